@@ -0,0 +1,4 @@
+import os
+
+# The viewer benchmarks create Qt widgets, which should not need a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
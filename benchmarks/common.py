@@ -0,0 +1,68 @@
+"""
+Synthetic datasets and viewers shared by the benchmarks.
+"""
+
+import numpy as np
+
+from glue.core import Data
+from glue.core.component import CategoricalComponent, Component
+
+# From the size of the penguins dataset the tests use, to what a viewer
+# should still cope with
+SIZES = [10**4, 10**5, 10**6, 10**7]
+
+# Grids as "<rows>x<columns>", which are also readable as parameter names
+GRIDS = ["1x2", "3x3", "10x10"]
+
+
+def parse_grid(grid):
+    num_rows, num_cols = grid.split("x")
+    return int(num_rows), int(num_cols)
+
+
+def make_data(size, num_rows, num_cols, seed=0):
+    """
+    A dataset with ``size`` rows, two numeric columns ``x`` and ``y`` to
+    plot and two categorical columns ``col`` and ``row`` with ``num_cols``
+    and ``num_rows`` categories to facet on. The facets have different
+    sizes, as in real data.
+    """
+    rng = np.random.default_rng(seed)
+    components = {
+        "x": Component(rng.normal(size=size)),
+        "y": Component(rng.normal(size=size)),
+        "value": Component(rng.uniform(0, 100, size=size)),
+    }
+    for name, count in (("col", num_cols), ("row", num_rows)):
+        categories = np.array([f"{name}{i}" for i in range(count)])
+        weights = np.arange(1, count + 1, dtype=float)
+        codes = rng.choice(count, size=size, p=weights / weights.sum())
+        components[name] = CategoricalComponent(
+            categories[codes], categories=categories
+        )
+    return Data(label="synthetic", **components)
+
+
+def make_viewer(data, num_rows, num_cols):
+    """
+    A Qt small multiples viewer showing ``data`` in a ``num_rows`` x
+    ``num_cols`` grid, along with the glue application it is in. Close the
+    application when done so that it and its data are not kept around.
+    """
+    from glue_qt.app import GlueApplication
+    from glue_small_multiples.qt.viewer import SmallMultiplesViewer
+
+    app = GlueApplication()
+    app.data_collection.append(data)
+    viewer = app.new_data_viewer(SmallMultiplesViewer)
+    viewer.add_data(data)
+
+    state = viewer.state
+    state.max_num_rows = num_rows
+    state.max_num_cols = num_cols
+    state.x_att = data.id["x"]
+    state.y_att = data.id["y"]
+    state.col_facet_att = data.id["col"]
+    if num_rows > 1:
+        state.row_facet_att = data.id["row"]
+    return app, viewer
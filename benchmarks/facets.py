@@ -0,0 +1,47 @@
+from glue_small_multiples.facets import FacetBinning, FacetIndex, FacetOrder
+
+from .common import GRIDS, SIZES, make_data, parse_grid
+
+
+class FacetIndexSuite:
+    """
+    Building the facet index, which happens whenever the facet attributes
+    or their binning or ordering change.
+    """
+
+    params = [SIZES, GRIDS]
+    param_names = ["size", "grid"]
+
+    def setup(self, size, grid):
+        self.num_rows, self.num_cols = parse_grid(grid)
+        self.data = make_data(size, self.num_rows, self.num_cols)
+        self.row_att = self.data.id["row"] if self.num_rows > 1 else None
+
+    def time_categorical(self, size, grid):
+        FacetIndex(self.data, col_att=self.data.id["col"], row_att=self.row_att)
+
+    def time_binned(self, size, grid):
+        FacetIndex(
+            self.data,
+            col_att=self.data.id["x"],
+            col_binning=FacetBinning(mode="quantile", num_bins=self.num_cols),
+        )
+
+    def time_order_by_statistic(self, size, grid):
+        order = FacetOrder(mode="statistic", att=self.data.id["value"])
+        FacetIndex(
+            self.data,
+            col_att=self.data.id["col"],
+            row_att=self.row_att,
+            col_order=order,
+            row_order=order,
+        )
+
+    def time_subset_states(self, size, grid):
+        index = FacetIndex(self.data, col_att=self.data.id["col"], row_att=self.row_att)
+        for row in range(index.num_rows):
+            for col in range(index.num_cols):
+                self.data.get_mask(index.subset_state(row, col))
+
+    def peakmem_categorical(self, size, grid):
+        FacetIndex(self.data, col_att=self.data.id["col"], row_att=self.row_att)
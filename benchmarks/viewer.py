@@ -0,0 +1,95 @@
+from glue.core.roi import PolygonalROI, RectangularROI
+from glue.core.subset import RangeSubsetState
+
+from .common import GRIDS, SIZES, make_data, make_viewer, parse_grid
+
+
+class ViewerSuite:
+    """
+    The main operations of the Qt viewer once the data is faceted.
+    """
+
+    params = [SIZES, GRIDS]
+    param_names = ["size", "grid"]
+
+    def setup(self, size, grid):
+        num_rows, num_cols = parse_grid(grid)
+        self.data = make_data(size, num_rows, num_cols)
+        self.app, self.viewer = make_viewer(self.data, num_rows, num_cols)
+        self.state = self.viewer.state
+        self.layer_artist = self.viewer.layers[0]
+        self.subset_states = [
+            RangeSubsetState(-1, 1, self.data.id["x"]),
+            RangeSubsetState(0, 2, self.data.id["x"]),
+        ]
+        self.subset_group = self.app.data_collection.new_subset_group(
+            "benchmark", self.subset_states[0]
+        )
+        self.calls = 0
+        self.viewer.figure.canvas.draw()
+
+    def teardown(self, size, grid):
+        # Closing the application also closes the viewer
+        self.app.close()
+
+    def time_facets_changed(self, size, grid):
+        # Force the facet index to be rebuilt rather than reused
+        self.state.facet_index = None
+        self.state._facets_changed()
+
+    def time_subset_update(self, size, grid):
+        # Alternate between two selections so that every call is a change
+        self.calls += 1
+        self.subset_group.subset_state = self.subset_states[self.calls % 2]
+
+    def time_density_maps(self, size, grid):
+        self.layer_artist.compute_density_maps(
+            bins=(100, 100), range=((-4, 4), (-4, 4))
+        )
+
+    def time_apply_roi(self, size, grid):
+        self.viewer.apply_roi(RectangularROI(-1, 1, -1, 1), 0, 0)
+
+    def time_apply_polygon_roi(self, size, grid):
+        roi = PolygonalROI(vx=[-1, 1, 0.5, -0.5], vy=[-1, -1, 1, 0.5])
+        self.viewer.apply_roi(roi, 0, 0)
+
+    def time_apply_roi_broadcast(self, size, grid):
+        self.state.broadcast_roi = True
+        self.viewer.apply_roi(RectangularROI(-1, 1, -1, 1), 0, 0)
+        self.state.broadcast_roi = False
+
+    def time_draw(self, size, grid):
+        self.viewer.figure.canvas.draw()
+
+    def peakmem_draw(self, size, grid):
+        self.viewer.figure.canvas.draw()
+
+
+class SetAxesSuite:
+    """
+    Creating the facet artists for a new grid. Each sample starts from a
+    viewer without facet artists, so it is only run once per setup.
+    """
+
+    params = [SIZES, GRIDS]
+    param_names = ["size", "grid"]
+    number = 1
+    repeat = 5
+    warmup_time = 0
+
+    def setup(self, size, grid):
+        num_rows, num_cols = parse_grid(grid)
+        self.data = make_data(size, num_rows, num_cols)
+        self.app, self.viewer = make_viewer(self.data, num_rows, num_cols)
+        self.layer_artist = self.viewer.layers[0]
+        for sla in self.layer_artist.scatter_layer_artists:
+            self.layer_artist._remove_facet_artist(sla)
+        self.layer_artist.scatter_layer_artists = []
+
+    def teardown(self, size, grid):
+        # Closing the application also closes the viewer
+        self.app.close()
+
+    def time_set_axes(self, size, grid):
+        self.layer_artist._set_axes()
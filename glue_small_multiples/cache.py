@@ -0,0 +1,221 @@
+import weakref
+from collections import OrderedDict
+
+from glue.core.hub import HubListener
+from glue.core.message import (
+    ComponentsChangedMessage,
+    ExternallyDerivableComponentsChangedMessage,
+    NumericalDataChangedMessage,
+    SubsetUpdateMessage,
+)
+from glue.core.subset import Subset
+
+__all__ = ["LRUCache", "LayerCache", "SharedDataCache"]
+
+DEFAULT_MAX_BYTES = 64 * 1024**2
+
+
+def _nbytes(value):
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    return getattr(value, "nbytes", 0)
+
+
+class LRUCache:
+    """
+    A mapping which keeps its most recently used values within a memory
+    budget.
+
+    The size of each value is taken from its ``nbytes`` attribute (summed
+    over the items of lists and tuples), so this is intended for Numpy
+    arrays. Once the total size goes over ``max_bytes``,
+    the least recently used values are evicted. The number of cache hits and
+    misses in `get` are counted in ``hits`` and ``misses``.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum total size of the cached values, in bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Return the value for ``key`` and mark it as recently used, or return
+        ``default`` if it is not in the cache.
+        """
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._entries:
+            self.nbytes -= _nbytes(self._entries.pop(key))
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= _nbytes(evicted)
+
+    def clear(self):
+        """
+        Remove all values from the cache. The hit and miss counts are kept.
+        """
+        self._entries.clear()
+        self.nbytes = 0
+
+    def info(self):
+        """
+        A dictionary summarizing the cache usage.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class LayerCache(LRUCache, HubListener):
+    """
+    An `LRUCache` for values computed from a dataset or subset.
+
+    Once registered to a hub, the cache is cleared and its ``version`` is
+    incremented whenever the values of the dataset or the definition of the
+    subset change. Including ``version`` in cache keys ensures that values
+    computed from an older version are never returned.
+
+    Parameters
+    ----------
+    layer : `~glue.core.data.Data` or `~glue.core.subset.Subset`
+        The dataset or subset the cached values are computed from.
+    max_bytes : int, optional
+        The maximum total size of the cached values, in bytes.
+    """
+
+    def __init__(self, layer, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(max_bytes=max_bytes)
+        self.layer = layer
+        self.version = 0
+
+    @property
+    def data(self):
+        if isinstance(self.layer, Subset):
+            return self.layer.data
+        return self.layer
+
+    def register_to_hub(self, hub):
+        # We use a high priority so that the cache is invalidated before
+        # viewers react to the same message.
+        for message_class in (
+            NumericalDataChangedMessage,
+            ComponentsChangedMessage,
+            ExternallyDerivableComponentsChangedMessage,
+        ):
+            hub.subscribe(
+                self,
+                message_class,
+                handler=self.invalidate,
+                filter=self._is_data,
+                priority=1000,
+            )
+        if isinstance(self.layer, Subset):
+            hub.subscribe(
+                self,
+                SubsetUpdateMessage,
+                handler=self.invalidate,
+                filter=self._is_subset,
+                priority=1000,
+            )
+
+    def _is_data(self, message):
+        return message.data is self.data
+
+    def _is_subset(self, message):
+        return message.subset is self.layer and message.attribute != "style"
+
+    def invalidate(self, *args):
+        """
+        Clear the cache and increment ``version``.
+        """
+        self.version += 1
+        self.clear()
+
+
+class SharedDataCache(LayerCache):
+    """
+    A `LayerCache` for values computed from a dataset, shared by every layer
+    showing that dataset.
+
+    Use `acquire` rather than creating instances directly: it returns the
+    cache for the dataset, creating and registering it to the dataset's hub
+    if needed. Each call to `acquire` should be matched by a call to
+    `release`, and the cache is cleared and unregistered from the hub once
+    the last user releases it.
+
+    Parameters
+    ----------
+    data : `~glue.core.data.Data`
+        The dataset the cached values are computed from.
+    max_bytes : int, optional
+        The maximum total size of the cached values, in bytes.
+    """
+
+    _caches = weakref.WeakKeyDictionary()
+
+    def __init__(self, data, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(data, max_bytes=max_bytes)
+        self.users = 0
+        self._hub = None
+
+    @classmethod
+    def acquire(cls, data, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Return the cache for ``data`` and add a user to it.
+
+        ``max_bytes`` is only used if the cache does not exist yet.
+        """
+        cache = cls._caches.get(data)
+        if cache is None:
+            cache = cls._caches[data] = cls(data, max_bytes=max_bytes)
+            if data.hub is not None:
+                cache._hub = data.hub
+                cache.register_to_hub(data.hub)
+        cache.users += 1
+        return cache
+
+    def release(self):
+        """
+        Remove a user from the cache, and clear and unregister it once it has
+        no users left.
+        """
+        self.users -= 1
+        if self.users > 0:
+            return
+        if self._hub is not None:
+            self.unregister(self._hub)
+            self._hub = None
+        self.clear()
+        if self._caches.get(self.layer) is self:
+            del self._caches[self.layer]
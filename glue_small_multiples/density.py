@@ -0,0 +1,170 @@
+import numpy as np
+
+from glue.utils import categorical_ndarray, datetime64_to_mpl
+
+__all__ = ["histogram_values", "compute_facet_histogram", "compute_facet_aggregate"]
+
+STATISTICS = ["mean", "min", "max", "median"]
+
+
+def histogram_values(data, cid, indices=None):
+    """
+    The values of ``cid`` in ``data`` at ``indices`` (or all values if
+    ``indices`` is not given), converted to numbers in the same way as
+    `~glue.core.data.Data.compute_histogram` does.
+    """
+    values = data.get_data(cid)
+    if isinstance(values, categorical_ndarray):
+        values = values.codes
+    values = np.asarray(values).ravel()
+    if indices is not None:
+        values = values[indices]
+    if values.dtype.kind == "M":
+        values = datetime64_to_mpl(values)
+    return values
+
+
+def _bin_indices(values, value_range, nbins, log):
+    """
+    Find the bin of each value, returning the bin indices and a mask of the
+    values which fall inside the range. This follows the conventions of
+    `glue.utils.compute_histogram` (the upper edge is inclusive and NaN
+    values are dropped).
+    """
+    vmin, vmax = sorted(value_range)
+    keep = (values >= vmin) & (values <= vmax)
+    if log:
+        if vmin < 0 or vmax < 0:
+            return None, None
+        vmin, vmax = np.log10(vmin), np.log10(vmax)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = np.log10(values)
+    vmax += 10 * np.spacing(vmax)
+    with np.errstate(invalid="ignore"):
+        bins = ((values - vmin) * (nbins / (vmax - vmin))).astype(np.intp)
+    np.clip(bins, 0, nbins - 1, out=bins)
+    return bins, keep
+
+
+def _flat_bin_indices(data, slots, range, bins, log):
+    """
+    Find the flattened ``(slot, y, x)`` bin of each value. Returns the bin
+    indices of the values inside the range, and the mask of those values,
+    or ``(None, None)`` if the range is invalid for a log histogram.
+    """
+    ny, nx = bins
+    log = log or (False, False)
+
+    iy, keep_y = _bin_indices(data[0], range[0], ny, log[0])
+    ix, keep_x = _bin_indices(data[1], range[1], nx, log[1])
+    if iy is None or ix is None:
+        return None, None
+
+    keep = keep_y & keep_x
+    flat = (np.asarray(slots, dtype=np.intp) * ny + iy) * nx + ix
+    return flat[keep], keep
+
+
+def compute_facet_histogram(
+    data, slots, num_slots, range, bins, weights=None, log=None
+):
+    """
+    Compute a 2-d histogram for every facet in a single pass.
+
+    Parameters
+    ----------
+    data : list of `~numpy.ndarray`
+        The ``[y, x]`` values to histogram, following the order used by
+        `glue.utils.compute_histogram`.
+    slots : `~numpy.ndarray`
+        The facet slot (between 0 and ``num_slots - 1``) of each value.
+    num_slots : int
+        The number of facets.
+    range : list of tuple
+        The ``(min, max)`` of the histogram range for y and x.
+    bins : tuple of int
+        The number of bins in y and x.
+    weights : `~numpy.ndarray`, optional
+        The weights to assign to each value.
+    log : tuple of bool, optional
+        Whether to compute the histogram in log space along y and x.
+
+    Returns
+    -------
+    histogram : `~numpy.ndarray`
+        An array with shape ``(num_slots,) + bins``.
+    """
+    shape = (num_slots,) + tuple(bins)
+    flat, keep = _flat_bin_indices(data, slots, range, bins, log)
+    if flat is None:
+        return np.zeros(shape)
+    if weights is not None:
+        weights = weights[keep]
+    return np.bincount(flat, weights=weights, minlength=np.prod(shape)).reshape(
+        shape
+    )
+
+
+def compute_facet_aggregate(
+    data, slots, num_slots, range, bins, values, statistic="mean", log=None
+):
+    """
+    Compute the number of values and an aggregate of ``values`` in each bin
+    of a 2-d histogram for every facet, binning the data only once.
+
+    The parameters are the same as for `compute_facet_histogram`, with the
+    addition of:
+
+    values : `~numpy.ndarray`
+        The values to aggregate in each bin.
+    statistic : {'mean', 'min', 'max', 'median'}
+        The aggregate to compute. NaN values are ignored by ``'min'``,
+        ``'max'`` and ``'median'``, but propagate to ``'mean'`` as with
+        weighted histograms.
+
+    Returns
+    -------
+    count, aggregate : `~numpy.ndarray`
+        Arrays with shape ``(num_slots,) + bins``. The aggregate is NaN in
+        empty bins.
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"statistic should be one of {STATISTICS}")
+
+    shape = (num_slots,) + tuple(bins)
+    size = int(np.prod(shape))
+    flat, keep = _flat_bin_indices(data, slots, range, bins, log)
+    if flat is None:
+        return np.zeros(shape), np.full(shape, np.nan)
+
+    values = values[keep]
+    count = np.bincount(flat, minlength=size)
+
+    if statistic == "mean":
+        total = np.bincount(flat, weights=values, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            aggregate = total / count
+        return count.reshape(shape), aggregate.reshape(shape)
+
+    # For order statistics, sort the values by bin and then by value, so
+    # that each bin is a contiguous sorted run.
+    finite = ~np.isnan(values)
+    flat, values = flat[finite], values[finite]
+    order = np.lexsort((values, flat))
+    flat, values = flat[order], values[order]
+
+    aggregate = np.full(size, np.nan)
+    if len(flat) > 0:
+        starts = np.flatnonzero(np.concatenate([[True], flat[1:] != flat[:-1]]))
+        lengths = np.diff(np.append(starts, len(flat)))
+        if statistic == "min":
+            result = values[starts]
+        elif statistic == "max":
+            result = values[starts + lengths - 1]
+        else:
+            result = 0.5 * (
+                values[starts + (lengths - 1) // 2] + values[starts + lengths // 2]
+            )
+        aggregate[flat[starts]] = result
+
+    return count.reshape(shape), aggregate.reshape(shape)
@@ -0,0 +1,572 @@
+import operator
+from collections.abc import Sequence
+from functools import reduce
+
+import numpy as np
+
+from glue.core.subset import CategorySubsetState, RangeSubsetState
+from glue.utils import ensure_numerical
+
+__all__ = [
+    "BIN_MODES",
+    "ORDER_MODES",
+    "ORDER_STATISTICS",
+    "FacetBinning",
+    "FacetOrder",
+    "FacetIndex",
+    "FacetMaskGrid",
+]
+
+BIN_MODES = ["equal", "quantile", "edges"]
+ORDER_MODES = ["default", "alphabetical", "count", "statistic"]
+ORDER_STATISTICS = ["mean", "sum", "min", "max"]
+
+# The label of the facet grouping the categories beyond FacetOrder.top_k
+OTHER_LABEL = "Other"
+
+
+class FacetBinning:
+    """
+    How to split a numeric facet attribute into bins.
+
+    Every value is assigned to its bin with a single `~numpy.searchsorted`
+    pass over the data. Bins include their lower edge, and the last bin also
+    includes its upper edge. Values outside the edges (and NaN values) do
+    not belong to any bin. Datetime values are binned on their integer
+    representation, so the edges keep the datetime type.
+
+    Parameters
+    ----------
+    mode : {'equal', 'quantile', 'edges'}
+        Whether to use bins of equal width between the minimum and maximum
+        values, bins containing roughly the same number of values, or the
+        bins given by ``edges``.
+    num_bins : int
+        The number of bins for the ``'equal'`` and ``'quantile'`` modes. The
+        ``'quantile'`` mode can give fewer bins if quantiles are repeated.
+    edges : sequence, optional
+        The bin edges for the ``'edges'`` mode.
+    sample_size : int
+        The quantiles are estimated from a random sample of at most this many
+        values, so that setting up the bins stays fast for large datasets.
+    """
+
+    def __init__(self, mode="equal", num_bins=5, edges=None, sample_size=100_000):
+        if mode not in BIN_MODES:
+            raise ValueError(f"mode should be one of {BIN_MODES}")
+        self.mode = mode
+        self.num_bins = int(num_bins)
+        self.edges = None if edges is None else tuple(edges)
+        self.sample_size = sample_size
+
+    def __eq__(self, other):
+        return isinstance(other, FacetBinning) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        return (self.mode, self.num_bins, self.edges, self.sample_size)
+
+    def bin(self, values):
+        """
+        Return the bin of each of ``values`` (-1 for values not in any bin)
+        and the bin edges.
+        """
+        values = np.asarray(values).ravel()
+        if values.dtype.kind == "M":
+            ints = values.view(np.int64)
+            valid = ~np.isnat(values)
+            if self.mode == "edges":
+                edges = np.asarray(self.edges, dtype=values.dtype).view(np.int64)
+            else:
+                edges = self._compute_edges(ints[valid].astype(float))
+                edges = np.unique(np.round(edges).astype(np.int64))
+            codes = _digitize(ints, edges)
+            codes[~valid] = -1
+            return codes, edges.view(values.dtype)
+
+        values = values.astype(float, copy=False)
+        if self.mode == "edges":
+            edges = np.asarray(self.edges, dtype=float)
+        else:
+            edges = self._compute_edges(values)
+        return _digitize(values, edges), edges
+
+    def _compute_edges(self, values):
+        with np.errstate(invalid="ignore"):
+            if values.size == 0 or np.all(np.isnan(values)):
+                return np.zeros(0)
+            vmin, vmax = np.nanmin(values), np.nanmax(values)
+        if vmin == vmax:
+            return np.array([vmin, vmax])
+        if self.mode == "equal":
+            return np.linspace(vmin, vmax, self.num_bins + 1)
+
+        # Estimate the quantiles from a sample (drawn with replacement, which
+        # is much faster than without for large arrays), then extend the
+        # outer edges to the actual extremes of the data.
+        if values.size > self.sample_size:
+            rng = np.random.default_rng(0)
+            values = values[rng.integers(0, values.size, self.sample_size)]
+        edges = np.nanquantile(values, np.linspace(0, 1, self.num_bins + 1))
+        edges[0], edges[-1] = vmin, vmax
+        return np.unique(edges)
+
+
+def _digitize(values, edges):
+    if len(edges) < 2:
+        return np.full(values.shape, -1, dtype=np.intp)
+    if np.any(np.diff(edges) <= 0):
+        raise ValueError("bin edges should be increasing")
+    codes = np.searchsorted(edges[1:-1], values, side="right")
+    with np.errstate(invalid="ignore"):
+        codes[~((values >= edges[0]) & (values <= edges[-1]))] = -1
+    return codes
+
+
+def _format_edge(value):
+    if isinstance(value, np.datetime64):
+        return str(value)
+    return f"{value:.6g}"
+
+
+def _bin_labels(edges):
+    return [
+        f"[{_format_edge(lo)}, {_format_edge(hi)}" + ("]" if i == len(edges) - 2 else ")")
+        for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:]))
+    ]
+
+
+class FacetOrder:
+    """
+    How to order the categories (or bins) of a facet attribute, and
+    optionally how many of them to show.
+
+    Orderings are computed from one `~numpy.bincount` (or grouped reduction)
+    over the category codes, so they are cheap even for attributes with many
+    categories.
+
+    Parameters
+    ----------
+    mode : {'default', 'alphabetical', 'count', 'statistic'}
+        Whether to keep the order of the categories (or bins), sort them
+        alphabetically, or put the categories with the most elements or the
+        largest ``statistic`` of ``att`` first. Bins of numeric attributes
+        are never sorted alphabetically.
+    att : `~glue.core.component_id.ComponentID`, optional
+        The attribute to compute the statistic of, for the ``'statistic'``
+        mode.
+    statistic : {'mean', 'sum', 'min', 'max'}
+        The statistic of ``att`` to order by.
+    top_k : int, optional
+        If given, only the first ``top_k`` categories get their own facet and
+        the others are grouped in a single "Other" facet.
+    """
+
+    def __init__(self, mode="default", att=None, statistic="mean", top_k=None):
+        if mode not in ORDER_MODES:
+            raise ValueError(f"mode should be one of {ORDER_MODES}")
+        if statistic not in ORDER_STATISTICS:
+            raise ValueError(f"statistic should be one of {ORDER_STATISTICS}")
+        if mode == "statistic" and att is None:
+            raise ValueError("att is needed to order by a statistic")
+        self.mode = mode
+        self.att = att
+        self.statistic = statistic
+        self.top_k = None if top_k is None else int(top_k)
+
+    def __eq__(self, other):
+        return isinstance(other, FacetOrder) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        # ComponentID overloads ==, so we compare attributes by UUID
+        return (self.mode, getattr(self.att, "uuid", None), self.statistic, self.top_k)
+
+    def order(self, data, codes, labels, sortable=True):
+        """
+        The category indices in the order they should be shown.
+
+        Parameters
+        ----------
+        data : `~glue.core.data.Data`
+            The dataset being faceted.
+        codes : `~numpy.ndarray`
+            The category code of each element (negative if missing).
+        labels : list
+            The category labels.
+        sortable : bool
+            Whether the categories can be sorted alphabetically.
+        """
+        num_categories = len(labels)
+        if self.mode == "default" or (self.mode == "alphabetical" and not sortable):
+            return np.arange(num_categories)
+        if self.mode == "alphabetical":
+            return np.argsort(np.array([str(label) for label in labels]), kind="stable")
+
+        valid = codes >= 0
+        codes = codes[valid].astype(np.intp)
+        counts = np.bincount(codes, minlength=num_categories)
+        if self.mode == "count":
+            return np.argsort(-counts, kind="stable")
+
+        values = ensure_numerical(data[self.att]).ravel()[valid].astype(float)
+        finite = ~np.isnan(values)
+        codes, values = codes[finite], values[finite]
+        if self.statistic in ("mean", "sum"):
+            result = np.bincount(codes, weights=values, minlength=num_categories)
+            if self.statistic == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result /= np.bincount(codes, minlength=num_categories)
+        else:
+            result = np.full(num_categories, np.nan)
+            reduce = np.fmin if self.statistic == "min" else np.fmax
+            reduce.at(result, codes, values)
+        # Largest first, and categories without a value last
+        return np.argsort(np.where(np.isnan(result), np.inf, -result), kind="stable")
+
+
+class _FacetAxis:
+    """
+    The facets along one axis of a `FacetIndex`, in the order they are shown.
+
+    Each facet has a list of ``members``, the indices of the categories (or
+    bins) of the attribute it contains. This is a single category, except
+    for the "Other" facet used with `FacetOrder.top_k`.
+    """
+
+    def __init__(self, data, att=None, binning=None, ordering=None):
+        self.data = data
+        self.att = att
+        self.edges = None
+
+        if att is None:
+            self.codes = None
+            self.labels = [None]
+            self.categories = [None]
+            self.members = [[0]]
+            return
+
+        component = data.get_component(att)
+        if component.categorical:
+            codes = component.codes.ravel()
+            self.labels = list(component.categories)
+        else:
+            codes, self.edges = (binning or FacetBinning()).bin(component.data)
+            self.labels = _bin_labels(self.edges)
+
+        ordering = ordering or FacetOrder()
+        order = ordering.order(data, codes, self.labels, sortable=self.edges is None)
+        top_k = ordering.top_k
+        if top_k is not None and top_k < len(order):
+            self.members = [[i] for i in order[:top_k]] + [list(order[top_k:])]
+        else:
+            self.members = [[i] for i in order]
+        self.categories = [
+            self.labels[members[0]] if len(members) == 1 else OTHER_LABEL
+            for members in self.members
+        ]
+
+        # Renumber the codes so that they follow the order of the facets. The
+        # lookup table ends with -1, so that missing codes (-1) stay missing.
+        if any(members != [i] for i, members in enumerate(self.members)):
+            lookup = np.full(len(self.labels) + 1, -1, dtype=np.intp)
+            for facet, members in enumerate(self.members):
+                lookup[members] = facet
+            codes = lookup[codes.astype(np.intp)]
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.members)
+
+    def subset_state(self, i):
+        members = self.members[i]
+        if self.edges is None:
+            if len(members) == 1:
+                return self.data.id[self.att] == self.labels[members[0]]
+            return CategorySubsetState(self.att, members)
+        return reduce(operator.or_, [self._range_state(member) for member in members])
+
+    def _range_state(self, i):
+        # RangeSubsetState includes both limits, so we use the value just
+        # below the upper edge for all but the last bin.
+        lo, hi = self.edges[i], self.edges[i + 1]
+        if i < len(self.edges) - 2:
+            if isinstance(hi, np.datetime64):
+                hi = hi - np.timedelta64(1, np.datetime_data(hi.dtype)[0])
+            else:
+                hi = np.nextafter(hi, -np.inf)
+        return RangeSubsetState(lo, hi, att=self.att)
+
+    def key(self, i):
+        members = self.members[i]
+        if self.edges is None:
+            categories = tuple(self.labels[member] for member in members)
+        else:
+            categories = tuple(
+                (self.edges[member], self.edges[member + 1]) for member in members
+            )
+        return (getattr(self.att, "uuid", None), categories)
+
+    def label(self, i):
+        members = self.members[i]
+        if len(members) > 1:
+            return f"{self.att.label} = {OTHER_LABEL}"
+        member = members[0]
+        if self.edges is None:
+            return f"{self.att.label} = {self.labels[member]}"
+        upper = "<=" if member == len(self.edges) - 2 else "<"
+        return (
+            f"{_format_edge(self.edges[member])} <= {self.att.label} {upper} "
+            f"{_format_edge(self.edges[member + 1])}"
+        )
+
+
+class FacetIndex:
+    """
+    An index of which facet (panel) each element of a dataset belongs to.
+
+    The categorical codes of the row and column facet attributes are read
+    once and combined into a single panel code per element
+    (``row_code * num_cols + col_code``). One `~numpy.bincount` gives the
+    number of elements in each panel and one stable `~numpy.argsort` groups
+    the elements by panel, so that the members of any panel are a contiguous
+    slice of ``order``.
+
+    The index covers every category of the facet attributes, not just the
+    ones that fit in the grid being displayed. Elements with a missing
+    category do not belong to any panel. Numeric attributes are split into
+    bins, which then behave like categories. The categories can be
+    reordered, and the smallest grouped into a single "Other" facet, by
+    renumbering the codes before they are combined.
+
+    Membership is stored compactly: one panel code per element using the
+    smallest unsigned integer type that fits, plus the grouping permutation,
+    so memory use does not grow with the number of panels. Per-panel masks
+    are only built when asked for.
+
+    Parameters
+    ----------
+    data : `~glue.core.data.Data`
+        The dataset being faceted.
+    col_att : `~glue.core.component_id.ComponentID`, optional
+        The categorical attribute to facet columns by.
+    row_att : `~glue.core.component_id.ComponentID`, optional
+        The categorical attribute to facet rows by.
+    col_binning, row_binning : `FacetBinning`, optional
+        How to bin the column and row attributes if they are numeric. By
+        default, numeric attributes are split into 5 bins of equal width.
+    col_order, row_order : `FacetOrder`, optional
+        How to order the column and row categories. By default, categories
+        are kept in their original order.
+    """
+
+    def __init__(
+        self,
+        data,
+        col_att=None,
+        row_att=None,
+        col_binning=None,
+        row_binning=None,
+        col_order=None,
+        row_order=None,
+    ):
+        self.data = data
+        self.col_att = col_att
+        self.row_att = row_att
+
+        self._col = _FacetAxis(data, col_att, binning=col_binning, ordering=col_order)
+        self._row = _FacetAxis(data, row_att, binning=row_binning, ordering=row_order)
+        col_codes, row_codes = self._col.codes, self._row.codes
+
+        self.col_categories = self._col.categories
+        self.row_categories = self._row.categories
+        self.col_edges = self._col.edges
+        self.row_edges = self._row.edges
+
+        self.num_cols = len(self.col_categories)
+        self.num_rows = len(self.row_categories)
+        self.num_panels = self.num_rows * self.num_cols
+
+        # Elements that are not in any panel get the code num_panels, which
+        # sorts them after every real panel. The codes are accumulated in
+        # place so that we never hold a full-length int64 temporary.
+        panel_codes = np.zeros(data.size, dtype=np.min_scalar_type(self.num_panels))
+        invalid = np.zeros(data.size, dtype=bool)
+        with np.errstate(invalid="ignore"):
+            if row_codes is not None:
+                np.multiply(row_codes, self.num_cols, out=panel_codes, casting="unsafe")
+                invalid |= row_codes < 0
+            if col_codes is not None:
+                np.add(panel_codes, col_codes, out=panel_codes, casting="unsafe")
+                invalid |= col_codes < 0
+        panel_codes[invalid] = self.num_panels
+        del invalid
+        self.panel_codes = panel_codes
+        self._col.codes = self._row.codes = None
+
+        self.counts = np.bincount(panel_codes, minlength=self.num_panels + 1)[
+            : self.num_panels
+        ]
+        self.offsets = np.zeros(self.num_panels + 1, dtype=np.intp)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+        # A stable sort of small unsigned integers is a radix sort in Numpy
+        order = np.argsort(panel_codes, kind="stable")
+        if data.size <= np.iinfo(np.uint32).max:
+            order = order.astype(np.uint32)
+        self.order = order
+
+    def _axes(self, row, col):
+        return ((self._row, row), (self._col, col))
+
+    def panel(self, row, col):
+        """
+        The panel code for the facet at ``row`` and ``col``.
+        """
+        return row * self.num_cols + col
+
+    def count(self, row, col):
+        """
+        The number of elements in the facet at ``row`` and ``col``.
+        """
+        return int(self.counts[self.panel(row, col)])
+
+    def indices(self, row, col):
+        """
+        The indices of the elements in the facet at ``row`` and ``col``, in
+        ascending order. This is a view into ``order``, not a copy.
+        """
+        panel = self.panel(row, col)
+        return self.order[self.offsets[panel]: self.offsets[panel + 1]]
+
+    def mask(self, row, col):
+        """
+        A boolean array which is `True` for elements in the facet at ``row``
+        and ``col``.
+        """
+        return self.panel_codes == self.panel(row, col)
+
+    def subset_state(self, row, col):
+        """
+        A subset state selecting the facet at ``row`` and ``col``.
+        """
+        states = [
+            axis.subset_state(i) for axis, i in self._axes(row, col) if axis.att is not None
+        ]
+        if len(states) == 1:
+            return states[0]
+        return states[0] & states[1]
+
+    def key(self, row, col):
+        """
+        A hashable key identifying the facet at ``row`` and ``col`` by its
+        attributes and categories (or bin edges) rather than its position,
+        so the same facet can be recognized in a different index or grid.
+        """
+        return tuple(axis.key(i) for axis, i in self._axes(row, col))
+
+    def limits(self, values, percentile=100, mask=None):
+        """
+        The lower and upper limits of ``values`` in every panel, as two
+        arrays indexed by panel code.
+
+        With a ``percentile`` of 100 the limits are the minimum and maximum,
+        otherwise they are the ``(100 - percentile) / 2`` and
+        ``(100 + percentile) / 2`` percentiles (interpolated linearly, as in
+        `numpy.percentile`), in the same way as colormap limits in glue. NaN
+        values, and elements where ``mask`` is `False`, are ignored. Panels
+        without any values get NaN limits.
+
+        All the panels are computed in one pass: the values are grouped by
+        panel with ``order``, and for percentiles sorted within their panel
+        with a single sort.
+        """
+        members = self.order[: self.offsets[-1]]
+        grouped = np.asarray(values, dtype=float)[members]
+        if mask is not None:
+            grouped[~mask[members]] = np.nan
+
+        lower = np.full(self.num_panels, np.nan)
+        upper = np.full(self.num_panels, np.nan)
+        panels = np.flatnonzero(self.counts)
+        if len(panels) == 0:
+            return lower, upper
+        starts = self.offsets[panels]
+
+        if percentile >= 100:
+            lower[panels] = np.fmin.reduceat(grouped, starts)
+            upper[panels] = np.fmax.reduceat(grouped, starts)
+            return lower, upper
+
+        # NaN values are sorted after the others within each panel
+        slots = np.repeat(np.arange(self.num_panels), self.counts)
+        grouped = grouped[np.lexsort((grouped, slots))]
+        valid = np.add.reduceat(~np.isnan(grouped), starts)
+        panels, starts, valid = panels[valid > 0], starts[valid > 0], valid[valid > 0]
+        fraction = (100 - percentile) / 200
+        for limits, q in ((lower, fraction), (upper, 1 - fraction)):
+            position = (valid - 1) * q
+            below = np.floor(position).astype(np.intp)
+            above = np.minimum(below + 1, valid - 1)
+            weight = position - below
+            limits[panels] = (
+                grouped[starts + below] * (1 - weight) + grouped[starts + above] * weight
+            )
+        return lower, upper
+
+    def label(self, row, col):
+        """
+        A human-readable description of the facet at ``row`` and ``col``.
+        """
+        return " and ".join(
+            axis.label(i) for axis, i in self._axes(row, col) if axis.att is not None
+        )
+
+
+class FacetMaskGrid(Sequence):
+    """
+    A lazy ``num_rows`` x ``num_cols`` grid of facet masks.
+
+    ``grid[row][col]`` is a boolean array which is `True` for elements that
+    are *not* in the facet at ``row`` and ``col`` (i.e. suitable for
+    `numpy.ma.masked_where`). Masks are computed from the facet index on
+    each access and are not kept around. ``row_offset`` and ``col_offset``
+    give the position in the facet index of the first row and column of the
+    grid, when the grid only shows a page of the facets.
+    """
+
+    def __init__(self, facet_index, num_rows, num_cols, row_offset=0, col_offset=0):
+        self.facet_index = facet_index
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.row_offset = row_offset
+        self.col_offset = col_offset
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.num_rows:
+            raise IndexError("facet row out of range")
+        return _FacetMaskRow(self, row)
+
+
+class _FacetMaskRow(Sequence):
+    def __init__(self, grid, row):
+        self._grid = grid
+        self._row = row
+
+    def __len__(self):
+        return self._grid.num_cols
+
+    def __getitem__(self, col):
+        if not 0 <= col < self._grid.num_cols:
+            raise IndexError("facet column out of range")
+        grid = self._grid
+        return ~grid.facet_index.mask(
+            self._row + grid.row_offset, col + grid.col_offset
+        )
@@ -0,0 +1,328 @@
+"""
+Opt-in instrumentation of the hot paths of the viewer.
+
+The viewer state, layer artists and viewers record how long each phase of
+an update takes (building the facet index, evaluating subsets, selecting
+the points of each facet, creating artists, updating their appearance,
+drawing), how many points each phase processed, cache hits and misses and
+redraw counts. Nothing is recorded unless instrumentation is enabled::
+
+    from glue_small_multiples import instrumentation
+
+    with instrumentation.recording(trace=True) as recorder:
+        viewer.state.col_facet_att = data.id["species"]
+        viewer.figure.canvas.draw()
+
+    recorder.phase_stats("set_axes")
+    recorder.export_trace("trace.json")  # for chrome://tracing or Perfetto
+
+When instrumentation is disabled, `phase` returns a shared no-op context
+manager and `count` returns straight away, so instrumented code only pays
+for checking a global flag.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+__all__ = [
+    "Recorder",
+    "enable",
+    "disable",
+    "is_enabled",
+    "get_recorder",
+    "recording",
+    "phase",
+    "count",
+    "timed",
+]
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of trace events kept, so that tracing a long session
+# does not use an unbounded amount of memory. Older events are dropped.
+DEFAULT_MAX_EVENTS = 100_000
+
+_recorder = None
+
+
+class Recorder:
+    """
+    Collects the timings and counters recorded while instrumentation is
+    enabled.
+
+    Parameters
+    ----------
+    trace : bool
+        Whether to keep every phase as an event that can be written out with
+        `export_trace`, rather than only the totals.
+    log : bool
+        Whether to also emit each phase as a JSON log record at the DEBUG
+        level of the ``glue_small_multiples.instrumentation`` logger.
+    max_events : int
+        The maximum number of trace events to keep.
+    """
+
+    def __init__(self, trace=False, log=False, max_events=DEFAULT_MAX_EVENTS):
+        self.trace = trace
+        self.log = log
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._phases = {}
+        self._counters = {}
+        self._events = deque(maxlen=max_events)
+
+    def add_phase(self, name, start, duration, points=0):
+        """
+        Record that phase ``name`` started at ``start`` (from
+        `time.perf_counter`), took ``duration`` seconds and processed
+        ``points`` points.
+        """
+        with self._lock:
+            stats = self._phases.get(name)
+            if stats is None:
+                stats = self._phases[name] = {
+                    "calls": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "points": 0,
+                }
+            stats["calls"] += 1
+            stats["total"] += duration
+            stats["max"] = max(stats["max"], duration)
+            stats["points"] += points
+            if self.trace:
+                self._events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": (start - self._start) * 1e6,
+                        "dur": duration * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": {"points": points},
+                    }
+                )
+        if self.log:
+            logger.debug(
+                json.dumps({"phase": name, "duration": duration, "points": points})
+            )
+
+    def add_count(self, name, value=1):
+        """
+        Add ``value`` to the counter ``name``.
+        """
+        with self._lock:
+            total = self._counters[name] = self._counters.get(name, 0) + value
+            if self.trace:
+                self._events.append(
+                    {
+                        "name": name,
+                        "ph": "C",
+                        "ts": (time.perf_counter() - self._start) * 1e6,
+                        "pid": os.getpid(),
+                        "args": {name: total},
+                    }
+                )
+
+    def phase_stats(self, name):
+        """
+        The ``calls``, ``total`` and ``max`` time in seconds and ``points``
+        recorded for phase ``name``, along with the ``mean`` time per call.
+        All are zero if the phase was not recorded.
+        """
+        with self._lock:
+            stats = dict(
+                self._phases.get(name, {"calls": 0, "total": 0.0, "max": 0.0, "points": 0})
+            )
+        stats["mean"] = stats["total"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+    def counter(self, name):
+        """
+        The value of the counter ``name``, zero if it was not recorded.
+        """
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    @property
+    def phases(self):
+        """
+        The names of the phases that were recorded.
+        """
+        with self._lock:
+            return sorted(self._phases)
+
+    @property
+    def counters(self):
+        """
+        A copy of all the counters.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def summary(self):
+        """
+        All the phase statistics and counters, as a dictionary which can be
+        serialized to JSON.
+        """
+        return {
+            "phases": {name: self.phase_stats(name) for name in self.phases},
+            "counters": self.counters,
+        }
+
+    def events(self):
+        """
+        The trace events, in the Chrome trace event format.
+        """
+        with self._lock:
+            return list(self._events)
+
+    def export_trace(self, filename):
+        """
+        Write the trace events to ``filename`` as JSON in the Chrome trace
+        event format, which can be opened in ``chrome://tracing`` or
+        Perfetto. Only available if the recorder was created with
+        ``trace=True``.
+        """
+        if not self.trace:
+            raise ValueError("The recorder was not created with trace=True")
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": self.events(), "otherData": self.summary()}, f)
+
+    def reset(self):
+        """
+        Forget everything that was recorded.
+        """
+        with self._lock:
+            self._start = time.perf_counter()
+            self._phases.clear()
+            self._counters.clear()
+            self._events.clear()
+
+
+def enable(trace=False, log=False, max_events=DEFAULT_MAX_EVENTS):
+    """
+    Start recording into a new `Recorder`, which is returned.
+    """
+    global _recorder
+    _recorder = Recorder(trace=trace, log=log, max_events=max_events)
+    return _recorder
+
+
+def disable():
+    """
+    Stop recording. Returns the `Recorder` that was in use, if any.
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def get_recorder():
+    """
+    The `Recorder` in use, or `None` if instrumentation is disabled.
+    """
+    return _recorder
+
+
+@contextmanager
+def recording(trace=False, log=False, max_events=DEFAULT_MAX_EVENTS):
+    """
+    Record for the duration of the ``with`` block, and restore the previous
+    recorder (if any) afterwards.
+    """
+    global _recorder
+    previous = _recorder
+    recorder = enable(trace=trace, log=log, max_events=max_events)
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+
+class _Phase:
+    __slots__ = ("recorder", "name", "points", "start")
+
+    def __init__(self, recorder, name, points):
+        self.recorder = recorder
+        self.name = name
+        self.points = points
+
+    def add_points(self, points):
+        self.points += int(points)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_phase(
+            self.name, self.start, time.perf_counter() - self.start, self.points
+        )
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def add_points(self, points):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name, points=0):
+    """
+    A context manager timing the phase ``name``. Points processed can be
+    given up front or added with ``add_points`` on the object returned by
+    the ``with`` statement.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_PHASE
+    return _Phase(recorder, name, int(points))
+
+
+def count(name, value=1):
+    """
+    Add ``value`` to the counter ``name``.
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.add_count(name, value)
+
+
+def timed(name):
+    """
+    Decorator recording each call to the decorated function as phase
+    ``name``.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return func(*args, **kwargs)
+            with _Phase(recorder, name, 0):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,14 +1,27 @@
+import warnings
+import weakref
+from contextlib import ExitStack
+
 import numpy as np
-from echo import keep_in_sync
+from echo import delay_callback
 
 from glue.core import Subset
 from glue.utils import defer_draw, ensure_numerical
 from glue.core.exceptions import IncompatibleAttribute
 
 from glue.viewers.matplotlib.layer_artist import MatplotlibLayerArtist
-from glue.viewers.scatter.layer_artist import ScatterLayerArtist
+from glue.viewers.scatter.layer_artist import DensityMapLimits, ScatterLayerArtist
 from glue.viewers.scatter.layer_artist import set_mpl_artist_cmap
+from matplotlib.colors import Normalize
 
+from glue_small_multiples import instrumentation
+from glue_small_multiples.cache import LayerCache, SharedDataCache
+from glue_small_multiples.density import (
+    compute_facet_aggregate,
+    compute_facet_histogram,
+    histogram_values,
+)
+from glue_small_multiples.parallel import map_facets, split_chunks
 from glue_small_multiples.utils import PanTrackerMixin
 from glue_small_multiples.state import SmallMultiplesLayerState, FacetScatterLayerState
 
@@ -21,6 +34,9 @@ MARKER_PROPERTIES = set(
     ["size_mode", "size_att", "size_vmin", "size_vmax", "size_scaling", "size", "fill"]
 )
 LINE_PROPERTIES = set(["linewidth", "linestyle"])
+# Properties of SmallMultiplesLayerState which change the colormap limits of
+# each facet
+CMAP_NORMALIZATION_PROPERTIES = set(["cmap_normalization", "cmap_facet_percentile"])
 DENSITY_PROPERTIES = set(["dpi", "stretch", "density_contrast"])
 VISUAL_PROPERTIES = (
     CMAP_PROPERTIES
@@ -30,6 +46,20 @@ VISUAL_PROPERTIES = (
     | set(["color", "alpha", "zorder", "visible"])
 )
 
+# The memory budget for the columns read from each dataset, shared by all the
+# layers showing it. Columns larger than this are read again each time they
+# are needed rather than cached.
+COLUMN_CACHE_MAX_BYTES = 512 * 1024**2
+
+# The properties of SmallMultiplesLayerState that are copied to every facet
+SYNC_PROPERTIES = (
+    CMAP_PROPERTIES
+    | MARKER_PROPERTIES
+    | LINE_PROPERTIES
+    | set(["color", "alpha", "zorder", "visible"])
+    | set(["points_mode", "density_threshold", "stretch", "density_contrast"])
+)
+
 DATA_PROPERTIES = set(
     [
         "layer",
@@ -55,6 +85,16 @@ DATA_PROPERTIES = set(
     ]
 )
 
+# Viewer state properties which change which facets are shown in the grid
+FACET_PROPERTIES = set(
+    ["col_facet_att", "row_facet_att", "num_rows", "num_cols", "order_att", "order_statistic"]
+    + [
+        f"{axis}_{prop}"
+        for axis in ("col", "row")
+        for prop in ("page", "bin_mode", "num_bins", "bin_edges", "order", "top_k")
+    ]
+)
+
 
 class SmallMultiplesLayerArtist(MatplotlibLayerArtist, PanTrackerMixin):
     """ """
@@ -63,65 +103,604 @@ class SmallMultiplesLayerArtist(MatplotlibLayerArtist, PanTrackerMixin):
 
     def __init__(self, axes, viewer_state, layer_state=None, layer=None):
         super().__init__(axes, viewer_state, layer_state=layer_state, layer=layer)
+        # The axes all share one canvas, which is what pan tracking listens to
+        self.init_pan_tracking(axes.flat[0])
         self.scatter_layer_artists = []
-        self.scatter_layer_artists_syncs = []
         self.axes_subplots = None
+        self._subset_mask = None
+        self._subset_mask_state = None
+        self._density_maps = None
+        self._density_max = (None, None)
+        self._marker_styles = {}
+
+        # Density maps for the whole grid, keyed on everything they depend on
+        self.density_cache = LayerCache(self.layer)
+        # Columns of the dataset, shared by all facets and by all the layers
+        # showing the dataset. They only depend on the dataset, so changes to
+        # a subset's definition keep them.
+        self.column_cache = SharedDataCache.acquire(
+            self.density_cache.data, max_bytes=COLUMN_CACHE_MAX_BYTES
+        )
+        self._column_cache_released = False
+        if self.layer.hub is not None:
+            self.density_cache.register_to_hub(self.layer.hub)
 
         self._viewer_state.add_global_callback(self._update_scatter)
         self.state.add_global_callback(self._update_scatter)
+        self.state.add_global_callback(self._broadcast_state)
 
+    @instrumentation.timed("set_axes")
     def _set_axes(self):
-        # import ipdb; ipdb.set_trace()
+        """
+        Reconcile the facet artists with the current grid.
+
+        Facets are identified by their attributes and categories, so a facet
+        that is still shown after the facet index or grid changed keeps its
+        artist and state, and is only pointed at its new axes and members.
+        Artists are only created or removed for facets that appear or
+        disappear.
+        """
         if self._viewer_state.axes_subplots is not None:
             self.axes_subplots = self._viewer_state.axes_subplots
 
         if self.axes_subplots is None:
             return
 
-        for sla in self.scatter_layer_artists:
-            self._viewer_state.layers.remove(sla.state)
-            sla.clear()
-            sla.remove()
+        self._marker_styles = {}
+        facet_index = self._viewer_state.facet_index
+        facet_masks = self._viewer_state.data_facet_masks
+        if facet_index is None or self.axes_subplots.shape != (
+            len(facet_masks),
+            len(facet_masks[0]) if facet_masks else 0,
+        ):
+            for sla in self.scatter_layer_artists:
+                self._remove_facet_artist(sla)
+            self.scatter_layer_artists = []
+            return
+
+        # When the grid shows a page of the facets, the facet row and column
+        # in the facet index are offset from the position in the grid.
+        existing = {sla.facet_key: sla for sla in self.scatter_layer_artists}
+        cells = []
+        for grid_row, grid_col in np.ndindex(self.axes_subplots.shape):
+            row, col = self._viewer_state.facet_cell(grid_row, grid_col)
+            ax = self.axes_subplots[grid_row, grid_col]
+            sla = existing.pop(facet_index.key(row, col), None)
+            # Facets that stay on the same axes with the same members can be
+            # left alone entirely.
+            if (
+                sla is not None
+                and sla.axes is ax
+                and sla.facet_index is facet_index
+            ):
+                sla.facet_row, sla.facet_col = row, col
+                cells.append((ax, row, col, sla, False))
+            else:
+                cells.append((ax, row, col, sla, True))
+
+        for sla in existing.values():
+            self._remove_facet_artist(sla)
+
+        changed = [(row, col) for _, row, col, _, change in cells if change]
+        facet_data = dict(
+            zip(
+                changed,
+                self._prepare_facet_data(
+                    [(facet_index, row, col) for row, col in changed]
+                ),
+            )
+        )
 
         self.scatter_layer_artists = []
-        self.scatter_layer_artists_syncs = []
-
-        flat_axes = self.axes_subplots.flatten()
-        flat_facet_masks = [
-            item for sublist in self._viewer_state.data_facet_masks for item in sublist
-        ]
-        flat_facet_subsets = [
-            item
-            for sublist in self._viewer_state.data_facet_subsets
-            for item in sublist
-        ]
-        if len(flat_axes) != len(flat_facet_masks):
-            return
+        for ax, row, col, sla, change in cells:
+            if not change:
+                self.scatter_layer_artists.append(sla)
+                continue
+            if sla is None:
+                instrumentation.count("facet_artists.created")
+                sla = FacetScatterLayerArtist(
+                    ax,
+                    self._viewer_state,
+                    layer=self.layer,
+                    facet_index=facet_index,
+                    facet_row=row,
+                    facet_col=col,
+                    facet_data=facet_data[row, col],
+                    facet_subset=facet_index.subset_state(row, col),
+                    facet_label=facet_index.label(row, col),
+                    scatter_state=self.state,
+                    parent_artist=self,
+                )
+            else:
+                instrumentation.count("facet_artists.moved")
+                sla.set_facet(
+                    ax,
+                    facet_index,
+                    row,
+                    col,
+                    facet_data=facet_data[row, col],
+                    facet_subset=facet_index.subset_state(row, col),
+                    facet_label=facet_index.label(row, col),
+                )
+            self.scatter_layer_artists.append(sla)
+            sla._update_scatter(force=True)
+
+    def _remove_facet_artist(self, sla):
+        instrumentation.count("facet_artists.removed")
+        self._viewer_state.layers.remove(sla.state)
+        sla.clear()
+        sla.remove()
+
+    def _on_press(self, event=None, force=False):
+        super()._on_press(event=event, force=force)
+        if self.panning:
+            self._update_level_of_detail()
+
+    def on_pan_end(self):
+        self._update_level_of_detail()
+
+    @defer_draw
+    def _update_level_of_detail(self):
+        """
+        Draw only a sample of the points of large facets while panning, and
+        all of them again once panning ends.
+        """
+        for sla in self.scatter_layer_artists:
+            sla.set_reduced_detail(self.panning)
 
-        for ax, facet_mask, facet_subset in zip(
-            flat_axes, flat_facet_masks, flat_facet_subsets
+    def _broadcast_state(self, **kwargs):
+        properties = SYNC_PROPERTIES.intersection(kwargs)
+        if properties:
+            self.broadcast_state(properties)
+
+    @defer_draw
+    @instrumentation.timed("broadcast_state")
+    def broadcast_state(self, properties=SYNC_PROPERTIES):
+        """
+        Copy ``properties`` from this layer's state to the states of all the
+        facet artists.
+
+        The new values are set on every facet with their callbacks delayed,
+        so each facet is notified once about all of the properties, and
+        nothing is drawn until every facet has been updated.
+        """
+        values = {prop: getattr(self.state, prop) for prop in properties}
+        with ExitStack() as stack:
+            for sla in self.scatter_layer_artists:
+                stack.enter_context(delay_callback(sla.state, *values))
+            for sla in self.scatter_layer_artists:
+                for prop, value in values.items():
+                    setattr(sla.state, prop, value)
+
+    @property
+    def subset_mask(self):
+        """
+        The mask for this layer's subset, flattened, or `None` if this layer
+        is a dataset. The subset state is evaluated once and the result is
+        shared by all facets until the next call to `update`.
+        """
+        if not isinstance(self.layer, Subset):
+            return None
+        if self._subset_mask is None or (
+            self._subset_mask_state is not self.layer.subset_state
         ):
-            sla = FacetScatterLayerArtist(
-                ax,
-                self._viewer_state,
-                layer=self.layer,
-                facet_mask=facet_mask,
-                facet_subset=facet_subset,
-                scatter_state=self.state,
+            with instrumentation.phase("subset_mask", points=self.layer.data.size):
+                self._subset_mask = self.layer.to_mask().ravel()
+            self._subset_mask_state = self.layer.subset_state
+        return self._subset_mask
+
+    def facet_indices(self, facet_index, row, col):
+        """
+        The indices of the elements of this layer that fall in the facet at
+        ``row`` and ``col`` of ``facet_index``.
+        """
+        indices = facet_index.indices(row, col)
+        subset_mask = self.subset_mask
+        if subset_mask is not None:
+            indices = indices[subset_mask[indices]]
+        return indices
+
+    def column(self, att, histogram=False):
+        """
+        The values of ``att`` in the dataset, flattened and converted to
+        numbers with `~glue.utils.ensure_numerical`, or with
+        `~glue_small_multiples.density.histogram_values` if ``histogram`` is
+        set.
+
+        Each column is read and converted once per version of the dataset
+        and shared by all the facets, so the returned array is read-only.
+        """
+        key = (self.column_cache.version, getattr(att, "uuid", None), histogram)
+        values = self.column_cache.get(key)
+        if values is None:
+            instrumentation.count("column_cache.misses")
+            data = self.column_cache.data
+            if histogram:
+                values = histogram_values(data, att)
+            else:
+                values = ensure_numerical(data[att].ravel())
+            # The array may be the dataset's own, so only a view is locked
+            values = values.view()
+            values.flags.writeable = False
+            self.column_cache[key] = values
+        else:
+            instrumentation.count("column_cache.hits")
+        return values
+
+    def _facet_columns(self):
+        """
+        The columns of the dataset that the facets will need to show their
+        points, keyed by component UUID, and the keys of the columns that
+        are only needed by facets showing markers. Attributes that are not
+        valid for this layer are left out, so facets can report the problem
+        themselves.
+        """
+        viewer_state = self._viewer_state
+        marker_atts = []
+        if not self.state.density_map or self.state.points_mode == "auto":
+            marker_atts += [viewer_state.x_att, viewer_state.y_att]
+            if self.state.size_mode != "Fixed":
+                marker_atts.append(self.state.size_att)
+        atts = list(marker_atts)
+        if self.state.cmap_mode != "Fixed":
+            atts.append(self.state.cmap_att)
+
+        columns = {}
+        for att in atts:
+            if att is None or att.uuid in columns:
+                continue
+            try:
+                columns[att.uuid] = self.column(att)
+            except IncompatibleAttribute:
+                continue
+        marker_keys = set(att.uuid for att in marker_atts if att is not None)
+        if self.state.cmap_mode != "Fixed" and self.state.cmap_att is not None:
+            marker_keys.discard(self.state.cmap_att.uuid)
+        return columns, marker_keys
+
+    def facet_density_map(self, num_points):
+        """
+        Whether a facet with ``num_points`` points is shown as a density map.
+        """
+        if self.state.points_mode == "auto":
+            return num_points > self.state.density_threshold
+        return self.state.density_map
+
+    def prepare_facets(self, facets):
+        """
+        Select the points shown in each facet.
+
+        Parameters
+        ----------
+        facets : list of tuple
+            The ``(facet_index, row, col)`` of each facet.
+
+        Returns
+        -------
+        list of tuple
+            An ``(indices, values)`` pair for each facet, in the same order
+            as ``facets``, where ``values`` maps component UUIDs to the
+            values of the selected points.
+
+        The subset mask and the data columns are read once on the calling
+        thread. Selecting the points of each facet is pure Numpy work which
+        is spread over ``num_workers`` threads of the viewer state.
+        """
+        if len(facets) == 0:
+            return []
+
+        # Evaluate the subset mask here rather than in the worker threads
+        self.subset_mask
+        columns, marker_keys = self._facet_columns()
+
+        def prepare(facet):
+            indices = self.facet_indices(*facet)
+            # Facets shown as density maps don't need their x and y values
+            skip = marker_keys if self.facet_density_map(len(indices)) else ()
+            values = {
+                key: column[indices]
+                for key, column in columns.items()
+                if key not in skip
+            }
+            return indices, values
+
+        with instrumentation.phase("prepare_facets") as phase:
+            prepared = map_facets(prepare, facets, self._viewer_state.num_workers)
+            phase.add_points(sum(len(indices) for indices, _ in prepared))
+        return prepared
+
+    def _prepare_facet_data(self, facets):
+        try:
+            return self.prepare_facets(facets)
+        except IncompatibleAttribute:
+            # The facets will disable themselves when they try to update
+            return [None] * len(facets)
+
+    def _marker_style(self, kind, key, compute):
+        """
+        The array of ``kind`` for every element of the dataset, computed by
+        ``compute`` once for all facets and kept while ``key`` stays the
+        same (and until the data, subset or facets change).
+        """
+        key = (self.column_cache.version,) + key
+        cached = self._marker_styles.get(kind)
+        if cached is None or cached[0] != key:
+            with instrumentation.phase(f"marker_{kind}", points=self.column_cache.data.size):
+                cached = self._marker_styles[kind] = (key, compute())
+        return cached[1]
+
+    def _facet_cmap_limits(self):
+        """
+        The colormap limits of every panel of the facet index, with a NaN
+        panel at the end for elements that are not in any facet.
+        """
+        facet_index = self._viewer_state.facet_index
+        state = self.state
+
+        def compute():
+            lower, upper = facet_index.limits(
+                self.column(state.cmap_att),
+                percentile=state.cmap_facet_percentile,
+                mask=self.subset_mask,
             )
-            self.scatter_layer_artists.append(sla)
-            for visual_property in (
-                CMAP_PROPERTIES
-                | MARKER_PROPERTIES
-                | LINE_PROPERTIES
-                | set(["color", "alpha", "zorder", "visible"])
-            ):
-                sla_sync = keep_in_sync(
-                    self.state, visual_property, sla.state, visual_property
+            return np.append(lower, np.nan), np.append(upper, np.nan)
+
+        return self._marker_style(
+            "cmap_limits",
+            (facet_index, getattr(state.cmap_att, "uuid", None), state.cmap_facet_percentile),
+            compute,
+        )
+
+    def facet_cmap_limits(self, sla):
+        """
+        The ``(vmin, vmax)`` colormap limits of the facet artist ``sla``.
+        """
+        if self.state.cmap_normalization != "facet":
+            return self.state.cmap_vmin, self.state.cmap_vmax
+        lower, upper = self._facet_cmap_limits()
+        panel = sla.facet_index.panel(sla.facet_row, sla.facet_col)
+        if np.isnan(lower[panel]):
+            # The facet has no values to take limits from
+            return self.state.cmap_vmin, self.state.cmap_vmax
+        return lower[panel], upper[panel]
+
+    def facet_colors(self, sla):
+        """
+        The values of the color attribute for the points of the facet artist
+        ``sla``, normalized so that the colormap limits of the facet map to
+        0 and 1.
+
+        The values are normalized once for the whole layer, with the limits
+        of each element's facet, and each facet takes its own points.
+        """
+        state = self.state
+        att = getattr(state.cmap_att, "uuid", None)
+        if state.cmap_normalization == "facet":
+            key = ("facet", att, state.cmap_facet_percentile)
+        else:
+            key = ("shared", att, state.cmap_vmin, state.cmap_vmax)
+
+        def compute():
+            values = self.column(state.cmap_att)
+            if state.cmap_normalization == "facet":
+                lower, upper = self._facet_cmap_limits()
+                codes = self._viewer_state.facet_index.panel_codes
+                lower, upper = lower[codes], upper[codes]
+            else:
+                lower, upper = state.cmap_vmin, state.cmap_vmax
+            span = np.asarray(upper - lower, dtype=float)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                colors = (values - lower) / span
+            # Matplotlib maps everything to the bottom of the colormap if the
+            # limits are equal, which we do too
+            colors[span == 0] = 0
+            return colors.astype(np.float32)
+
+        return self._marker_style("colors", key, compute)[sla._facet_indices]
+
+    def facet_sizes(self, sla):
+        """
+        The marker sizes (as areas, for `~matplotlib.axes.Axes.scatter`) of
+        the points of the facet artist ``sla``, scaled once for the whole
+        layer.
+        """
+        state = self.state
+
+        def compute():
+            s = np.array(self.column(state.size_att), dtype=float)
+            s -= state.size_vmin
+            s /= state.size_vmax - state.size_vmin
+            # The following ensures that the sizes are in the range 3 to 30
+            # before the final size_scaling.
+            np.clip(s, 0, 1, out=s)
+            s *= 0.95
+            s += 0.05
+            s *= 30 * state.size_scaling
+            # Note, we need to square here because for scatter, s is actually
+            # proportional to the marker area, not radius.
+            s **= 2
+            return s
+
+        key = (
+            getattr(state.size_att, "uuid", None),
+            state.size_vmin,
+            state.size_vmax,
+            state.size_scaling,
+        )
+        return self._marker_style("sizes", key, compute)[sla._facet_indices]
+
+    def _density_key(self, layout, range):
+        # ComponentID overloads ==, so we key on the component UUIDs instead
+        viewer_state = self._viewer_state
+        return (
+            self.density_cache.version,
+            # The maps are laid out in the order of the facets in the grid,
+            # so maps for recently viewed pages stay in the cache.
+            tuple(sla.facet_key for sla in self.scatter_layer_artists),
+            layout,
+            tuple(tuple(r) for r in range),
+            getattr(viewer_state.x_att, "uuid", None),
+            getattr(viewer_state.y_att, "uuid", None),
+            viewer_state.x_log,
+            viewer_state.y_log,
+            self.state.cmap_mode,
+            getattr(self.state.cmap_att, "uuid", None),
+            self.state.cmap_statistic,
+        )
+
+    def compute_density_maps(self, bins=None, range=None, facets=None):
+        """
+        Compute the density maps for all facets in one pass over the data.
+
+        Returns an array with shape ``(len(facets),) + bins`` in the same
+        order as ``facets``, which defaults to ``scatter_layer_artists``.
+
+        If ``num_workers`` in the viewer state is more than one, the facets
+        are split into contiguous groups which are histogrammed in parallel.
+        Each facet is computed by a single thread, so the result does not
+        depend on the number of workers.
+        """
+        viewer_state = self._viewer_state
+        if facets is None:
+            facets = self.scatter_layer_artists
+
+        # Read the data on this thread, so that the worker threads only index
+        # into Numpy arrays.
+        self.subset_mask
+        y = self.column(viewer_state.y_att, histogram=True)
+        x = self.column(viewer_state.x_att, histogram=True)
+        if self.state.cmap_mode == "Fixed":
+            c = None
+        else:
+            c = self.column(self.state.cmap_att, histogram=True)
+        log = (viewer_state.y_log, viewer_state.x_log)
+
+        def compute(chunk):
+            indices = [
+                self.facet_indices(sla.facet_index, sla.facet_row, sla.facet_col)
+                for sla in chunk
+            ]
+            slots = np.repeat(
+                np.arange(len(indices)), [len(facet) for facet in indices]
+            )
+            indices = (
+                np.concatenate(indices) if indices else np.zeros(0, dtype=int)
+            )
+            values = [y[indices], x[indices]]
+            if c is None:
+                return compute_facet_histogram(
+                    values, slots, len(chunk), range, bins, log=log
                 )
-                self.scatter_layer_artists_syncs.append(sla_sync)
+            # Counts and the color statistic come from a single binning pass
+            count, aggregate = compute_facet_aggregate(
+                values,
+                slots,
+                len(chunk),
+                range,
+                bins,
+                c[indices],
+                statistic=self.state.cmap_statistic,
+                log=log,
+            )
+            return aggregate
 
-            sla._update_scatter(force=True)
+        num_workers = viewer_state.num_workers
+        chunks = split_chunks(facets, num_workers)
+        with instrumentation.phase("density_maps", points=len(x)):
+            return np.concatenate(map_facets(compute, chunks, num_workers))
+
+    def density_map(self, sla, bins=None, range=None):
+        """
+        The density map for the facet artist ``sla``. The maps for all
+        facets are computed together and cached, so redrawing a facet (or
+        returning to a previous view) does not recompute the grid.
+        """
+        index = self.scatter_layer_artists.index(sla)
+        layout = self._density_layout()
+        if layout[index] != tuple(bins):
+            # The facet is not drawn at the resolution of its axes, so use
+            # the resolution it asked for in every facet.
+            layout = tuple(
+                tuple(bins) if b is not None or i == index else None
+                for i, b in enumerate(layout)
+            )
+        key = self._density_key(layout, range)
+        density_maps = self.density_cache.get(key)
+        if density_maps is None:
+            instrumentation.count("density_cache.misses")
+            density_maps = self._compute_layout(layout, range)
+            self.density_cache[key] = density_maps
+        else:
+            instrumentation.count("density_cache.hits")
+        self._density_maps = density_maps
+        return density_maps[index]
+
+    def _facet_bins(self, sla):
+        """
+        The number of ``(y, x)`` bins in the density map of the facet artist
+        ``sla``, with one bin per pixel of its axes at the viewer ``dpi``.
+        This matches the resolution the density artist asks for.
+        """
+        axes = sla.axes
+        figure = axes.figure
+        position = axes.get_position()
+        dpi = self._viewer_state.dpi
+        return (
+            int(round(position.height * figure.get_figheight() * dpi)),
+            int(round(position.width * figure.get_figwidth() * dpi)),
+        )
+
+    def _density_layout(self):
+        # Facets drawn with markers (in the auto points mode, the facets
+        # under the threshold) don't need a density map, so they get None
+        return tuple(
+            self._facet_bins(sla)
+            if sla.state.markers_visible and sla.state.density_map
+            else None
+            for sla in self.scatter_layer_artists
+        )
+
+    def _compute_layout(self, layout, range):
+        """
+        Compute the density maps of all facets, with the bins of each facet
+        given by ``layout``. Facets with the same bins are computed in a
+        single pass, so a grid of axes with the same size (the usual case)
+        is only binned once. Facets with no bins in ``layout`` are skipped
+        and get `None`.
+        """
+        groups = {}
+        for index, bins in enumerate(layout):
+            if bins is not None:
+                groups.setdefault(bins, []).append(index)
+        density_maps = [None] * len(layout)
+        for bins, indices in groups.items():
+            facets = [self.scatter_layer_artists[index] for index in indices]
+            for index, density_map in zip(
+                indices, self.compute_density_maps(bins, range, facets=facets)
+            ):
+                density_maps[index] = density_map
+        return density_maps
+
+    def density_max(self):
+        """
+        The largest value in the density maps of all facets, as last drawn,
+        or `None` if no density maps were drawn. This is used to give all
+        facets the same color scale.
+        """
+        density_maps = self._density_maps
+        if not density_maps:
+            return None
+        if self._density_max[0] is not density_maps:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                maximum = np.nanmax(
+                    [
+                        np.nanmax(m) if m is not None and m.size else np.nan
+                        for m in density_maps
+                    ]
+                )
+            self._density_max = (density_maps, maximum)
+        return self._density_max[1]
 
     @defer_draw
     def _update_scatter(self, force=False, **kwargs):
@@ -138,15 +717,32 @@ class SmallMultiplesLayerArtist(MatplotlibLayerArtist, PanTrackerMixin):
             return
 
         changed = set() if force else self.pop_changed_properties()
-        if force or any(
-            prop in changed
-            for prop in ("col_facet_att", "row_facet_att", "num_rows", "num_cols")
-        ):
+        if force or FACET_PROPERTIES.intersection(changed):
             self._set_axes()
+        elif "cmap_statistic" in changed or "density_normalization" in changed:
+            for sla in self.scatter_layer_artists:
+                if sla.density_artist is not None:
+                    sla.density_artist.stale = True
+        if CMAP_NORMALIZATION_PROPERTIES.intersection(changed):
+            for sla in self.scatter_layer_artists:
+                sla._update_visual_attributes(CMAP_NORMALIZATION_PROPERTIES)
 
     @defer_draw
+    @instrumentation.timed("layer_update")
     def update(self):
+        # The subset or data may have changed, so re-evaluate the subset mask
+        # (once) the next time a facet asks for it.
+        self._subset_mask = None
+        self._marker_styles = {}
         self._update_scatter()
+        facet_data = self._prepare_facet_data(
+            [
+                (sla.facet_index, sla.facet_row, sla.facet_col)
+                for sla in self.scatter_layer_artists
+            ]
+        )
+        for sla, data in zip(self.scatter_layer_artists, facet_data):
+            sla.set_facet_data(data)
         for sla in self.scatter_layer_artists:
             sla.state.zorder = (
                 self.state.zorder
@@ -159,11 +755,16 @@ class SmallMultiplesLayerArtist(MatplotlibLayerArtist, PanTrackerMixin):
         # reference to the self.histogram2d method in density artist.
         self.density_artist = None
         for sla in self.scatter_layer_artists:
-            self._viewer_state.layers.remove(sla.state)
-            sla.clear()
-            sla.remove()
+            self._remove_facet_artist(sla)
         self.scatter_layer_artists = []
-        self.scatter_layer_artists_syncs = []
+        self._density_maps = None
+        self._marker_styles = {}
+        if self.layer.hub is not None:
+            self.density_cache.unregister(self.layer.hub)
+        self.density_cache.clear()
+        if not self._column_cache_released:
+            self._column_cache_released = True
+            self.column_cache.release()
         super(SmallMultiplesLayerArtist, self).remove()
 
     def clear(self):
@@ -175,10 +776,35 @@ class SmallMultiplesLayerArtist(MatplotlibLayerArtist, PanTrackerMixin):
         pass  # There is nothing to actually draw for this artist
 
 
+class FacetDensityMapLimits(DensityMapLimits):
+    """
+    Density map limits which can be shared by all the facets of a layer.
+
+    With the ``'shared'`` density normalization of the layer, the upper
+    limit is computed from the largest value in the density maps of all
+    facets rather than just the one being drawn.
+    """
+
+    def __init__(self, facet_artist):
+        self._facet_artist = weakref.ref(facet_artist)
+
+    def max(self, array):
+        facet_artist = self._facet_artist()
+        parent_artist = getattr(facet_artist, "parent_artist", None)
+        if (
+            parent_artist is not None
+            and parent_artist.state.density_normalization == "shared"
+        ):
+            maximum = parent_artist.density_max()
+            if maximum is not None and np.isfinite(maximum):
+                array = maximum
+        return super().max(array)
+
+
 class FacetScatterLayerArtist(ScatterLayerArtist):
     """
     A custom ScatterLayerArtist that knows how to trim the data
-    appropriately based on a facet_mask
+    appropriately based on its facet in the facet index
     """
 
     _layer_state_cls = FacetScatterLayerState
@@ -189,9 +815,14 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
         viewer_state,
         layer_state=None,
         layer=None,
-        facet_mask=None,
+        facet_index=None,
+        facet_row=0,
+        facet_col=0,
+        facet_data=None,
         facet_subset=None,
+        facet_label=None,
         scatter_state=None,
+        parent_artist=None,
     ):
         self.density_artist = (
             None  # Hack to avoid an AttributeError because density_artist does
@@ -199,12 +830,26 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
         # not get fully initialized before a callback fires
         super().__init__(axes, viewer_state, layer_state=layer_state, layer=layer)
 
-        self.state.facet_mask = facet_mask
+        self.facet_index = facet_index
+        self.facet_key = (
+            None if facet_index is None else facet_index.key(facet_row, facet_col)
+        )
+        self._facet_indices = np.zeros(0, dtype=int)
+        self._facet_values_cache = {}
+        self._facet_data_ready = False
+        self._reduced_detail = False
+        self._detail_sample = None
+        self.facet_row = facet_row
+        self.facet_col = facet_col
+        self.parent_artist = parent_artist
         self.state.facet_subset = facet_subset
+        self.state.facet_label = facet_label
         self.state._update_title()
-        self.facet_mask = self.state.facet_mask
+        self.set_facet_data(facet_data)
         if scatter_state is not None:
             self.state.update_from_state(scatter_state)
+            # The density map mode was copied too, but depends on the facet
+            self.state._update_density_map_mode()
 
     @defer_draw
     def _update_scatter(self, force=False, **kwargs):
@@ -226,28 +871,149 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
         if force or len(changed & VISUAL_PROPERTIES) > 0:
             self._update_visual_attributes(changed, force=force)
 
+    def _set_axes(self, axes):
+        if not isinstance(self.density_auto_limits, FacetDensityMapLimits):
+            self.density_auto_limits = FacetDensityMapLimits(self)
+        super()._set_axes(axes)
+
+    def set_facet(
+        self,
+        axes,
+        facet_index,
+        facet_row,
+        facet_col,
+        facet_data=None,
+        facet_subset=None,
+        facet_label=None,
+    ):
+        """
+        Point this artist at a new position in the grid and facet index. The
+        Matplotlib artists are only recreated if the facet moved to
+        different axes.
+        """
+        if axes is not self.axes:
+            self.remove()
+            self._set_axes(axes)
+        self.facet_index = facet_index
+        self.facet_key = facet_index.key(facet_row, facet_col)
+        self.facet_row = facet_row
+        self.facet_col = facet_col
+        self.state.facet_subset = facet_subset
+        self.state.facet_label = facet_label
+        self.state._update_title()
+        self.set_facet_data(facet_data)
+
+    def set_facet_data(self, facet_data):
+        """
+        Set the points shown in this facet, as an ``(indices, values)`` pair
+        prepared by `SmallMultiplesLayerArtist.prepare_facets`. If
+        ``facet_data`` is `None`, the facet works out its points itself the
+        next time it updates.
+        """
+        if facet_data is None:
+            self._facet_data_ready = False
+            self._facet_values_cache = {}
+        else:
+            self._facet_indices, values = facet_data
+            self._facet_values_cache = dict(values)
+            self._facet_data_ready = True
+            self.state.facet_count = len(self._facet_indices)
+
+    def set_reduced_detail(self, reduced):
+        """
+        Switch between drawing a sample of at most ``pan_max_points`` points
+        and all the points of this facet. Facets shown as density maps, or
+        with few enough points, always draw everything.
+        """
+        reduced = (
+            reduced
+            and not self.state.density_map
+            and self._sample_positions() is not None
+        )
+        if reduced != self._reduced_detail:
+            self._reduced_detail = reduced
+            self._update_scatter(force=True)
+
+    def _sample_positions(self):
+        """
+        The positions of the points drawn with reduced detail, or `None` if
+        the facet has no more than ``pan_max_points`` points. The sample is
+        random but deterministic, and is reused while the number of points
+        and the budget stay the same.
+        """
+        num_points = len(self._facet_indices)
+        budget = int(self._viewer_state.pan_max_points or 0)
+        if budget <= 0 or num_points <= budget:
+            return None
+        if self._detail_sample is None or self._detail_sample[0] != (num_points, budget):
+            rng = np.random.default_rng(0)
+            positions = np.sort(rng.choice(num_points, budget, replace=False))
+            self._detail_sample = ((num_points, budget), positions)
+        return self._detail_sample[1]
+
+    def _update_facet_indices(self):
+        """
+        Work out which elements of the dataset are shown in this facet.
+        """
+        self._facet_values_cache = {}
+        if self.parent_artist is not None:
+            # The parent artist evaluates the subset state once for all facets
+            indices = self.parent_artist.facet_indices(
+                self.facet_index, self.facet_row, self.facet_col
+            )
+        else:
+            indices = self.facet_index.indices(self.facet_row, self.facet_col)
+            if isinstance(self.layer, Subset):
+                indices = indices[self.layer.to_mask().ravel()[indices]]
+        self._facet_indices = indices
+        self.state.facet_count = len(indices)
+
+    def _facet_values(self, att):
+        """
+        The values of ``att`` for the elements shown in this facet, in the
+        same order as the plotted points.
+        """
+        values = self._facet_values_cache.get(getattr(att, "uuid", None))
+        if values is None and self.parent_artist is not None:
+            values = self.parent_artist.column(att)[self._facet_indices]
+        elif values is None:
+            if isinstance(self.layer, Subset):
+                data = self.layer.data
+            else:
+                data = self.layer
+            values = ensure_numerical(data[att].ravel())[self._facet_indices]
+        return self._sampled(values)
+
+    def _sampled(self, values):
+        """
+        The elements of ``values`` (one per point of this facet) for the
+        points that are drawn.
+        """
+        if self._reduced_detail:
+            positions = self._sample_positions()
+            if positions is not None:
+                values = values[positions]
+        return values
+
+    def _cmap_limits(self):
+        if self.parent_artist is None:
+            return self.state.cmap_vmin, self.state.cmap_vmax
+        return self.parent_artist.facet_cmap_limits(self)
+
     @defer_draw
+    @instrumentation.timed("facet_update_data")
     def _update_data(self):
         if len(self.mpl_artists) == 0:
             return
+
+        # Each facet only gets the points that belong to it, which are a
+        # contiguous slice of the facet-sorted permutation in the facet index.
+        # These are normally prepared for the whole grid by the parent artist.
         try:
+            if not self._facet_data_ready:
+                self._update_facet_indices()
             if not self.state.density_map:
-                if isinstance(self.layer, Subset):
-                    # TODO: This is not a very efficient way to do this calculation, if that matters
-                    # There are a fair number of calls here with empty subsets, and maybe
-                    # we could short-circuit some of them
-                    xsubset_state = (
-                        self.layer.subset_state & self.state.facet_subset.subset_state
-                    )
-                    subset = Subset(self.layer.data, label="temp")
-                    subset.subset_state = xsubset_state
-                    masked_x = ensure_numerical(
-                        subset[self._viewer_state.x_att].ravel()
-                    )
-                else:
-                    x = ensure_numerical(self.layer[self._viewer_state.x_att].ravel())
-                    masked_x = np.ma.masked_where(self.facet_mask, x)
-
+                x = self._facet_values(self._viewer_state.x_att)
         except (IncompatibleAttribute, IndexError):
             self.disable_invalid_attributes(self._viewer_state.x_att)
             return
@@ -256,21 +1022,7 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
 
         try:
             if not self.state.density_map:
-                if isinstance(
-                    self.layer, Subset
-                ):  # This is not a very efficient way to do this
-                    ysubset_state = (
-                        self.layer.subset_state & self.state.facet_subset.subset_state
-                    )
-                    subset = Subset(self.layer.data, label="temp")
-                    subset.subset_state = ysubset_state
-                    masked_y = ensure_numerical(
-                        subset[self._viewer_state.y_att].ravel()
-                    )
-                else:
-                    y = ensure_numerical(self.layer[self._viewer_state.y_att].ravel())
-                    masked_y = np.ma.masked_where(self.facet_mask, y)
-
+                y = self._facet_values(self._viewer_state.y_att)
         except (IncompatibleAttribute, IndexError):
             self.disable_invalid_attributes(self._viewer_state.y_att)
             return
@@ -292,15 +1044,16 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
                 if self._use_plot_artist():
                     # In this case we use Matplotlib's plot function because it has much
                     # better performance than scatter.
-                    self.plot_artist.set_data(masked_x, masked_y)
+                    self.plot_artist.set_data(x, y)
                 else:
-                    offsets = np.vstack((masked_x, masked_y)).transpose()
+                    offsets = np.vstack((x, y)).transpose()
                     self.scatter_artist.set_offsets(offsets)
         else:
             self.plot_artist.set_data([], [])
             self.scatter_artist.set_offsets(np.zeros((0, 2)))
 
     @defer_draw
+    @instrumentation.timed("facet_update_visual")
     def _update_visual_attributes(self, changed, force=False):
         if not self.enabled:
             return
@@ -313,11 +1066,14 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
                         self.density_artist.set_clim(
                             self.density_auto_limits.min, self.density_auto_limits.max
                         )
-                elif force or any(prop in changed for prop in CMAP_PROPERTIES):
-                    c = ensure_numerical(self.layer[self.state.cmap_att].ravel())
-                    if self.facet_mask is not None:
-                        c = np.ma.masked_where(self.facet_mask, c)
-                    set_mpl_artist_cmap(self.density_artist, c, self.state)
+                elif force or any(
+                    prop in changed
+                    for prop in CMAP_PROPERTIES | CMAP_NORMALIZATION_PROPERTIES
+                ):
+                    vmin, vmax = self._cmap_limits()
+                    set_mpl_artist_cmap(
+                        self.density_artist, None, cmap=self.state.cmap, vmin=vmin, vmax=vmax
+                    )
 
                 if force or "dpi" in changed:
                     self.density_artist.set_dpi(self._viewer_state.dpi)
@@ -362,16 +1118,24 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
                                 self.scatter_artist.set_edgecolors(self.state.color)
                     elif (
                         force
-                        or any(prop in changed for prop in CMAP_PROPERTIES)
+                        or any(
+                            prop in changed
+                            for prop in CMAP_PROPERTIES | CMAP_NORMALIZATION_PROPERTIES
+                        )
                         or "fill" in changed
                     ):
                         self.scatter_artist.set_edgecolors(None)
                         self.scatter_artist.set_facecolors(None)
-                        c = ensure_numerical(self.layer[self.state.cmap_att].ravel())
-                        if self.facet_mask is not None:
-                            c = np.ma.masked_where(self.facet_mask, c)
-
-                        set_mpl_artist_cmap(self.scatter_artist, c, self.state)
+                        if self.parent_artist is None:
+                            c = self._facet_values(self.state.cmap_att)
+                            set_mpl_artist_cmap(self.scatter_artist, c, self.state)
+                        else:
+                            # The values were normalized for the whole layer
+                            # with the limits of each facet
+                            c = self._sampled(self.parent_artist.facet_colors(self))
+                            self.scatter_artist.set_array(c)
+                            self.scatter_artist.set_cmap(self.state.cmap)
+                            self.scatter_artist.set_norm(Normalize(0, 1))
                         if self.state.fill:
                             self.scatter_artist.set_edgecolors("none")
                         else:
@@ -383,12 +1147,12 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
                             s = np.broadcast_to(
                                 s, self.scatter_artist.get_sizes().shape
                             )
+                            s = s**2
+                        elif self.parent_artist is not None:
+                            # The sizes are scaled once for the whole layer
+                            s = self._sampled(self.parent_artist.facet_sizes(self))
                         else:
-                            s = ensure_numerical(
-                                self.layer[self.state.size_att].ravel()
-                            )
-                            if self.facet_mask is not None:
-                                s = np.ma.masked_where(self.facet_mask, s)
+                            s = self._facet_values(self.state.size_att)
 
                             s = (s - self.state.size_vmin) / (
                                 self.state.size_vmax - self.state.size_vmin
@@ -399,10 +1163,11 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
                             s *= 0.95
                             s += 0.05
                             s *= 30 * self.state.size_scaling
+                            # Note, we need to square here because for scatter, s is
+                            # actually proportional to the marker area, not radius.
+                            s = s**2
 
-                        # Note, we need to square here because for scatter, s is actually
-                        # proportional to the marker area, not radius.
-                        self.scatter_artist.set_sizes(s**2)
+                        self.scatter_artist.set_sizes(s)
 
         for artist in [
             self.scatter_artist,
@@ -438,9 +1203,21 @@ class FacetScatterLayerArtist(ScatterLayerArtist):
             self.plot_artist.set_visible(False)
         self.redraw()
 
+    def redraw(self):
+        instrumentation.count("facet_redraws")
+        super().redraw()
+
     def compute_density_map(self, *args, **kwargs):
         try:
-            density_map = self.state.compute_density_map(*args, **kwargs)
+            if (
+                self.parent_artist is not None
+                and self.state.markers_visible
+                and self.state.density_map
+            ):
+                # The parent artist computes the maps for all facets at once
+                density_map = self.parent_artist.density_map(self, *args, **kwargs)
+            else:
+                density_map = self.state.compute_density_map(*args, **kwargs)
         except IncompatibleAttribute:
             self.disable_invalid_attributes(
                 self._viewer_state.x_att, self._viewer_state.y_att
@@ -0,0 +1,62 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["get_executor", "map_facets", "split_chunks"]
+
+# One pool per worker count, shared by all viewers
+_EXECUTORS = {}
+
+
+def get_executor(num_workers):
+    """
+    Return a shared thread pool with ``num_workers`` threads.
+    """
+    executor = _EXECUTORS.get(num_workers)
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="small-multiples"
+        )
+        _EXECUTORS[num_workers] = executor
+    return executor
+
+
+@atexit.register
+def _shutdown_executors():
+    for executor in _EXECUTORS.values():
+        executor.shutdown(wait=False)
+    _EXECUTORS.clear()
+
+
+def map_facets(func, items, num_workers=1):
+    """
+    Apply ``func`` to each of ``items``, using a thread pool if
+    ``num_workers`` is more than one.
+
+    The results are always returned as a list in the same order as
+    ``items``, and any exception raised by ``func`` is re-raised here, so
+    callers can merge the results deterministically on the calling thread.
+    ``func`` should only do pure Numpy work (which mostly releases the GIL)
+    and must not touch Matplotlib or the glue hub.
+    """
+    items = list(items)
+    num_workers = int(num_workers or 1)
+    if num_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    return list(get_executor(num_workers).map(func, items))
+
+
+def split_chunks(items, num_chunks):
+    """
+    Split ``items`` into at most ``num_chunks`` contiguous chunks of similar
+    length, preserving their order.
+    """
+    items = list(items)
+    num_chunks = max(1, min(int(num_chunks or 1), len(items)))
+    size, extra = divmod(len(items), num_chunks)
+    chunks = []
+    start = 0
+    for i in range(num_chunks):
+        stop = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:stop])
+        start = stop
+    return chunks
@@ -48,12 +48,17 @@ class SmallMultiplesLayerStyleEditor(QtWidgets.QWidget):
         self.layer_state.add_callback("vector_visible", self._update_vectors_visible)
 
         self.layer_state.add_callback("cmap_mode", self._update_cmap_mode)
+        self.layer_state.add_callback("cmap_normalization", self._update_cmap_mode)
+        self.layer_state.add_callback("points_mode", self._update_points_mode)
         self.layer_state.add_callback("size_mode", self._update_size_mode)
         self.layer_state.add_callback("vector_mode", self._update_vector_mode)
 
         self.layer_state.add_callback("density_map", self._update_size_mode)
+        self.layer_state.add_callback("density_map", self._update_cmap_mode)
         self.layer_state.add_callback("density_map", self._update_warnings)
         self.layer_state.add_callback("density_map", self._update_checkboxes)
+        self.layer_state.add_callback("density_map", self._update_density_normalization)
+        self.layer_state.add_callback("cmap_mode", self._update_density_normalization)
 
         self.layer_state.viewer_state.add_callback("x_att", self._update_checkboxes)
         self.layer_state.viewer_state.add_callback("y_att", self._update_checkboxes)
@@ -71,8 +76,10 @@ class SmallMultiplesLayerStyleEditor(QtWidgets.QWidget):
         self._update_vectors_visible()
 
         self._update_size_mode()
+        self._update_points_mode()
         self._update_vector_mode()
         self._update_cmap_mode()
+        self._update_density_normalization()
 
         self._update_checkboxes()
 
@@ -145,6 +152,18 @@ class SmallMultiplesLayerStyleEditor(QtWidgets.QWidget):
         self.ui.label_fill.setVisible(not density)
         self.ui.bool_fill.setVisible(not density)
 
+    def _update_points_mode(self, *args):
+        # Each facet chooses between markers and a density map in auto mode
+        auto = self.layer_state.points_mode == "auto"
+        self.ui.label_density_threshold.setVisible(auto)
+        self.ui.value_density_threshold.setVisible(auto)
+
+    def _update_density_normalization(self, *args):
+        # Density maps colored by an attribute use the colormap limits instead
+        visible = self.layer_state.density_map and self.layer_state.cmap_mode == "Fixed"
+        self.ui.label_density_normalization.setVisible(visible)
+        self.ui.combosel_density_normalization.setVisible(visible)
+
     def _update_markers_visible(self, *args):
         self.ui.combosel_size_mode.setEnabled(self.layer_state.markers_visible)
         self.ui.value_size.setEnabled(self.layer_state.markers_visible)
@@ -157,6 +176,7 @@ class SmallMultiplesLayerStyleEditor(QtWidgets.QWidget):
         self.ui.combosel_stretch.setEnabled(self.layer_state.markers_visible)
         self.ui.label_size_scaling.setEnabled(self.layer_state.markers_visible)
         self.ui.combosel_points_mode.setEnabled(self.layer_state.markers_visible)
+        self.ui.value_density_threshold.setEnabled(self.layer_state.markers_visible)
         self.ui.value_density_contrast.setEnabled(self.layer_state.markers_visible)
 
     def _update_checkboxes(self, *args):
@@ -247,6 +267,12 @@ class SmallMultiplesLayerStyleEditor(QtWidgets.QWidget):
             self.ui.button_flip_cmap.hide()
             self.ui.combodata_cmap.hide()
             self.ui.label_colormap.hide()
+            self.ui.label_cmap_statistic.hide()
+            self.ui.combosel_cmap_statistic.hide()
+            self.ui.label_cmap_normalization.hide()
+            self.ui.combosel_cmap_normalization.hide()
+            self.ui.label_cmap_facet_percentile.hide()
+            self.ui.combosel_cmap_facet_percentile.hide()
             self.ui.color_color.show()
         else:
             self.ui.label_cmap_attribute.show()
@@ -257,4 +283,17 @@ class SmallMultiplesLayerStyleEditor(QtWidgets.QWidget):
             self.ui.button_flip_cmap.show()
             self.ui.combodata_cmap.show()
             self.ui.label_colormap.show()
+            # The statistic only applies to the pixels of density maps
+            density = self.layer_state.density_map
+            self.ui.label_cmap_statistic.setVisible(density)
+            self.ui.combosel_cmap_statistic.setVisible(density)
+            self.ui.label_cmap_normalization.show()
+            self.ui.combosel_cmap_normalization.show()
+            # The limits set above are only used when shared by all facets
+            per_facet = self.layer_state.cmap_normalization == "facet"
+            self.ui.label_cmap_facet_percentile.setVisible(per_facet)
+            self.ui.combosel_cmap_facet_percentile.setVisible(per_facet)
+            self.ui.valuetext_cmap_vmin.setEnabled(not per_facet)
+            self.ui.valuetext_cmap_vmax.setEnabled(not per_facet)
+            self.ui.button_flip_cmap.setEnabled(not per_facet)
             self.ui.color_color.hide()
@@ -3,6 +3,7 @@ import os
 from qtpy import QtWidgets
 
 from echo.qt import autoconnect_callbacks_to_qt
+from glue.core.exceptions import IncompatibleAttribute
 from glue_qt.utils import load_ui, fix_tab_widget_fontsize
 
 
@@ -19,3 +20,51 @@ class SmallMultiplesOptionsWidget(QtWidgets.QWidget):
         self._connections = autoconnect_callbacks_to_qt(viewer_state, self.ui)
 
         self.viewer_state = viewer_state
+
+        for prop in (
+            "col_facet_att",
+            "row_facet_att",
+            "col_bin_mode",
+            "row_bin_mode",
+            "reference_data",
+        ):
+            viewer_state.add_callback(prop, self._update_binning_widgets)
+        self._update_binning_widgets()
+
+        for prop in ("col_order", "row_order"):
+            viewer_state.add_callback(prop, self._update_order_widgets)
+        self._update_order_widgets()
+
+    def _update_binning_widgets(self, *args):
+        """
+        Only show the binning options for numeric facet attributes.
+        """
+        for axis in ("col", "row"):
+            att = getattr(self.viewer_state, f"{axis}_facet_att")
+            data = self.viewer_state.reference_data
+            try:
+                numeric = (
+                    att is not None
+                    and data is not None
+                    and data.get_kind(att) != "categorical"
+                )
+            except IncompatibleAttribute:
+                numeric = False
+            mode = getattr(self.viewer_state, f"{axis}_bin_mode")
+            getattr(self.ui, f"{axis}_bins_lab").setVisible(numeric)
+            getattr(self.ui, f"combosel_{axis}_bin_mode").setVisible(numeric)
+            getattr(self.ui, f"value_{axis}_num_bins").setVisible(
+                numeric and mode != "edges"
+            )
+            getattr(self.ui, f"text_{axis}_bin_edges").setVisible(
+                numeric and mode == "edges"
+            )
+
+    def _update_order_widgets(self, *args):
+        """
+        Only show the statistic to order by if a facet axis uses it.
+        """
+        visible = "statistic" in (self.viewer_state.col_order, self.viewer_state.row_order)
+        self.ui.order_att_lab.setVisible(visible)
+        self.ui.combosel_order_statistic.setVisible(visible)
+        self.ui.combosel_order_att.setVisible(visible)
@@ -39,9 +39,9 @@ class TestSmallMultiplesViewer(object):
         assert len(self.viewer.state.layers) == 4
         yo = self.viewer.layers[0].scatter_layer_artists[0]
 
+        # Each facet only receives its own points
         x, y = yo.plot_artist.get_data()
-        unmasked_x = x[~x.mask]
-        assert len(unmasked_x) > 10
+        assert len(x) == NUM_ADELIE
 
         viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
         viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
@@ -49,8 +49,7 @@ class TestSmallMultiplesViewer(object):
         yo = self.viewer.layers[0].scatter_layer_artists[1]
 
         x, y = yo.plot_artist.get_data()
-        unmasked_x = x[~x.mask]
-        assert len(unmasked_x) > 10
+        assert len(x) == NUM_CHINSTRAP
 
         viewer_state.row_facet_att = self.penguin_data.id["island"]
         process_events()
@@ -67,3 +66,42 @@ class TestSmallMultiplesViewer(object):
         # process_events(wait=2)
         # assert len(self.viewer.layers) == 1
         # assert len(self.viewer.state.layers) == 7
+
+    def test_reuse_axes(self):
+        viewer_state = self.viewer.state
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        process_events()
+
+        first_row = list(self.viewer.axes_array[0])
+        assert self.viewer.axes_array.shape == (1, 3)
+
+        # Adding rows keeps the existing axes and shares limits with them
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+        process_events()
+        axes_array = self.viewer.axes_array
+        assert axes_array.shape == (3, 3)
+        assert all(ax is old for ax, old in zip(axes_array[0], first_row))
+        assert len(self.viewer.figure.axes) == 9
+        for ax in axes_array.flat:
+            assert ax.get_shared_x_axes().joined(ax, axes_array[0, 0])
+            assert ax.get_shared_y_axes().joined(ax, axes_array[0, 0])
+
+        # Removing a row only removes the axes that are no longer needed
+        bottom_row = list(axes_array[2])
+        middle_left = axes_array[1, 0]
+        viewer_state.max_num_rows = 2
+        process_events()
+        assert self.viewer.axes_array.shape == (2, 3)
+        assert self.viewer.axes_array[1, 0] is middle_left
+        assert len(self.viewer.figure.axes) == 6
+        assert not any(ax in self.viewer.figure.axes for ax in bottom_row)
+
+        # The new bottom row gets its tick labels back
+        assert any(
+            tick.label1.get_visible() for tick in middle_left.xaxis.get_major_ticks()
+        )
+        assert not any(
+            tick.label1.get_visible()
+            for tick in self.viewer.axes_array[0, 0].xaxis.get_major_ticks()
+        )
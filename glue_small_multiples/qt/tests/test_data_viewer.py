@@ -1,13 +1,21 @@
 import os
+from unittest.mock import patch
 
 import numpy as np
+from echo import delay_callback
+from glue.core import Subset
 from glue.core import data_factories as df
+from glue.core.message import NumericalDataChangedMessage
 from glue_qt.app import GlueApplication
-from glue.core.subset import AndState
-from glue.core.roi import RectangularROI
+from glue.core.subset import AndState, MaskSubsetState, roi_to_subset_state
+from glue.core.roi import PolygonalROI, RectangularROI
 from glue.config import colormaps
+from matplotlib.backend_bases import KeyEvent, MouseEvent
 
+from ..layer_style_editor import SmallMultiplesLayerStyleEditor
 from ..viewer import SmallMultiplesViewer
+from ... import instrumentation
+from ...layer_artist import FacetScatterLayerArtist
 
 DATA = os.path.join(os.path.dirname(__file__), "data")
 NUM_ADELIE = 152
@@ -78,6 +86,13 @@ class TestSmallMultiplesViewer(object):
         layer_state.cmap_vmax = 2.0
         layer_state.cmap = colormaps.members[3][1]
 
+        # Colors and sizes are sliced the same way as the facet's points
+        for sla in self.viewer.layers[0].scatter_layer_artists:
+            n_points = len(sla.scatter_artist.get_offsets())
+            assert n_points > 0
+            assert len(sla.scatter_artist.get_sizes()) == n_points
+            assert len(sla.scatter_artist.get_array()) == n_points
+
         # Check inverting works
         layer_state.cmap_vmin = 3.0
 
@@ -131,7 +146,16 @@ class TestSmallMultiplesViewer(object):
         assert len(self.viewer.layers) == 2
         assert len(self.penguin_data.subsets) == 1
         state = self.penguin_data.subsets[0].subset_state
-        assert isinstance(state, AndState)
+        # Only the first facet was tested against the ROI, and the result is
+        # stored as a mask
+        assert isinstance(state, MaskSubsetState)
+        expected = (
+            roi_to_subset_state(roi, x_att=viewer_state.x_att, y_att=viewer_state.y_att)
+            & viewer_state.data_facet_subsets[0][0].subset_state
+        )
+        np.testing.assert_array_equal(
+            state.to_mask(self.penguin_data), expected.to_mask(self.penguin_data)
+        )
 
         subset_sla = self.viewer.layers[1].scatter_layer_artists[0]
         backgr_sla = self.viewer.layers[0].scatter_layer_artists[0]
@@ -147,3 +171,777 @@ class TestSmallMultiplesViewer(object):
         # unmasked_x = x[x.mask == False]
         assert len(x) == 14
         assert subset_sla.zorder > backgr_sla.zorder
+
+    def test_apply_roi_broadcast(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["sex"]
+        viewer_state.broadcast_roi = True
+
+        roi = RectangularROI(34, 50, 15, 22)
+        self.viewer.apply_roi(roi, 1, 0)
+
+        state = self.penguin_data.subsets[0].subset_state
+        assert isinstance(state, MaskSubsetState)
+        # The ROI is applied to every facet in the grid
+        facets = self.penguin_data.get_mask(
+            viewer_state.data_facet_subsets[0][0].subset_state
+        )
+        for facet_subsets in viewer_state.data_facet_subsets:
+            for facet_subset in facet_subsets:
+                facets |= self.penguin_data.get_mask(facet_subset.subset_state)
+        roi_mask = self.penguin_data.get_mask(
+            roi_to_subset_state(roi, x_att=viewer_state.x_att, y_att=viewer_state.y_att)
+        )
+        np.testing.assert_array_equal(
+            self.penguin_data.get_mask(state), roi_mask & facets
+        )
+        selected = self.penguin_data["species"][self.penguin_data.get_mask(state)]
+        assert set(selected) == {"Adelie", "Chinstrap", "Gentoo"}
+
+    def test_apply_roi_polygon(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+
+        roi = PolygonalROI(vx=[40, 50, 50, 45], vy=[14, 14, 17, 16])
+        with instrumentation.recording() as recorder:
+            self.viewer.apply_roi(roi, 0, 2)
+
+        state = self.penguin_data.subsets[0].subset_state
+        assert isinstance(state, MaskSubsetState)
+        # Only the points of the facet were considered
+        assert recorder.phase_stats("roi_selection")["points"] == NUM_GENTOO
+        expected = (
+            roi_to_subset_state(roi, x_att=viewer_state.x_att, y_att=viewer_state.y_att)
+            & viewer_state.data_facet_subsets[0][2].subset_state
+        )
+        mask = state.to_mask(self.penguin_data)
+        assert mask.sum() > 0
+        np.testing.assert_array_equal(mask, expected.to_mask(self.penguin_data))
+
+    def test_apply_roi_categorical(self):
+        viewer_state = self.viewer.state
+
+        # ROIs on categorical axes can't use the mask
+        viewer_state.x_att = self.penguin_data.id["island"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+
+        self.viewer.apply_roi(RectangularROI(0.5, 1.5, 15, 22), 0, 1)
+        state = self.penguin_data.subsets[0].subset_state
+        assert isinstance(state, AndState)
+        mask = np.asarray(self.penguin_data.get_mask(state))
+        assert mask.sum() > 0
+        assert set(self.penguin_data["species"][mask]) == {"Chinstrap"}
+
+    def test_subset_mask_evaluated_once(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+
+        self.viewer.apply_roi(RectangularROI(34, 50, 15, 22), 0, 0)
+        subset_master = self.viewer.layers[1]
+        assert len(subset_master.scatter_layer_artists) == 9
+
+        to_mask = Subset.to_mask
+        with patch.object(
+            Subset, "to_mask", autospec=True, side_effect=to_mask
+        ) as mock_to_mask:
+            subset_master.update()
+        assert mock_to_mask.call_count == 1
+
+        n_points = [
+            len(sla.plot_artist.get_data()[0])
+            for sla in subset_master.scatter_layer_artists
+        ]
+        assert sum(n_points) == np.count_nonzero(self.penguin_data.subsets[0].to_mask())
+
+    def test_column_cache(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+        master = self.viewer.layers[0]
+
+        with instrumentation.recording() as recorder:
+            master.update()
+            master.state.cmap_att = self.penguin_data.id["body_mass_g"]
+            master.state.cmap_mode = "Linear"
+            master.update()
+        # x and y were read when the grid was set up, so only the color
+        # column is read, and only once for all nine facets
+        assert recorder.counter("column_cache.misses") == 1
+        assert recorder.counter("column_cache.hits") >= 3
+
+        column = master.column(viewer_state.x_att)
+        assert not column.flags.writeable
+        np.testing.assert_array_equal(column, self.penguin_data["bill_length_mm"])
+
+        # Changing the values of the dataset reads the columns again
+        self.penguin_data.update_components(
+            {viewer_state.x_att: self.penguin_data["bill_length_mm"] + 1}
+        )
+        np.testing.assert_array_equal(
+            master.column(viewer_state.x_att), self.penguin_data["bill_length_mm"]
+        )
+
+    def test_column_cache_shared(self):
+        viewer_state = self.viewer.state
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+
+        self.data_collection.new_subset_group(
+            subset_state=self.penguin_data.id["bill_length_mm"] > 40, label="long"
+        )
+        master, subset_master = self.viewer.layers
+        cache = master.column_cache
+        assert subset_master.column_cache is cache
+        assert cache.users == 2
+
+        # The subset layer reads the columns the data layer already read
+        master.column(viewer_state.x_att)
+        with instrumentation.recording() as recorder:
+            subset_master.column(viewer_state.x_att)
+        assert recorder.counter("column_cache.misses") == 0
+
+        # The cache is only released with the last layer of the dataset
+        self.viewer.remove_layer(self.data_collection.subset_groups[0].subsets[0])
+        assert cache.users == 1
+        assert len(cache) > 0
+        self.viewer.remove_layer(self.penguin_data)
+        assert cache.users == 0
+        assert len(cache) == 0
+        assert not self.penguin_data.hub.is_subscribed(cache, NumericalDataChangedMessage)
+
+    def test_density_map(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+
+        layer_state = self.viewer.layers[0].state
+        layer_state.points_mode = "density"
+
+        bins = (10, 12)
+        histogram_range = ((12, 22), (30, 60))
+        master = self.viewer.layers[0]
+        for cmap_mode in ("Fixed", "Linear"):
+            layer_state.cmap_mode = cmap_mode
+            for sla in master.scatter_layer_artists:
+                assert sla.state.density_map
+                expected = sla.state.compute_density_map(
+                    bins=bins, range=histogram_range
+                )
+                actual = sla.compute_density_map(bins=bins, range=histogram_range)
+                np.testing.assert_allclose(actual, expected)
+
+        # Drawing the figure computes the maps for all facets in one go
+        compute = type(master).compute_density_maps
+        with patch.object(
+            type(master), "compute_density_maps", autospec=True, side_effect=compute
+        ) as mock_compute:
+            self.viewer.figure.canvas.draw()
+            self.viewer.figure.canvas.draw()
+            assert mock_compute.call_count == 1
+            assert master.density_cache.hits >= 2 * 9 - 1
+
+            # Changing the data invalidates the cached maps
+            values = self.penguin_data["bill_depth_mm"] + 1
+            self.penguin_data.update_components(
+                {self.penguin_data.id["bill_depth_mm"]: values}
+            )
+            self.viewer.figure.canvas.draw()
+            assert mock_compute.call_count == 2
+
+    def test_num_workers(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+
+        self.viewer.apply_roi(RectangularROI(34, 50, 15, 22), 0, 0)
+        layer_state = self.viewer.layers[0].state
+        layer_state.cmap_mode = "Linear"
+        layer_state.cmap_att = self.penguin_data.id["body_mass_g"]
+
+        bins = (10, 12)
+        histogram_range = ((12, 22), (30, 60))
+
+        def snapshot():
+            results = []
+            for master in self.viewer.layers:
+                master.update()
+                for sla in master.scatter_layer_artists:
+                    results.append(sla.plot_artist.get_data())
+                    results.append(sla.scatter_artist.get_offsets())
+                    results.append(sla.scatter_artist.get_array())
+                results.append(master.compute_density_maps(bins, histogram_range))
+            return results
+
+        serial = snapshot()
+        viewer_state.num_workers = 4
+        parallel = snapshot()
+
+        assert len(serial) == len(parallel)
+        for expected, actual in zip(serial, parallel):
+            np.testing.assert_array_equal(actual, expected)
+
+    def test_reconcile_facet_artists(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+
+        master = self.viewer.layers[0]
+        before = {sla.facet_key: sla for sla in master.scatter_layer_artists}
+        assert len(before) == 9
+
+        # Facets that are still shown keep their artists and states
+        viewer_state.max_num_cols = 2
+        after = {sla.facet_key: sla for sla in master.scatter_layer_artists}
+        assert len(after) == 6
+        for key, sla in after.items():
+            assert sla is before[key]
+            assert sla.axes is self.viewer.axes_array[sla.facet_row, sla.facet_col]
+        assert len(viewer_state.layers) == 7
+        removed = [sla for key, sla in before.items() if key not in after]
+        assert not any(sla.state in viewer_state.layers for sla in removed)
+
+        master.state.size_scaling = 2
+        size_scaling = master.state.size_scaling
+        assert all(sla.state.size_scaling == size_scaling for sla in after.values())
+        assert not any(sla.state.size_scaling == size_scaling for sla in removed)
+
+        # Only the facets that reappear get new artists
+        viewer_state.max_num_cols = 3
+        final = {sla.facet_key: sla for sla in master.scatter_layer_artists}
+        assert len(final) == 9
+        assert sum(sla is after.get(key) for key, sla in final.items()) == 6
+        assert all(sla.state.size_scaling == size_scaling for sla in final.values())
+        for sla in master.scatter_layer_artists:
+            x, y = sla.plot_artist.get_data()
+            assert len(x) == sla.facet_index.count(sla.facet_row, sla.facet_col)
+
+    def test_broadcast_state(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+
+        master = self.viewer.layers[0]
+        master.state.cmap_mode = "Linear"
+
+        # Each facet is updated once for all the properties that changed
+        update = FacetScatterLayerArtist._update_visual_attributes
+        with patch.object(
+            FacetScatterLayerArtist,
+            "_update_visual_attributes",
+            autospec=True,
+            side_effect=update,
+        ) as mock_update:
+            with delay_callback(master.state, "alpha", "cmap"):
+                master.state.alpha = 0.3
+                master.state.cmap = colormaps.members[3][1]
+        assert mock_update.call_count == 9
+        for call in mock_update.call_args_list:
+            assert {"alpha", "cmap"} <= set(call.args[1])
+
+        for sla in master.scatter_layer_artists:
+            assert sla.state.alpha == 0.3
+            assert sla.state.cmap is colormaps.members[3][1]
+            assert sla.scatter_artist.get_alpha() == 0.3
+
+    def test_pages(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.row_facet_att = self.penguin_data.id["island"]
+        viewer_state.max_num_cols = 2
+
+        master = self.viewer.layers[0]
+        assert viewer_state.num_col_pages == 2
+        assert viewer_state.page_label == "page 1 of 2"
+        assert self.viewer.axes_array.shape == (3, 2)
+        assert len(master.scatter_layer_artists) == 6
+
+        # Only the facets of the page being shown have artists
+        viewer_state.next_page()
+        assert viewer_state.col_page == 1
+        assert viewer_state.page_label == "page 2 of 2"
+        assert self.viewer.axes_array.shape == (3, 1)
+        assert len(master.scatter_layer_artists) == 3
+        assert len(viewer_state.layers) == 4
+        for sla in master.scatter_layer_artists:
+            assert sla.facet_col == 2
+            assert sla.state.facet_label.endswith("species = Gentoo")
+            x, y = sla.plot_artist.get_data()
+            assert len(x) == sla.facet_index.count(sla.facet_row, sla.facet_col)
+        assert sum(
+            len(sla.plot_artist.get_data()[0]) for sla in master.scatter_layer_artists
+        ) == NUM_GENTOO
+        masks = viewer_state.data_facet_masks
+        assert sum(np.size(m) - np.count_nonzero(m) for row in masks for m in row) == (
+            NUM_GENTOO
+        )
+
+        # There is no page after the last one
+        viewer_state.next_page()
+        assert viewer_state.col_page == 1
+
+        viewer_state.previous_page()
+        assert viewer_state.col_page == 0
+        assert self.viewer.axes_array.shape == (3, 2)
+
+        viewer_state.jump_to_category("Gentoo")
+        assert viewer_state.col_page == 1
+        viewer_state.jump_category = ("col", "Adelie")
+        assert viewer_state.col_page == 0
+
+        # Changing the facet attribute goes back to the first page
+        viewer_state.next_page()
+        viewer_state.col_facet_att = self.penguin_data.id["sex"]
+        assert viewer_state.col_page == 0
+
+    def test_pages_switch_facet_att(self):
+        viewer_state = self.viewer.state
+        self.penguin_data.add_component(
+            np.array([f"m{i % 12:02d}" for i in range(self.penguin_data.size)]),
+            "month",
+        )
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["month"]
+        viewer_state.max_num_cols = 4
+        viewer_state.next_page()
+        assert viewer_state.page_label == "page 2 of 3"
+
+        # The new attribute has fewer categories than the page being shown
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        master = self.viewer.layers[0]
+        assert viewer_state.col_page == 0
+        assert viewer_state.page_label == "page 1 of 1"
+        assert self.viewer.axes_array.shape == (1, 3)
+        assert [sla.facet_col for sla in master.scatter_layer_artists] == [0, 1, 2]
+
+        # Switching from a numeric facet attribute to a categorical one
+        viewer_state.col_facet_att = self.penguin_data.id["body_mass_g"]
+        viewer_state.next_page()
+        viewer_state.col_facet_att = self.penguin_data.id["island"]
+        assert viewer_state.page_label == "page 1 of 1"
+        assert len(master.scatter_layer_artists) == 3
+
+    def test_pages_density_cache(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.max_num_cols = 1
+        master = self.viewer.layers[0]
+        master.state.points_mode = "density"
+
+        # Density maps for recently viewed pages are reused
+        compute = type(master).compute_density_maps
+        with patch.object(
+            type(master), "compute_density_maps", autospec=True, side_effect=compute
+        ) as mock_compute:
+            self.viewer.figure.canvas.draw()
+            viewer_state.next_page()
+            self.viewer.figure.canvas.draw()
+            viewer_state.previous_page()
+            self.viewer.figure.canvas.draw()
+            assert mock_compute.call_count == 2
+
+    def test_numeric_facets(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["body_mass_g"]
+        viewer_state.col_num_bins = 4
+
+        master = self.viewer.layers[0]
+        assert viewer_state.num_cols == 4
+        assert len(master.scatter_layer_artists) == 4
+        body_mass = self.penguin_data["body_mass_g"]
+        n_points = [
+            len(sla.plot_artist.get_data()[0]) for sla in master.scatter_layer_artists
+        ]
+        assert sum(n_points) == np.count_nonzero(~np.isnan(body_mass))
+        assert master.scatter_layer_artists[0].state.title.startswith(
+            f"{np.nanmin(body_mass):g} <= body_mass_g <"
+        )
+
+        viewer_state.col_bin_mode = "edges"
+        viewer_state.col_bin_edges = "3000, 4000, 5000, 6000"
+        assert viewer_state.num_cols == 3
+        n_points = [
+            len(sla.plot_artist.get_data()[0]) for sla in master.scatter_layer_artists
+        ]
+        assert n_points[0] == np.count_nonzero((body_mass >= 3000) & (body_mass < 4000))
+
+        # Selections are restricted to the bin they are drawn in
+        self.viewer.apply_roi(RectangularROI(0, 100, 0, 100), 0, 1)
+        subset = self.penguin_data.subsets[0]
+        assert np.count_nonzero(subset.to_mask()) == n_points[1]
+
+    def test_facet_order(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.max_num_cols = 2
+
+        # The largest facets come first, so they are on the first page
+        viewer_state.col_order = "count"
+        master = self.viewer.layers[0]
+        assert viewer_state.facet_index.col_categories == ["Adelie", "Gentoo", "Chinstrap"]
+        n_points = [
+            len(sla.plot_artist.get_data()[0]) for sla in master.scatter_layer_artists
+        ]
+        assert n_points == [NUM_ADELIE, NUM_GENTOO]
+
+        viewer_state.col_top_k = 1
+        assert viewer_state.num_cols == 2
+        assert master.scatter_layer_artists[1].state.title == "species = Other"
+        n_points = [
+            len(sla.plot_artist.get_data()[0]) for sla in master.scatter_layer_artists
+        ]
+        assert n_points == [NUM_ADELIE, NUM_GENTOO + NUM_CHINSTRAP]
+
+        viewer_state.col_top_k = 0
+        viewer_state.order_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.order_statistic = "mean"
+        viewer_state.col_order = "statistic"
+        assert viewer_state.facet_index.col_categories[-1] == "Gentoo"
+
+    def test_pan_level_of_detail(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        viewer_state.pan_max_points = 100
+        master = self.viewer.layers[0]
+
+        def n_points():
+            return [
+                len(sla.plot_artist.get_data()[0]) for sla in master.scatter_layer_artists
+            ]
+
+        assert n_points() == [NUM_ADELIE, NUM_CHINSTRAP, NUM_GENTOO]
+
+        # While panning, large facets only draw a (reproducible) sample
+        self.viewer.toolbar.active_tool = "mpl:pan"
+        master._on_press()
+        assert master.panning
+        assert n_points() == [100, NUM_CHINSTRAP, 100]
+        sample = master.scatter_layer_artists[0].plot_artist.get_data()[0].copy()
+        x = self.penguin_data["bill_length_mm"][self.penguin_data["species"] == "Adelie"]
+        assert np.all(np.isin(sample, x))
+
+        master._on_release()
+        assert not master.panning
+        assert n_points() == [NUM_ADELIE, NUM_CHINSTRAP, NUM_GENTOO]
+
+        master._on_press()
+        np.testing.assert_array_equal(
+            master.scatter_layer_artists[0].plot_artist.get_data()[0], sample
+        )
+        master._on_release()
+
+        # Density maps are already frozen while panning by the density artist
+        master.state.points_mode = "density"
+        master._on_press()
+        assert not any(sla._reduced_detail for sla in master.scatter_layer_artists)
+        master._on_release()
+        self.viewer.toolbar.active_tool = None
+
+    def test_auto_density_map(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        master = self.viewer.layers[0]
+        facets = list(master.scatter_layer_artists)
+
+        # Each facet picks markers or a density map from its own size
+        master.state.density_threshold = 100
+        master.state.points_mode = "auto"
+        assert [sla.state.density_map for sla in facets] == [True, False, True]
+        assert len(facets[0].plot_artist.get_data()[0]) == 0
+        assert len(facets[1].plot_artist.get_data()[0]) == NUM_CHINSTRAP
+        compute = type(master).compute_density_maps
+        with patch.object(
+            type(master), "compute_density_maps", autospec=True, side_effect=compute
+        ) as mock_compute:
+            self.viewer.figure.canvas.draw()
+        # Only the facets shown as density maps are binned
+        binned = [sla for call in mock_compute.call_args_list for sla in call.kwargs["facets"]]
+        assert binned == [facets[0], facets[2]]
+        assert master._density_maps[1] is None
+
+        master.state.density_threshold = 130
+        assert [sla.state.density_map for sla in facets] == [True, False, False]
+        assert len(facets[2].plot_artist.get_data()[0]) == NUM_GENTOO
+
+        # Subsets choose from the number of points they select in each facet
+        self.data_collection.new_subset_group(
+            subset_state=self.penguin_data.id["bill_length_mm"] > 40, label="long"
+        )
+        self.viewer.layers[1].state.density_threshold = 130
+        subset_facets = self.viewer.layers[1].scatter_layer_artists
+        counts = [sla.state.facet_count for sla in subset_facets]
+        assert counts[0] < 130
+        assert [sla.state.density_map for sla in subset_facets] == [
+            count > 130 for count in counts
+        ]
+
+        self.data_collection.subset_groups[0].subset_state = (
+            self.penguin_data.id["bill_length_mm"] > 0
+        )
+        assert [sla.state.density_map for sla in subset_facets] == [True, False, False]
+        assert master.scatter_layer_artists == facets
+
+    def test_density_map_layout(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        master = self.viewer.layers[0]
+        master.state.points_mode = "density"
+        facets = master.scatter_layer_artists
+
+        # Each facet is binned at one bin per pixel of its axes
+        self.viewer.figure.canvas.draw()
+        layout = master._density_layout()
+        for sla in facets:
+            assert sla.density_artist.get_array().shape == layout[0]
+
+        # Facets whose axes have different sizes are binned in separate
+        # passes, and each facet gets the resolution of its own axes
+        histogram_range = ((12, 22), (30, 60))
+        sizes = {facets[0]: (10, 12), facets[1]: (10, 12), facets[2]: (5, 6)}
+        compute = type(master).compute_density_maps
+        with patch.object(
+            type(master), "_facet_bins", autospec=True, side_effect=lambda _, sla: sizes[sla]
+        ), patch.object(
+            type(master), "compute_density_maps", autospec=True, side_effect=compute
+        ) as mock_compute:
+            for sla in facets:
+                bins = sizes[sla]
+                expected = sla.state.compute_density_map(bins=bins, range=histogram_range)
+                actual = sla.compute_density_map(bins=bins, range=histogram_range)
+                np.testing.assert_allclose(actual, expected)
+            assert mock_compute.call_count == 2
+
+    def test_density_normalization(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        master = self.viewer.layers[0]
+        master.state.points_mode = "density"
+        facets = master.scatter_layer_artists
+
+        def vmax():
+            self.viewer.figure.canvas.draw()
+            return [sla.density_artist.get_clim()[1] for sla in facets]
+
+        assert master.state.density_normalization == "facet"
+        per_facet = vmax()
+        assert len(set(per_facet)) > 1
+
+        master.state.density_normalization = "shared"
+        shared = vmax()
+        assert shared == [max(per_facet)] * len(facets)
+
+    def test_cmap_normalization(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        master = self.viewer.layers[0]
+        body_mass = self.penguin_data["body_mass_g"]
+
+        with instrumentation.recording() as recorder:
+            with delay_callback(
+                master.state, "cmap_mode", "cmap_att", "cmap_vmin", "cmap_vmax"
+            ):
+                master.state.cmap_mode = "Linear"
+                master.state.cmap_att = self.penguin_data.id["body_mass_g"]
+                master.state.cmap_vmin = 3000
+                master.state.cmap_vmax = 5000
+            with delay_callback(master.state, "size_mode", "size_att"):
+                master.state.size_mode = "Linear"
+                master.state.size_att = self.penguin_data.id["body_mass_g"]
+        # The colors and sizes are computed once for all the facets
+        assert recorder.phase_stats("marker_colors")["calls"] == 1
+        assert recorder.phase_stats("marker_sizes")["calls"] == 1
+
+        def colors(sla):
+            return np.asarray(sla.scatter_artist.get_array())
+
+        for sla in master.scatter_layer_artists:
+            np.testing.assert_allclose(
+                colors(sla), (body_mass[sla._facet_indices] - 3000) / 2000, rtol=1e-6
+            )
+            assert len(sla.scatter_artist.get_sizes()) == len(sla._facet_indices)
+
+        # Each facet is colored from its own minimum to its own maximum
+        master.state.cmap_normalization = "facet"
+        for sla in master.scatter_layer_artists:
+            assert np.nanmin(colors(sla)) == 0
+            assert np.nanmax(colors(sla)) == 1
+
+        master.state.cmap_facet_percentile = 90
+        for sla in master.scatter_layer_artists:
+            values = body_mass[sla._facet_indices]
+            vmin, vmax = np.nanpercentile(values, [5, 95])
+            np.testing.assert_allclose(
+                colors(sla), (values - vmin) / (vmax - vmin), rtol=1e-5
+            )
+
+        # Density maps use the limits of each facet too
+        master.state.points_mode = "density"
+        self.viewer.figure.canvas.draw()
+        for sla in master.scatter_layer_artists:
+            values = body_mass[sla._facet_indices]
+            np.testing.assert_allclose(
+                sla.density_artist.get_clim(), np.nanpercentile(values, [5, 95])
+            )
+
+        editor = SmallMultiplesLayerStyleEditor(master)
+        assert not editor.ui.valuetext_cmap_vmin.isEnabled()
+        master.state.cmap_normalization = "shared"
+        assert editor.ui.valuetext_cmap_vmin.isEnabled()
+        assert editor.ui.combosel_cmap_facet_percentile.isHidden()
+
+    def test_instrumentation(self):
+        viewer_state = self.viewer.state
+
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        with instrumentation.recording() as recorder:
+            viewer_state.col_facet_att = self.penguin_data.id["island"]
+            self.viewer.figure.canvas.draw()
+
+        assert recorder.phase_stats("facet_index")["points"] == 344
+        assert recorder.phase_stats("prepare_facets")["points"] == 344
+        for name in ("facets_changed", "set_axes", "facet_update_data", "draw"):
+            assert recorder.phase_stats(name)["calls"] > 0
+        assert recorder.counter("facet_artists.created") == 3
+        assert recorder.counter("facet_artists.removed") == 3
+        assert recorder.counter("facet_redraws") > 0
+
+        master = self.viewer.layers[0]
+        master.state.points_mode = "density"
+        with instrumentation.recording() as recorder:
+            self.data_collection.new_subset_group(
+                subset_state=self.penguin_data.id["bill_length_mm"] > 40, label="long"
+            )
+            self.viewer.figure.canvas.draw()
+            self.viewer.figure.canvas.draw()
+
+        assert recorder.phase_stats("subset_mask")["calls"] > 0
+        assert recorder.phase_stats("draw")["calls"] == 2
+        # The density maps of all the facets are computed at once, and only
+        # the dataset is shown as density maps
+        assert recorder.counter("density_cache.misses") == 1
+        assert recorder.counter("density_cache.hits") > 0
+
+    def _activate_facet_tool(self, tool_id):
+        viewer_state = self.viewer.state
+        viewer_state.x_att = self.penguin_data.id["bill_length_mm"]
+        viewer_state.y_att = self.penguin_data.id["bill_depth_mm"]
+        viewer_state.col_facet_att = self.penguin_data.id["species"]
+        self.viewer.figure.canvas.draw()
+
+        self.viewer.toolbar.active_tool = tool_id
+        mode = self.viewer.toolbar.active_tool
+        # ROI tools are only created for the panels selections are made in
+        assert mode._roi_tools == {}
+
+        ax = self.viewer.axes_array[0, 2]
+        canvas = self.viewer.figure.canvas
+
+        def event(name, x, y, button=1):
+            return MouseEvent(name, canvas, *ax.transData.transform((x, y)), button=button)
+
+        return mode, ax, event
+
+    def _check_gentoo_selection(self, mode, ax):
+        assert list(mode._roi_tools) == [(0, 2)]
+        assert mode._roi_tools[(0, 2)]._axes is ax
+        subset = self.penguin_data.subsets[0]
+        selected = self.penguin_data["species"][subset.to_mask()]
+        assert len(selected) > 0
+        assert set(selected) == {"Gentoo"}
+        assert self.viewer.toolbar.active_tool is None
+
+    def test_facet_rectangle_mode(self):
+        mode, ax, event = self._activate_facet_tool("select:facetrectangle")
+
+        mode.press(event("button_press_event", 40, 14))
+        mode.move(event("motion_notify_event", 45, 15))
+        # The selection stays in the panel it started in
+        mode.move(event("motion_notify_event", 50, 16))
+        mode.release(event("button_release_event", 50, 16))
+
+        self._check_gentoo_selection(mode, ax)
+
+    def test_facet_lasso_mode(self):
+        mode, ax, event = self._activate_facet_tool("select:facetlasso")
+
+        mode.press(event("button_press_event", 40, 14))
+        for x, y in [(50, 14), (50, 17), (45, 16)]:
+            mode.move(event("motion_notify_event", x, y))
+        mode.release(event("button_release_event", 45, 16))
+
+        assert isinstance(mode.roi(), PolygonalROI)
+        assert len(mode.roi().vx) == 4
+        self._check_gentoo_selection(mode, ax)
+
+    def test_facet_polygon_mode(self):
+        mode, ax, event = self._activate_facet_tool("select:facetpolygon")
+        # The polygon and lasso tools have their own icons
+        assert os.path.exists(mode.icon)
+        assert mode.icon != self.viewer.toolbar.tools["select:facetlasso"].icon
+
+        for x, y in [(40, 14), (50, 14), (50, 17), (45, 16)]:
+            mode.press(event("button_press_event", x, y))
+            mode.release(event("button_release_event", x, y))
+        assert len(self.penguin_data.subsets) == 0
+        mode.key(KeyEvent("key_press_event", self.viewer.figure.canvas, "enter"))
+
+        assert len(mode.roi().vx) == 4
+        self._check_gentoo_selection(mode, ax)
@@ -1,3 +1,6 @@
+import json
+import os
+
 from glue.core import Data
 from glue_qt.app import GlueApplication
 
@@ -41,3 +44,84 @@ class TestSmallMultiplesViewer(object):
         assert viewer_state.row_facet_att is self.data.id["b"]
 
         assert len(viewer_state.layers) == 5
+
+    def test_render_session(self, tmp_path):
+        from glue_small_multiples.render import load_session, render
+
+        self.viewer.add_data(self.data)
+        self.viewer.state.x_att = self.data.id["x"]
+        self.viewer.state.y_att = self.data.id["y"]
+        self.viewer.state.col_facet_att = self.data.id["a"]
+        self.viewer.state.row_facet_att = self.data.id["b"]
+
+        filename = str(tmp_path / "session.glu")
+        self.app.save_session(filename)
+
+        session, viewers = load_session(filename)
+        assert len(viewers) == 1
+        state = viewers[0].state
+        assert state.x_att.label == "x"
+        assert state.col_facet_att.label == "a"
+        assert viewers[0].axes_array.shape == (2, 2)
+        assert len(state.layers) == 5
+
+        output = str(tmp_path / "session.png")
+        assert render(filename, output) == [output]
+        assert os.path.exists(output)
+
+    def test_render_session_patched(self, tmp_path):
+        from glue.config import session_patch
+        from glue_small_multiples.render import SESSION_VIEWER_TYPE, load_session
+
+        self.viewer.add_data(self.data)
+        self.viewer.state.col_facet_att = self.data.id["a"]
+        filename = str(tmp_path / "session.glu")
+        self.app.save_session(filename)
+
+        # Record the viewer under an older name, which only a session patch
+        # maps back to the current viewer
+        with open(filename) as fobj:
+            records = json.load(fobj)
+        legacy_type = "glue_small_multiples.qt.viewer.LegacySmallMultiplesViewer"
+        for rec in records.values():
+            if isinstance(rec, dict) and rec.get("_type") == SESSION_VIEWER_TYPE:
+                rec["_type"] = legacy_type
+        with open(filename, "w") as fobj:
+            json.dump(records, fobj)
+
+        def upgrade_viewer(rec):
+            for value in rec.values():
+                if isinstance(value, dict) and value.get("_type") == legacy_type:
+                    value["_type"] = SESSION_VIEWER_TYPE
+
+        session_patch.add(upgrade_viewer)
+        try:
+            session, viewers = load_session(filename)
+        finally:
+            session_patch.members.pop()
+        assert len(viewers) == 1
+        assert viewers[0].state.col_facet_att.label == "a"
+
+    def test_render_session_relative_paths(self, tmp_path, monkeypatch):
+        from glue.core.data_factories import load_data
+        from glue_small_multiples.render import load_session
+
+        # Relative paths are written relative to the working directory
+        (tmp_path / "table.csv").write_text("x,y,a\n1,2,p\n3,4,q\n")
+        monkeypatch.chdir(tmp_path)
+        data = load_data("table.csv")
+        self.data_collection.append(data)
+        self.viewer.add_data(data)
+        self.viewer.state.col_facet_att = data.id["a"]
+        self.app.save_session("session.glu", absolute_paths=False)
+
+        # The paths are resolved relative to the session file, without
+        # changing the working directory
+        other = tmp_path / "other"
+        other.mkdir()
+        monkeypatch.chdir(other)
+        session, viewers = load_session(str(tmp_path / "session.glu"))
+        assert os.getcwd() == str(other)
+        labels = [d.label for d in session.data_collection]
+        assert labels == ["d1", "table"]
+        assert viewers[0].state.col_facet_att.label == "a"
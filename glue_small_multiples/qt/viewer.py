@@ -1,34 +1,67 @@
-import numpy as np
-
-from echo import delay_callback
+import os
 
 from glue.config import viewer_tool
 from glue.core import roi
-from glue.core.subset import roi_to_subset_state
 
 from glue.utils import defer_draw, decorate_all_methods
 from glue_qt.viewers.matplotlib.data_viewer import MatplotlibDataViewer
 from glue.viewers.matplotlib.toolbar_mode import ToolbarModeBase
 from glue.viewers.scatter.viewer import MatplotlibScatterMixin
-from glue.core.roi_pretransforms import ProjectionMplTransform
 
-from glue_small_multiples.utils import PanTrackerMixin
+from glue_small_multiples.utils import PanelLocator, PanTrackerMixin
+from glue_small_multiples.viewer import SmallMultiplesViewerMixin
 from glue_small_multiples.layer_artist import SmallMultiplesLayerArtist
 from glue_small_multiples.state import SmallMultiplesViewerState
 from glue_small_multiples.qt.layer_style_editor import SmallMultiplesLayerStyleEditor
 from glue_small_multiples.qt.options_widget import SmallMultiplesOptionsWidget
 
 __all__ = [
+    "PanelBlitMixin",
+    "PanelRectangularROI",
+    "PanelPolygonalROI",
     "MultiplePossibleRoiModeBase",
     "MultiplePossibleRoiMode",
+    "MultiplePossibleClickRoiMode",
     "FacetRectangleMode",
+    "FacetPolygonMode",
+    "FacetLassoMode",
     "SmallMultiplesViewer",
 ]
 
+ICON_DIR = os.path.dirname(__file__)
+
+
+class PanelBlitMixin(object):
+    """
+    Mixin for Matplotlib ROIs drawn in one panel of the grid.
+
+    The background cached when a selection starts only covers the panel,
+    so only the panel is restored and blitted while the selection is drawn,
+    rather than the whole canvas.
+    """
+
+    def _draw(self):
+        canvas = self._axes.figure.canvas
+        if self._background_cache is None or not canvas.supports_blit:
+            canvas.draw_idle()
+        else:
+            canvas.restore_region(self._background_cache)
+            self._axes.draw_artist(self._patch)
+            canvas.blit(self._axes.bbox)
+
+
+class PanelRectangularROI(PanelBlitMixin, roi.MplRectangularROI):
+    pass
+
+
+class PanelPolygonalROI(PanelBlitMixin, roi.MplPolygonalROI):
+    pass
+
 
 class MultiplePossibleRoiModeBase(ToolbarModeBase):
     """
-    Base class for defining ROIs. ROIs accessible via the roi() method
+    Base class for defining ROIs in any of the panels of the grid. ROIs
+    accessible via the roi() method
 
     See RoiMode and ClickRoiMode subclasses for interaction details
 
@@ -37,6 +70,9 @@ class MultiplePossibleRoiModeBase(ToolbarModeBase):
     argument. Clients can use RoiMode.roi() to retrieve the new ROI, and take
     the appropriate action. By default, roi_callback will default to calling an
     ``apply_roi`` method on the data viewer.
+
+    The ROI tool of a panel is only created when a selection is first made
+    in it, by :meth:`_create_roi_tool`.
     """
 
     persistent = False  # clear the shape when drawing completes?
@@ -52,14 +88,17 @@ class MultiplePossibleRoiModeBase(ToolbarModeBase):
         """
 
         def apply_mode(mode):
-            self.viewer.apply_roi(self.roi(), self._col_axis_num, self._row_axis_num)
+            self.viewer.apply_roi(self.roi(), *self._panel)
 
         self._roi_callback = kwargs.pop("roi_callback", apply_mode)
         super(MultiplePossibleRoiModeBase, self).__init__(viewer, **kwargs)
-        self._roi_tools = []
+        self._axes_array = getattr(viewer, "axes_array", None)
+        self._locator = (
+            None if self._axes_array is None else PanelLocator(self._axes_array)
+        )
+        self._roi_tools = {}
         self._roi_tool = None
-        self._row_axis_num = 0
-        self._col_axis_num = 0
+        self._panel = (0, 0)
 
     def close(self, *args):
         self._roi_callback = None
@@ -69,23 +108,41 @@ class MultiplePossibleRoiModeBase(ToolbarModeBase):
         # For persistent ROIs, the user might e.g. pan and zoom around before
         # the selection is finalized. The Matplotlib ROIs cache the image
         # background to make things more efficient, but if the user pans/zooms
-        # we need to make sure we reset the background.
-        # TODO: Re-enable this for multiple patches
-        # The following attempt leaves behind patches when
-        # switching facets
-        # for _roi_tool in self._roi_tools:
-        #    if getattr(_roi_tool, '_mid_selection', False):
-        #        _roi_tool._reset_background()
-        #    _roi_tool._sync_patch()
+        # we need to make sure we reset the background. Only the panel with
+        # the current selection can have a patch to draw.
+        if getattr(self._roi_tool, "_mid_selection", False):
+            self._roi_tool._reset_background()
+            self._roi_tool._sync_patch()
         super(MultiplePossibleRoiModeBase, self).activate()
 
+    def _create_roi_tool(self, axes):
+        """
+        Create the Matplotlib ROI tool for the panel drawn in ``axes``.
+        """
+        raise NotImplementedError()
+
+    def _select_panel(self, event):
+        """
+        Make the ROI tool of the panel under ``event`` the current one,
+        creating it if needed. Returns `False` if there is no panel there.
+        """
+        panel = None if self._locator is None else self._locator.panel(event.x, event.y)
+        if panel is None:
+            self._roi_tool = None
+            return False
+        if panel not in self._roi_tools:
+            self._roi_tools[panel] = self._create_roi_tool(self._axes_array[panel])
+        self._roi_tool = self._roi_tools[panel]
+        self._panel = panel
+        return True
+
     def roi(self):
         """
         The ROI defined by this mouse mode
 
         Returns
         -------
-        list of roi : :class:`~glue.core.roi.Roi`
+        roi : :class:`~glue.core.roi.Roi`
         """
         return self._roi_tool.roi()
 
@@ -102,7 +159,7 @@ class MultiplePossibleRoiModeBase(ToolbarModeBase):
             self.viewer.toolbar.active_tool = None
 
     def clear(self):
-        for _roi_tool in self._roi_tools:
+        for _roi_tool in self._roi_tools.values():
             _roi_tool.reset()
 
 
@@ -111,7 +168,8 @@ class MultiplePossibleRoiMode(MultiplePossibleRoiModeBase):
     Define Roi Modes via click+drag events.
 
     ROIs are updated continuously on click+drag events, and finalized on each
-    mouse release
+    mouse release. The selection is made in the panel where the mouse was
+    pressed.
     """
 
     status_tip = (
@@ -136,20 +194,12 @@ class MultiplePossibleRoiMode(MultiplePossibleRoiModeBase):
         self._drag = True if status is None else status
 
     def press(self, event):
-        self._start_event = event
+        # Finding the panel once per press means that moving the mouse does
+        # not need to look for the panel under it
+        self._start_event = event if self._select_panel(event) else None
         super(MultiplePossibleRoiMode, self).press(event)
 
     def move(self, event):
-        i = 0
-        for axes, _roi_tool in zip(self._axes_array.flatten(), self._roi_tools):
-            if event.inaxes == axes:
-                self._roi_tool = _roi_tool
-                self._col_axis_num, self._row_axis_num = np.unravel_index(
-                    i, self._axes_array.shape
-                )
-                break
-            i += 1
-
         self._update_drag(event)
         if self._drag:
             self._roi_tool.update_selection(event)
@@ -164,25 +214,72 @@ class MultiplePossibleRoiMode(MultiplePossibleRoiModeBase):
 
     def key(self, event):
         if event.key == "escape":
-            for _roi_tool in self._roi_tools:
-                try:
-                    self._roi_tool.abort_selection(event)
-                except IndexError:
-                    pass
+            if self._roi_tool is not None:
+                self._roi_tool.abort_selection(event)
             self._drag = False
             self._drawing = False
             self._start_event = None
         super(MultiplePossibleRoiMode, self).key(event)
 
 
+class MultiplePossibleClickRoiMode(MultiplePossibleRoiModeBase):
+    """
+    Generate ROIs using clicks and click+drags.
+
+    ROIs are updated on each click, and each click+drag, in the panel where
+    the first click was made. ROIs are finalized on enter press, and reset
+    on escape press.
+    """
+
+    def __init__(self, viewer, **kwargs):
+        super(MultiplePossibleClickRoiMode, self).__init__(viewer, **kwargs)
+        self._last_event = None
+        self._drawing = False
+
+    def press(self, event):
+        if self._drawing and self._roi_tool is not None and self._roi_tool.active():
+            self._roi_tool.update_selection(event)
+        elif self._select_panel(event):
+            self._roi_tool.start_selection(event)
+            self._drawing = True
+        self._last_event = event
+        super(MultiplePossibleClickRoiMode, self).press(event)
+
+    def move(self, event):
+        if (
+            event.button is not None
+            and self._roi_tool is not None
+            and self._roi_tool.active()
+        ):
+            self._roi_tool.update_selection(event)
+            self._last_event = event
+        super(MultiplePossibleClickRoiMode, self).move(event)
+
+    def key(self, event):
+        if self._roi_tool is not None:
+            if event.key == "enter" and self._roi_tool.active():
+                self._finish_roi(self._last_event)
+                self._drawing = False
+            elif event.key == "escape":
+                self._roi_tool.abort_selection(event)
+                self._drawing = False
+        super(MultiplePossibleClickRoiMode, self).key(event)
+
+    def release(self, event):
+        if getattr(self._roi_tool, "_scrubbing", False):
+            self._finish_roi(event)
+        super(MultiplePossibleClickRoiMode, self).release(event)
+
+
+def _data_space(viewer):
+    return not hasattr(viewer.state, "plot_mode") or viewer.state.plot_mode == "rectilinear"
+
+
 @viewer_tool
 class FacetRectangleMode(MultiplePossibleRoiMode):
     """
-    Defines a Rectangular ROI, accessible via the :meth:`~RectangleMode.roi`
-    method
-
-    This kind of thing assumes that we have a single self._roi_tool
-    But I think what we want is a list of _roi_tools
+    Defines a Rectangular ROI in one of the panels, accessible via the
+    :meth:`~FacetRectangleMode.roi` method
     """
 
     icon = "glue_square"
@@ -191,23 +288,61 @@ class FacetRectangleMode(MultiplePossibleRoiMode):
     tool_tip = "Define a rectangular region of interest"
     shortcut = "R"
 
-    def __init__(self, viewer, **kwargs):
-        super(FacetRectangleMode, self).__init__(viewer, **kwargs)
-        data_space = (
-            not hasattr(viewer.state, "plot_mode")
-            or viewer.state.plot_mode == "rectilinear"
-        )
-        self._axes_array = getattr(viewer, "axes_array", None)
-        self._roi_tools = []
-        if self._axes_array is None:
-            return
-        for axes in self._axes_array.flatten():
-            self._roi_tools.append(roi.MplRectangularROI(axes, data_space=data_space))
+    def _create_roi_tool(self, axes):
+        return PanelRectangularROI(axes, data_space=_data_space(self.viewer))
+
+
+@viewer_tool
+class FacetPolygonMode(MultiplePossibleClickRoiMode):
+    """
+    Defines a Polygonal ROI in one of the panels, accessible via the
+    :meth:`~FacetPolygonMode.roi` method
+    """
+
+    icon = os.path.join(ICON_DIR, "facet_polygon.png")
+    tool_id = "select:facetpolygon"
+    action_text = "Polygonal ROI"
+    tool_tip = (
+        "Define a polygonal region of interest\n"
+        "  ENTER accepts the polygon\n"
+        "  ESCAPE clears the polygon"
+    )
+    status_tip = (
+        "CLICK (or CLICK and DRAG) to add vertices, ENTER to finalize, "
+        "ESC to cancel, CTRL-CLICK and DRAG to move selection"
+    )
+    shortcut = "G"
+
+    def _create_roi_tool(self, axes):
+        return PanelPolygonalROI(axes, data_space=_data_space(self.viewer))
+
+
+@viewer_tool
+class FacetLassoMode(MultiplePossibleRoiMode):
+    """
+    Defines a freehand ROI in one of the panels, drawn in a single click and
+    drag, and accessible via the :meth:`~FacetLassoMode.roi` method
+    """
+
+    icon = "glue_lasso"
+    tool_id = "select:facetlasso"
+    action_text = "Lasso ROI"
+    tool_tip = "Lasso a region of interest"
+    status_tip = (
+        "CLICK and DRAG to lasso a selection, CTRL-CLICK and DRAG to move selection"
+    )
+    shortcut = "L"
+
+    def _create_roi_tool(self, axes):
+        return PanelPolygonalROI(axes, data_space=_data_space(self.viewer))
 
 
 @decorate_all_methods(defer_draw)
 class SmallMultiplesViewer(
-    MatplotlibScatterMixin, MatplotlibDataViewer, PanTrackerMixin
+    SmallMultiplesViewerMixin,
+    MatplotlibScatterMixin,
+    MatplotlibDataViewer,
+    PanTrackerMixin,
 ):
     LABEL = "Small Multiples Viewer"
 
@@ -218,117 +353,22 @@ class SmallMultiplesViewer(
     _data_artist_cls = SmallMultiplesLayerArtist
     _subset_artist_cls = SmallMultiplesLayerArtist
 
-    tools = ["select:facetrectangle"]
+    tools = ["select:facetrectangle", "select:facetpolygon", "select:facetlasso"]
 
     def __init__(self, session, parent=None, state=None):
         proj = None if not state or not state.plot_mode else state.plot_mode
         MatplotlibDataViewer.__init__(
             self, session, parent=parent, state=state, projection=proj
         )
-        if self.axes is not None and self.figure is not None:
-            self.figure.delaxes(self.axes)
-        self.axes_array = self.figure.subplots(
-            self.state.num_rows,
-            self.state.num_cols,
-            sharex=True,
-            sharey=True,
-            squeeze=False,
-        )
-        self.axes = self.axes_array[0][0]
+        self.setup_axes_array()
 
         MatplotlibScatterMixin.setup_callbacks(self)
 
-        self.state.add_callback("num_cols", self._configure_axes_array, priority=9999)
-        self.state.add_callback("num_rows", self._configure_axes_array, priority=9999)
         if state is not None:
-            self.state._set_axes_subplots(axes_subplots=self.axes_array)
-            self.state._update_num_rows_cols()  # This sets our data_facets
-            self._configure_axes_array(force=True)
+            self._restore_axes_array()
             self.remove_all_toolbars()
 
-    def _configure_axes_array(self, force=False, *args):
-        with delay_callback(self.state, "num_cols", "num_cols"):
-            """
-            I took some of this code from _update_projection
-            in scatter._update_projection
-            """
-            # If the axes are the right shape we should just return
-            if (
-                self.axes_array.shape == (self.state.num_rows, self.state.num_cols)
-            ) and not force:
-                return
-
-            for ax in self.figure.axes:
-                self.figure.delaxes(ax)
-            self.redraw()
-
-            self.axes_array = self.figure.subplots(
-                self.state.num_rows,
-                self.state.num_cols,
-                sharex=True,
-                sharey=True,
-                squeeze=False,
-            )
-            self.axes = self.axes_array[0][0]
-            # if not force:
-            self.remove_all_toolbars()
-            self.initialize_toolbar()
-            self.state._set_axes_subplots(axes_subplots=self.axes_array)
-            self.axes.callbacks.connect("xlim_changed", self.limits_from_mpl)
-            self.axes.callbacks.connect("ylim_changed", self.limits_from_mpl)
-            self.update_x_axislabel()
-            self.update_y_axislabel()
-            self.update_x_ticklabel()
-            self.update_y_ticklabel()
-            self.state.x_log = self.state.y_log = False
-            self.state.reset_limits()
-
-            self.limits_to_mpl()
-            self.limits_from_mpl()
-
-            # We need to update the tick marks
-            # to account for the radians/degrees switch in polar mode
-            # Also need to add/remove axis labels as necessary
-            self._update_axes()
-
-            self.figure.canvas.draw_idle()
-
-    def get_layer_artist(self, cls, layer=None, layer_state=None):
-        return cls(self.axes_array, self.state, layer=layer, layer_state=layer_state)
-
-    def apply_roi(self, roi, col_axis_num=0, row_axis_num=0, override_mode=None):
-        self.redraw()
-
-        if len(self.layers) == 0:
-            return
-
-        use_transform = False  # self.state.plot_mode != 'rectilinear'
-        subset_state = roi_to_subset_state(
-            roi,
-            x_att=self.state.x_att,
-            x_categories=self.state.x_categories,
-            y_att=self.state.y_att,
-            y_categories=self.state.y_categories,
-            use_pretransform=use_transform,
-        )
-        if use_transform:
-            subset_state.pretransform = ProjectionMplTransform(
-                self.state.plot_mode,
-                self.axes.get_xlim(),
-                self.axes.get_ylim(),
-                self.axes.get_xscale(),
-                self.axes.get_yscale(),
-            )
-        facet_state = self.state.data_facet_subsets[col_axis_num][
-            row_axis_num
-        ].subset_state  # We need to get this index back from the roi_tool
-        subset_state = subset_state & facet_state
-        self.apply_subset_state(subset_state, override_mode=override_mode)
-
-    def draw_legend(self, *args):
-        # Old legend logic does not work
-        pass
-
-    def _on_resize(self, *args):
-        # Neither does the aspect_ratio call
-        pass
+    def _axes_array_changed(self):
+        # The ROI tools hold on to the axes they were created for
+        self.remove_all_toolbars()
+        self.initialize_toolbar()
@@ -0,0 +1,390 @@
+"""
+Render small multiples figures without Qt.
+
+This module provides a viewer that draws to an off-screen Agg canvas, so
+that figures can be exported from data files or saved glue sessions in
+scripts and batch jobs, along with the ``glue-small-multiples-render``
+command-line tool.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # pragma: nocover
+    resource = None  # Not available on Windows
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from glue.core.data_factories import load_data
+from glue.core.session import Session
+from glue.core.state import GlueUnSerializer
+from glue.viewers.common.viewer import Viewer
+from glue.viewers.matplotlib.mpl_axes import init_mpl
+from glue.viewers.matplotlib.viewer import MatplotlibViewerMixin
+from glue.viewers.scatter.viewer import MatplotlibScatterMixin
+
+from glue_small_multiples.viewer import SmallMultiplesViewerMixin
+from glue_small_multiples.layer_artist import SmallMultiplesLayerArtist
+from glue_small_multiples.state import SmallMultiplesViewerState
+
+__all__ = [
+    "FORMATS",
+    "HeadlessSmallMultiplesViewer",
+    "load_session",
+    "render",
+    "render_batch",
+    "main",
+]
+
+FORMATS = ["png", "svg", "pdf"]
+
+DEFAULT_FIGSIZE = (8.0, 6.0)
+DEFAULT_DPI = 100
+
+# Worker processes are replaced after this many jobs, so that memory which
+# Matplotlib or the data loaders hold on to is given back regularly
+DEFAULT_TASKS_PER_CHILD = 10
+
+# How the Qt viewer is recorded in session files
+SESSION_VIEWER_TYPE = "glue_small_multiples.qt.viewer.SmallMultiplesViewer"
+
+
+class _HeadlessCanvas(FigureCanvasAgg):
+    # Nothing is shown on screen, so the figure is only drawn when it is
+    # saved rather than every time the viewer asks for a redraw
+    def draw_idle(self, *args, **kwargs):
+        pass
+
+
+class HeadlessSmallMultiplesViewer(
+    SmallMultiplesViewerMixin,
+    MatplotlibScatterMixin,
+    MatplotlibViewerMixin,
+    Viewer,
+):
+    """
+    A small multiples viewer that draws to an off-screen Agg canvas.
+
+    It uses the same state and layer artists as the Qt viewer, so it can be
+    set up in the same way (or restored from a session with
+    :func:`load_session`) and then exported with :meth:`savefig`.
+    """
+
+    LABEL = "Small Multiples Viewer"
+
+    _state_cls = SmallMultiplesViewerState
+    _data_artist_cls = SmallMultiplesLayerArtist
+    _subset_artist_cls = SmallMultiplesLayerArtist
+
+    def __init__(
+        self, session, parent=None, state=None, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI
+    ):
+        Viewer.__init__(self, session, state=state)
+        proj = None if not state or not state.plot_mode else state.plot_mode
+        figure = Figure(figsize=figsize, dpi=dpi)
+        _HeadlessCanvas(figure)
+        self.figure, self.axes = init_mpl(figure, projection=proj)
+        MatplotlibViewerMixin.setup_callbacks(self)
+
+        self.setup_axes_array()
+
+        MatplotlibScatterMixin.setup_callbacks(self)
+
+        if state is not None:
+            self._restore_axes_array()
+
+    def savefig(self, filename, format=None, **kwargs):
+        """
+        Save the figure to ``filename``. The format is taken from the file
+        extension unless ``format`` is given.
+        """
+        self.figure.savefig(filename, format=format, **kwargs)
+
+
+def _resolve_paths(records, start):
+    # Data loaded from files is recorded in LoadLog entries with the path of
+    # the file, which can be relative to the directory of the session file.
+    # Making these absolute avoids changing the working directory to load it.
+    for rec in records.values():
+        if not isinstance(rec, dict) or not rec.get("_type", "").endswith(".LoadLog"):
+            continue
+        path = rec.get("path")
+        if isinstance(path, str) and not os.path.isabs(path):
+            rec["path"] = os.path.normpath(os.path.join(start, path))
+
+
+def load_session(path, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI):
+    """
+    Restore the small multiples viewers from a glue session file without
+    creating a glue application.
+
+    Other viewers in the session are skipped. As in glue, relative paths in
+    the session file are relative to the directory the session file is in.
+    Returns the :class:`~glue.core.session.Session` and the list of restored
+    :class:`HeadlessSmallMultiplesViewer`.
+    """
+    with open(path) as fobj:
+        records = json.load(fobj)
+    _resolve_paths(records, os.path.dirname(os.path.abspath(path)))
+    context = GlueUnSerializer.loads(json.dumps(records))
+
+    # The application record is only used to find the data and viewers,
+    # since restoring it would need the Qt application. The records are read
+    # back from the unserializer since glue and plugins patch them in place
+    # there (e.g. to upgrade older sessions).
+    records = context._rec
+    rec = records["__main__"]
+    session = Session(data_collection=context.object(rec["data"]))
+    context.register_object(rec["session"], session)
+
+    viewers = []
+    for tab in rec.get("viewers", []):
+        for viewer_id in tab:
+            viewer_rec = dict(records[viewer_id])
+            if viewer_rec.pop("_type") != SESSION_VIEWER_TYPE:
+                continue
+            viewer = HeadlessSmallMultiplesViewer.__setgluestate__(viewer_rec, context)
+            viewer.figure.set_size_inches(figsize)
+            viewer.figure.set_dpi(dpi)
+            context.register_object(viewer_id, viewer)
+            viewers.append(viewer)
+
+    return session, viewers
+
+
+def _configure(viewer, x_att=None, y_att=None, col_facet_att=None,
+               row_facet_att=None, max_num_cols=None, max_num_rows=None):
+    state = viewer.state
+    data = state.reference_data
+    if max_num_cols is not None:
+        state.max_num_cols = max_num_cols
+    if max_num_rows is not None:
+        state.max_num_rows = max_num_rows
+    # The facets are set last so the grid is only laid out once
+    for name, label in [
+        ("x_att", x_att),
+        ("y_att", y_att),
+        ("col_facet_att", col_facet_att),
+        ("row_facet_att", row_facet_att),
+    ]:
+        if label is not None:
+            setattr(state, name, data.id[label])
+
+
+def _numbered(output, index):
+    root, ext = os.path.splitext(output)
+    return f"{root}_{index}{ext}"
+
+
+def render(input, output, format=None, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI,
+           **options):
+    """
+    Render small multiples from ``input`` to ``output``.
+
+    Parameters
+    ----------
+    input : str
+        A glue session (``.glu``) file, in which case every small multiples
+        viewer in it is rendered, or any data file glue can read.
+    output : str
+        The file to write. When a session has several small multiples
+        viewers, their figures are written to ``<name>_<index>.<ext>``.
+    format : str, optional
+        One of :data:`FORMATS`. Defaults to the extension of ``output``.
+    figsize, dpi
+        The size of the figure in inches and its resolution.
+    **options
+        ``x_att``, ``y_att``, ``col_facet_att`` and ``row_facet_att`` give
+        the labels of the attributes to show, and ``max_num_cols`` and
+        ``max_num_rows`` the size of the grid. Options that are not given
+        keep their value from the session, or the viewer defaults.
+
+    Returns
+    -------
+    list of str
+        The files written.
+    """
+    format = format or os.path.splitext(output)[1][1:].lower() or "png"
+    if format not in FORMATS:
+        raise ValueError(
+            f"Unsupported format {format!r}, should be one of {', '.join(FORMATS)}"
+        )
+
+    if input.endswith(".glu"):
+        session, viewers = load_session(input, figsize=figsize, dpi=dpi)
+        if not viewers:
+            raise ValueError(f"No small multiples viewers found in {input}")
+    else:
+        session = Session()
+        data = load_data(input)
+        session.data_collection.append(data)
+        viewer = HeadlessSmallMultiplesViewer(session, figsize=figsize, dpi=dpi)
+        viewer.register_to_hub(session.hub)
+        viewer.add_data(data)
+        viewers = [viewer]
+
+    if len(viewers) == 1:
+        outputs = [output]
+    else:
+        outputs = [_numbered(output, index) for index in range(len(viewers))]
+
+    try:
+        for viewer, filename in zip(viewers, outputs):
+            _configure(viewer, **options)
+            viewer.savefig(filename, format=format)
+    finally:
+        for viewer in viewers:
+            viewer.cleanup()
+
+    return outputs
+
+
+def _limit_memory(max_memory):
+    # Pool initializer: cap the address space of the worker, so that a job
+    # which needs too much memory fails with a MemoryError in that worker
+    # instead of the whole machine swapping
+    if max_memory is None or resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_memory = min(max_memory, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+
+
+def _render_job(job):
+    try:
+        return render(**job), None
+    except Exception as exc:
+        return [], f"{type(exc).__name__}: {exc}"
+
+
+def render_batch(jobs, processes=None, max_memory=None,
+                 maxtasksperchild=DEFAULT_TASKS_PER_CHILD):
+    """
+    Run several :func:`render` jobs in a pool of worker processes.
+
+    Parameters
+    ----------
+    jobs : iterable of dict
+        The keyword arguments to :func:`render` for each job.
+    processes : int, optional
+        The number of worker processes, defaults to the number of CPUs. With
+        a single process and no memory limit, the jobs are run in this
+        process.
+    max_memory : int, optional
+        The maximum address space of each worker, in bytes. Not supported on
+        Windows, where it is ignored.
+    maxtasksperchild : int, optional
+        The number of jobs after which a worker is replaced by a new one.
+
+    Returns
+    -------
+    list of tuple
+        For each job in order, the list of files written and ``None``, or an
+        empty list and the error message if the job failed. A failed job
+        does not stop the others.
+    """
+    jobs = list(jobs)
+    if processes == 1 and max_memory is None:
+        return [_render_job(job) for job in jobs]
+
+    # Spawn rather than fork, so that workers do not inherit threads or a Qt
+    # application from the calling process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(
+        processes,
+        initializer=_limit_memory,
+        initargs=(max_memory,),
+        maxtasksperchild=maxtasksperchild,
+    ) as pool:
+        return list(pool.imap(_render_job, jobs))
+
+
+def main(argv=None):
+    """
+    Entry point for the ``glue-small-multiples-render`` command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="glue-small-multiples-render",
+        description="Render small multiples figures from data or glue session files.",
+    )
+    parser.add_argument("inputs", nargs="+", metavar="INPUT",
+                        help="data files, or glue session (.glu) files")
+    parser.add_argument("-o", "--output",
+                        help="output file, only allowed with a single input")
+    parser.add_argument("-d", "--output-dir", default=".",
+                        help="directory to write the figures to (default: %(default)s)")
+    parser.add_argument("-f", "--format", choices=FORMATS,
+                        help="output format (default: from --output, or png)")
+    parser.add_argument("-x", dest="x_att", metavar="ATT", help="x attribute")
+    parser.add_argument("-y", dest="y_att", metavar="ATT", help="y attribute")
+    parser.add_argument("--col", dest="col_facet_att", metavar="ATT",
+                        help="attribute to facet columns on")
+    parser.add_argument("--row", dest="row_facet_att", metavar="ATT",
+                        help="attribute to facet rows on")
+    parser.add_argument("--max-cols", dest="max_num_cols", type=int,
+                        help="maximum number of columns")
+    parser.add_argument("--max-rows", dest="max_num_rows", type=int,
+                        help="maximum number of rows")
+    parser.add_argument("--size", nargs=2, type=float, default=DEFAULT_FIGSIZE,
+                        metavar=("WIDTH", "HEIGHT"),
+                        help="figure size in inches (default: %(default)s)")
+    parser.add_argument("--dpi", type=float, default=DEFAULT_DPI,
+                        help="figure resolution (default: %(default)s)")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+                        help="number of worker processes, 0 for one per CPU "
+                             "(default: %(default)s)")
+    parser.add_argument("--max-memory", type=float, metavar="MB",
+                        help="maximum memory of each worker process, in MB")
+    parser.add_argument("--max-tasks-per-child", type=int,
+                        default=DEFAULT_TASKS_PER_CHILD,
+                        help="jobs after which a worker process is replaced "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.output and len(args.inputs) > 1:
+        parser.error("--output can only be used with a single input")
+
+    options = {
+        name: getattr(args, name)
+        for name in ("x_att", "y_att", "col_facet_att", "row_facet_att",
+                     "max_num_cols", "max_num_rows")
+        if getattr(args, name) is not None
+    }
+    jobs = []
+    for path in args.inputs:
+        if args.output:
+            output = args.output
+        else:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            output = os.path.join(args.output_dir, f"{stem}.{args.format or 'png'}")
+        jobs.append(dict(input=path, output=output, format=args.format,
+                         figsize=tuple(args.size), dpi=args.dpi, **options))
+
+    max_memory = None if args.max_memory is None else int(args.max_memory * 2**20)
+    results = render_batch(
+        jobs,
+        processes=args.processes or None,
+        max_memory=max_memory,
+        maxtasksperchild=args.max_tasks_per_child,
+    )
+
+    status = 0
+    for job, (outputs, error) in zip(jobs, results):
+        if error is None:
+            for output in outputs:
+                print(output)
+        else:
+            print(f"{job['input']}: {error}", file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
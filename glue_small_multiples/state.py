@@ -1,3 +1,6 @@
+import operator
+from functools import reduce
+
 import numpy as np
 
 from glue.viewers.matplotlib.state import (
@@ -6,9 +9,23 @@ from glue.viewers.matplotlib.state import (
 )
 from glue.config import session_patch
 from glue.core.data_combo_helper import ManualDataComboHelper, ComponentIDComboHelper
-from glue.core.subset import Subset
+from glue.core.exceptions import IncompatibleAttribute
+from glue.core.roi import PolygonalROI
+from glue.core.subset import MaskSubsetState, Subset, roi_to_subset_state
 from glue.viewers.scatter.state import ScatterLayerState, ScatterViewerState
 
+from glue_small_multiples import instrumentation
+from glue_small_multiples.density import STATISTICS
+from glue_small_multiples.facets import (
+    BIN_MODES,
+    ORDER_MODES,
+    ORDER_STATISTICS,
+    FacetBinning,
+    FacetIndex,
+    FacetMaskGrid,
+    FacetOrder,
+)
+
 
 __all__ = [
     "FacetSubset",
@@ -17,6 +34,57 @@ __all__ = [
     "SmallMultiplesLayerState",
 ]
 
+BIN_MODES_DISPLAY = {
+    "equal": "Equal width",
+    "quantile": "Quantiles",
+    "edges": "Custom edges",
+}
+
+ORDER_MODES_DISPLAY = {
+    "default": "Default",
+    "alphabetical": "Alphabetical",
+    "count": "Largest first",
+    "statistic": "By statistic",
+}
+
+ORDER_STATISTICS_DISPLAY = {
+    "mean": "Mean",
+    "sum": "Sum",
+    "min": "Minimum",
+    "max": "Maximum",
+}
+
+DENSITY_NORMALIZATIONS = ["facet", "shared"]
+
+DENSITY_NORMALIZATIONS_DISPLAY = {
+    "facet": "Per facet",
+    "shared": "Shared by all facets",
+}
+
+CMAP_NORMALIZATIONS = ["shared", "facet"]
+
+CMAP_NORMALIZATIONS_DISPLAY = {
+    "shared": "Shared by all facets",
+    "facet": "Per facet",
+}
+
+CMAP_PERCENTILES = [100, 99.5, 99, 95, 90]
+
+CMAP_PERCENTILES_DISPLAY = {
+    100: "Min/Max",
+    99.5: "99.5%",
+    99: "99%",
+    95: "95%",
+    90: "90%",
+}
+
+STATISTICS_DISPLAY = {
+    "mean": "Mean",
+    "min": "Minimum",
+    "max": "Maximum",
+    "median": "Median",
+}
+
 
 class FacetSubset(Subset):
     """A convenience class to prevent facet subset labels from
@@ -37,12 +105,33 @@ class FacetSubset(Subset):
         self._label = value
 
 
+def _points_in_roi(roi, x, y, indices):
+    """
+    The subset of ``indices`` for which the points ``x``, ``y`` are inside
+    ``roi``.
+    """
+    x, y = x[indices], y[indices]
+    if isinstance(roi, PolygonalROI):
+        # Testing whether points are inside a polygon is expensive, and a
+        # polygon drawn in one facet usually only covers a small part of it,
+        # so only the points inside its bounding box are tested
+        vx, vy = np.asarray(roi.vx, dtype=float), np.asarray(roi.vy, dtype=float)
+        keep = np.flatnonzero(
+            (x >= vx.min()) & (x <= vx.max()) & (y >= vy.min()) & (y <= vy.max())
+        )
+        indices, x, y = indices[keep], x[keep], y[keep]
+    return indices[roi.contains(x, y)]
+
+
 class SmallMultiplesViewerState(ScatterViewerState):
     """
     State for a Small Multiples Viewer
 
-    The user can chose to facet on one or two categorical attributes.
-    Ideally we should allow them to facet on integer attributes too.
+    The user can chose to facet on one or two attributes. Numeric
+    attributes are split into bins, which can have equal widths, contain
+    similar numbers of values, or be given explicitly. Facets can be ordered
+    by their number of elements or by a statistic of another attribute, and
+    the facets beyond the first few can be grouped in a single "Other" facet.
     """
 
     col_facet_att = DDSCProperty(
@@ -51,6 +140,26 @@ class SmallMultiplesViewerState(ScatterViewerState):
     row_facet_att = DDSCProperty(
         docstring="The attribute to facet rows by", default_index=1
     )
+    col_bin_mode = DDSCProperty(docstring="How to bin a numeric column attribute")
+    col_num_bins = DDCProperty(5, docstring="The number of column bins")
+    col_bin_edges = DDCProperty("", docstring="Comma-separated column bin edges")
+    row_bin_mode = DDSCProperty(docstring="How to bin a numeric row attribute")
+    row_num_bins = DDCProperty(5, docstring="The number of row bins")
+    row_bin_edges = DDCProperty("", docstring="Comma-separated row bin edges")
+
+    col_order = DDSCProperty(docstring="How to order the column facets")
+    col_top_k = DDCProperty(
+        0, docstring="The number of column facets to show before grouping "
+        "the others (0 shows all facets)"
+    )
+    row_order = DDSCProperty(docstring="How to order the row facets")
+    row_top_k = DDCProperty(
+        0, docstring="The number of row facets to show before grouping "
+        "the others (0 shows all facets)"
+    )
+    order_att = DDSCProperty(docstring="The attribute to order facets by")
+    order_statistic = DDSCProperty(docstring="The statistic to order facets by")
+
     # We should be able to make these spinners in the GUI that cannot go below 1
     max_num_cols = DDCProperty(5, docstring="The maximum number of columns to show")
     max_num_rows = DDCProperty(5, docstring="The maximum number of rows to show")
@@ -58,8 +167,34 @@ class SmallMultiplesViewerState(ScatterViewerState):
     num_cols = DDCProperty(1, docstring="The number of columns to display in the grid")
     num_rows = DDCProperty(1, docstring="The number of rows to display in the grid")
 
+    # Attributes with more categories than fit in the grid are shown in pages
+    col_page = DDCProperty(0, docstring="The page of column categories to show")
+    row_page = DDCProperty(0, docstring="The page of row categories to show")
+    page_label = DDCProperty("", docstring="A description of the page being shown")
+    jump_category = DDSCProperty(
+        docstring="A facet category to show the page of", comparison_type="equality"
+    )
+
     reference_data = DDSCProperty(docstring="The dataset being displayed")
 
+    num_workers = DDCProperty(
+        1,
+        docstring="The number of threads used to prepare facets and compute "
+        "density maps (1 computes everything on the main thread)",
+    )
+
+    pan_max_points = DDCProperty(
+        10000,
+        docstring="The maximum number of points drawn in each facet while "
+        "panning and zooming (0 always draws all points)",
+    )
+
+    broadcast_roi = DDCProperty(
+        False,
+        docstring="Whether selections made in one facet apply to the same "
+        "region of every facet in the grid",
+    )
+
     def __init__(self, **kwargs):
         self.axes_subplots = None
 
@@ -68,17 +203,50 @@ class SmallMultiplesViewerState(ScatterViewerState):
             []
         )  # We can only initialize this if we have a dataset defined
         self.data_facet_subsets = []
+        self.facet_index = None
+        self._facet_index_key = None
+        self._facet_options_key = None
+        self._facet_offsets = (0, 0)
         self.temp_num_cols = 0
         self.temp_num_rows = 0
         self.ref_data_helper = ManualDataComboHelper(self, "reference_data")
         self.col_facet_att_helper = ComponentIDComboHelper(
-            self, "col_facet_att", categorical=True, numeric=False
+            self, "col_facet_att", categorical=True, numeric=True, datetime=True
         )
         self.row_facet_att_helper = ComponentIDComboHelper(
-            self, "row_facet_att", categorical=True, numeric=False, none=True
+            self, "row_facet_att", categorical=True, numeric=True, datetime=True, none=True
         )
+        self.order_att_helper = ComponentIDComboHelper(self, "order_att", numeric=True)
+        for prop, choices, display in (
+            ("col_bin_mode", BIN_MODES, BIN_MODES_DISPLAY),
+            ("row_bin_mode", BIN_MODES, BIN_MODES_DISPLAY),
+            ("col_order", ORDER_MODES, ORDER_MODES_DISPLAY),
+            ("row_order", ORDER_MODES, ORDER_MODES_DISPLAY),
+            ("order_statistic", ORDER_STATISTICS, ORDER_STATISTICS_DISPLAY),
+        ):
+            getattr(SmallMultiplesViewerState, prop).set_display_func(self, display.get)
+            getattr(SmallMultiplesViewerState, prop).set_choices(self, choices)
+        # The category to jump to follows the page being shown, and its
+        # choices are only known once the facets are, so it is not restored
+        kwargs.pop("jump_category", None)
         self.update_from_dict(kwargs)
 
+        # Changing the facet attributes starts again from the first page
+        self.add_callback("col_facet_att", self._reset_col_page, priority=10001)
+        self.add_callback("row_facet_att", self._reset_row_page, priority=10001)
+        self.add_callback("col_page", self._update_num_rows_cols, priority=10000)
+        self.add_callback("row_page", self._update_num_rows_cols, priority=10000)
+        for prop in ("bin_mode", "num_bins", "bin_edges", "order", "top_k"):
+            self.add_callback(f"col_{prop}", self._reset_col_page, priority=10001)
+            self.add_callback(f"row_{prop}", self._reset_row_page, priority=10001)
+            self.add_callback(f"col_{prop}", self._update_num_rows_cols, priority=10000)
+            self.add_callback(f"row_{prop}", self._update_num_rows_cols, priority=10000)
+        for prop in ("order_att", "order_statistic"):
+            self.add_callback(prop, self._reset_col_page, priority=10001)
+            self.add_callback(prop, self._reset_row_page, priority=10001)
+            self.add_callback(prop, self._update_num_rows_cols, priority=10000)
+        self.add_callback("jump_category", self._jump_to_selected_category)
+
         self.add_callback("col_facet_att", self._update_num_rows_cols, priority=10000)
         self.add_callback("row_facet_att", self._update_num_rows_cols, priority=10000)
         self.add_callback("reference_data", self._update_num_rows_cols, priority=10000)
@@ -104,20 +272,25 @@ class SmallMultiplesViewerState(ScatterViewerState):
         ):
             return
 
-        if self.col_facet_att is not None:
-            self.temp_num_cols = min(
-                int(self.max_num_cols),
-                len(self.reference_data[self.col_facet_att].categories),
-            )
-        else:
-            self.temp_num_cols = 1
-        if self.row_facet_att is not None:
-            self.temp_num_rows = min(
-                int(self.max_num_rows),
-                len(self.reference_data[self.row_facet_att].categories),
-            )
-        else:
-            self.temp_num_rows = 1
+        self._update_facet_index()
+        if self.facet_index is None:
+            return
+
+        # Make sure the pages are still valid, for example if the maximum
+        # grid size increased. Setting them calls this method again.
+        col_page = min(max(int(self.col_page), 0), self.num_col_pages - 1)
+        row_page = min(max(int(self.row_page), 0), self.num_row_pages - 1)
+        if (col_page, row_page) != (self.col_page, self.row_page):
+            self.col_page = col_page
+            self.row_page = row_page
+            return
+
+        self.temp_num_cols = min(
+            int(self.max_num_cols), self.facet_index.num_cols - self.facet_col_offset
+        )
+        self.temp_num_rows = min(
+            int(self.max_num_rows), self.facet_index.num_rows - self.facet_row_offset
+        )
 
         self._facets_changed()
         if (self.num_cols != self.temp_num_cols) or (
@@ -126,106 +299,309 @@ class SmallMultiplesViewerState(ScatterViewerState):
             self.num_cols = self.temp_num_cols
             self.num_rows = self.temp_num_rows
 
-    def _facets_changed(self, *args):
+        # Setting the page label notifies the layer artists, which rebuild
+        # their facets from the grid, so it has to wait until the facets and
+        # the grid match the new facet index.
+        self._update_page_label()
+
+    def _update_categories(self):
+        # The choices are ("col" or "row", category) rather than including
+        # the attribute itself, because ComponentID overloads ==.
+        atts = {"col": self.col_facet_att, "row": self.row_facet_att}
+        choices = []
+        if self.facet_index is not None:
+            for axis, categories in (
+                ("col", self.facet_index.col_categories),
+                ("row", self.facet_index.row_categories),
+            ):
+                if atts[axis] is not None:
+                    choices.extend((axis, category) for category in categories)
+        SmallMultiplesViewerState.jump_category.set_display_func(
+            self, lambda choice: f"{atts[choice[0]].label}: {choice[1]}"
+        )
+        SmallMultiplesViewerState.jump_category.set_choices(self, choices)
+
+    @property
+    def num_col_pages(self):
+        """
+        The number of pages needed to show all the column categories.
+        """
+        if self.facet_index is None:
+            return 1
+        return max(1, -(-self.facet_index.num_cols // int(self.max_num_cols)))
+
+    @property
+    def num_row_pages(self):
+        """
+        The number of pages needed to show all the row categories.
+        """
+        if self.facet_index is None:
+            return 1
+        return max(1, -(-self.facet_index.num_rows // int(self.max_num_rows)))
+
+    @property
+    def facet_col_offset(self):
+        """
+        The position in the facet index of the first column shown.
+        """
+        return int(self.col_page) * int(self.max_num_cols)
+
+    @property
+    def facet_row_offset(self):
+        """
+        The position in the facet index of the first row shown.
+        """
+        return int(self.row_page) * int(self.max_num_rows)
+
+    def facet_cell(self, row, col):
+        """
+        The position in the facet index of the facet shown at ``row`` and
+        ``col`` of the grid.
+        """
+        row_offset, col_offset = self._facet_offsets
+        return row + row_offset, col + col_offset
+
+    def roi_subset_state(self, roi, cells=None):
+        """
+        The subset state selecting the points inside ``roi`` in the facets
+        shown in the grid ``cells``, given as a list of ``(row, col)``, or
+        in every facet of the grid if ``cells`` is `None`.
+
+        When the x and y attributes are numerical, only the points of those
+        facets, found with the facet index, are tested against the ROI, and
+        the selection is stored as a mask. Otherwise the ROI subset state is
+        combined with the subset states of the facets.
+        """
+        if cells is None:
+            cells = list(np.ndindex(self.temp_num_rows, self.temp_num_cols))
+        with instrumentation.phase("roi_selection") as phase:
+            subset_state = self._facet_roi_mask_state(roi, cells, phase)
+        if subset_state is not None:
+            return subset_state
+
+        subset_state = roi_to_subset_state(
+            roi,
+            x_att=self.x_att,
+            x_categories=self.x_categories,
+            y_att=self.y_att,
+            y_categories=self.y_categories,
+        )
+        facet_state = reduce(
+            operator.or_,
+            [self.data_facet_subsets[row][col].subset_state for row, col in cells],
+        )
+        return subset_state & facet_state
+
+    def _facet_roi_mask_state(self, roi, cells, phase):
+        data = self.reference_data
+        if (
+            self.facet_index is None
+            or data is None
+            or not roi.defined()
+            or self.plot_mode not in (None, "rectilinear")
+            or self.facet_index.data is not data
+        ):
+            return None
+        try:
+            if any(
+                data.get_kind(att) != "numerical" for att in (self.x_att, self.y_att)
+            ):
+                return None
+            x = data[self.x_att].ravel()
+            y = data[self.y_att].ravel()
+        except IncompatibleAttribute:
+            return None
+
+        indices = np.concatenate(
+            [self.facet_index.indices(*self.facet_cell(row, col)) for row, col in cells]
+        )
+        phase.add_points(len(indices))
+        mask = np.zeros(data.size, dtype=bool)
+        mask[_points_in_roi(roi, x, y, indices)] = True
+        return MaskSubsetState(mask.reshape(data.shape), data.pixel_component_ids)
+
+    def next_page(self, *args):
+        """
+        Show the next page of facets, moving across the column pages first.
+        """
+        self._set_page(self.row_page * self.num_col_pages + self.col_page + 1)
+
+    def previous_page(self, *args):
+        """
+        Show the previous page of facets.
+        """
+        self._set_page(self.row_page * self.num_col_pages + self.col_page - 1)
+
+    def _set_page(self, page):
+        num_pages = self.num_col_pages * self.num_row_pages
+        if not 0 <= page < num_pages:
+            return
+        # The pages are set one at a time (rather than with delay_callback)
+        # so that the grid is updated before layer artists are notified.
+        row_page, col_page = divmod(page, self.num_col_pages)
+        self.row_page = row_page
+        self.col_page = col_page
+
+    def jump_to_category(self, category, axis=None):
+        """
+        Show the page containing ``category``.
+
+        Parameters
+        ----------
+        category : str
+            The category to show.
+        axis : {'col', 'row'}, optional
+            Whether ``category`` is a column or row category. By default, the
+            column categories are searched first, then the row categories.
+        """
+        if self.facet_index is None:
+            return
+        for facet_axis, att, categories, max_num in (
+            ("col", self.col_facet_att, self.facet_index.col_categories, self.max_num_cols),
+            ("row", self.row_facet_att, self.facet_index.row_categories, self.max_num_rows),
+        ):
+            if att is None or axis not in (None, facet_axis):
+                continue
+            if category in categories:
+                page = categories.index(category) // int(max_num)
+                setattr(self, f"{facet_axis}_page", page)
+                return
+        raise ValueError(f"{category} is not a facet category")
+
+    def _jump_to_selected_category(self, *args):
+        if self.jump_category is not None:
+            axis, category = self.jump_category
+            self.jump_to_category(category, axis=axis)
+
+    def _reset_col_page(self, *args):
+        self.col_page = 0
+
+    def _reset_row_page(self, *args):
+        self.row_page = 0
+
+    def _update_page_label(self):
+        num_pages = self.num_col_pages * self.num_row_pages
+        page = self.row_page * self.num_col_pages + self.col_page
+        self.page_label = f"page {page + 1} of {num_pages}"
+
+        # Show the first category of the page, so that picking any other
+        # category is a change that jumps to its page.
+        for axis, att, categories, offset in (
+            ("col", self.col_facet_att, self.facet_index.col_categories, self.facet_col_offset),
+            ("row", self.row_facet_att, self.facet_index.row_categories, self.facet_row_offset),
+        ):
+            if att is not None:
+                self.jump_category = (axis, categories[offset])
+                break
+
+    def _update_facet_index(self):
+        """
+        Rebuild the facet index if the dataset or facet attributes changed.
+        """
         if ((self.col_facet_att is None) and (self.row_facet_att is None)) or (
             self.reference_data is None
         ):
+            self.facet_index = None
             return
 
-        self.data_facet_masks = []
-        self.data_facet_subsets = []
-        # We create both a simple mask and a subset representing the facet.
-        # This is redundant, but the Density mode really wants a subset
-        # and the regular/point mode wants a precomputed mask
-        # TODO: Remove this redundancy
         try:
-            col_facet_masks = []
-            col_facet_subsets = []
-            if self.col_facet_att is not None:
-                for col_i in range(self.temp_num_cols):
-                    col_facet = self.reference_data[self.col_facet_att].categories[
-                        col_i
-                    ]
-                    col_facet_data = self.reference_data[self.col_facet_att].ravel()
-                    col_facet_mask = np.ma.masked_where(
-                        col_facet_data != col_facet, col_facet_data
-                    )
-                    facet_state = (
-                        self.reference_data.id[self.col_facet_att] == col_facet
-                    )
-                    subset = FacetSubset(
-                        self.reference_data,
-                        label=f"{self.col_facet_att.label}={col_facet}",
-                    )
-                    subset.subset_state = facet_state
-                    col_facet_subsets.append(subset)
-                    col_facet_masks.append(col_facet_mask)
-            else:
-                col_facet_masks = [
-                    np.ma.masked_where(
-                        False, self.reference_data[self.row_facet_att].ravel()
-                    )
-                ]
-                facet_state = (
-                    self.reference_data.id[self.row_facet_att] != "***"
-                )  # FIXME -- this is a hack to get the full subset
-                subset = FacetSubset(self.reference_data, label=" ")
-                subset.subset_state = facet_state
-                col_facet_subsets.append(subset)
-
-            row_facet_masks = []
-            row_facet_subsets = []
-            if self.row_facet_att is not None:
-                row_facet_masks = []
-                for row_i in range(self.temp_num_rows):
-                    row_facet = self.reference_data[self.row_facet_att].categories[
-                        row_i
-                    ]
-                    row_facet_data = self.reference_data[self.row_facet_att].ravel()
-                    row_facet_mask = np.ma.masked_where(
-                        row_facet_data != row_facet, row_facet_data
-                    )
-                    facet_state = (
-                        self.reference_data.id[self.row_facet_att] == row_facet
-                    )
-                    subset = FacetSubset(
-                        self.reference_data,
-                        label=f"{self.row_facet_att.label}={row_facet}",
-                    )
-                    subset.subset_state = facet_state
-                    row_facet_subsets.append(subset)
-                    row_facet_masks.append(row_facet_mask)
-            else:
-                row_facet_masks = [
-                    np.ma.masked_where(
-                        False, self.reference_data[self.col_facet_att].ravel()
-                    )
-                ]
-                facet_state = (
-                    self.reference_data.id[self.col_facet_att] != "***"
-                )  # FIXME -- this is a hack to get the full subset
-                subset = FacetSubset(self.reference_data, label=" ")
-                subset.subset_state = facet_state
-                row_facet_subsets.append(subset)
-
-            for row_facet_subset in row_facet_subsets:
-                col = []
-                for col_facet_subset in col_facet_subsets:
-                    facet_subset_state = (
-                        row_facet_subset.subset_state & col_facet_subset.subset_state
-                    )
-                    col.append(facet_subset_state)
-                self.data_facet_subsets.append(col)
-
-            for row_facet_mask in row_facet_masks:
-                col = []
-                for col_facet_mask in col_facet_masks:
-                    facet_mask = row_facet_mask.mask | col_facet_mask.mask
-                    col.append(facet_mask)
-                self.data_facet_masks.append(col)
-
-        except IndexError:
-            pass
+            col_binning = self._facet_binning("col")
+            row_binning = self._facet_binning("row")
+            col_order = self._facet_order("col")
+            row_order = self._facet_order("row")
+        except (IncompatibleAttribute, ValueError):
+            self.facet_index = None
+            return
+        options = (col_binning, row_binning, col_order, row_order)
+
+        # ComponentID overloads ==, so we need to compare by identity here
+        key = (self.reference_data, self.col_facet_att, self.row_facet_att)
+        if (
+            self.facet_index is not None
+            and all(new is old for new, old in zip(key, self._facet_index_key))
+            and options == self._facet_options_key
+        ):
+            return
+
+        try:
+            with instrumentation.phase("facet_index", points=self.reference_data.size):
+                self.facet_index = FacetIndex(
+                    self.reference_data,
+                    col_att=self.col_facet_att,
+                    row_att=self.row_facet_att,
+                    col_binning=col_binning,
+                    row_binning=row_binning,
+                    col_order=col_order,
+                    row_order=row_order,
+                )
+        except (IncompatibleAttribute, ValueError):
+            self.facet_index = None
+            return
+        self._facet_index_key = key
+        self._facet_options_key = options
+        self._update_categories()
+
+    def _facet_binning(self, axis):
+        """
+        The binning for the column or row facet attribute, or `None` if the
+        attribute is not numeric.
+        """
+        att = getattr(self, f"{axis}_facet_att")
+        if att is None or self.reference_data.get_kind(att) == "categorical":
+            return None
+        mode = getattr(self, f"{axis}_bin_mode")
+        edges = None
+        if mode == "edges":
+            edges = [
+                edge.strip()
+                for edge in getattr(self, f"{axis}_bin_edges").split(",")
+                if edge.strip()
+            ]
+            if len(edges) < 2:
+                raise ValueError("at least two bin edges are needed")
+        return FacetBinning(
+            mode=mode, num_bins=getattr(self, f"{axis}_num_bins"), edges=edges
+        )
+
+    def _facet_order(self, axis):
+        """
+        The ordering of the column or row facets.
+        """
+        mode = getattr(self, f"{axis}_order") or "default"
+        if mode == "statistic" and self.order_att is None:
+            raise ValueError("an attribute is needed to order facets by a statistic")
+        top_k = getattr(self, f"{axis}_top_k")
+        return FacetOrder(
+            mode=mode,
+            att=self.order_att if mode == "statistic" else None,
+            statistic=self.order_statistic or "mean",
+            top_k=int(top_k) if top_k and top_k > 0 else None,
+        )
+
+    @instrumentation.timed("facets_changed")
+    def _facets_changed(self, *args):
+        self._update_facet_index()
+        if self.facet_index is None:
+            return
+
+        # We expose both a mask and a subset state representing each facet,
+        # both derived from the facet index. The masks are only computed when
+        # accessed, so they don't take up memory for every panel.
+        self._facet_offsets = (self.facet_row_offset, self.facet_col_offset)
+        self.data_facet_masks = FacetMaskGrid(
+            self.facet_index,
+            self.temp_num_rows,
+            self.temp_num_cols,
+            row_offset=self._facet_offsets[0],
+            col_offset=self._facet_offsets[1],
+        )
+        self.data_facet_subsets = [
+            [
+                self.facet_index.subset_state(*self.facet_cell(row, col))
+                for col in range(self.temp_num_cols)
+            ]
+            for row in range(self.temp_num_rows)
+        ]
 
     def _layers_changed(self, *args):
         """
@@ -243,35 +619,45 @@ class SmallMultiplesViewerState(ScatterViewerState):
         self.y_att_helper.set_multiple_data(layers_data)
         self.col_facet_att_helper.set_multiple_data(layers_data)
         self.row_facet_att_helper.set_multiple_data(layers_data)
+        self.order_att_helper.set_multiple_data(layers_data)
 
         self._layers_data_cache = layers_data
 
 
+DEFAULT_DENSITY_THRESHOLD = 100000
+
+
 class FacetScatterLayerState(ScatterLayerState):
     """A simple superclass for the Facet subsets
     to add titles on the axes and custom density
     map logic.
+
+    In the ``'auto'`` points mode, each facet shows a density map if it has
+    more than ``density_threshold`` points, and markers otherwise.
     """
 
+    facet_count = DDCProperty(0, docstring="The number of points in this facet")
+    density_threshold = DDCProperty(
+        DEFAULT_DENSITY_THRESHOLD,
+        docstring="The number of points above which a facet is shown as a "
+        "density map in the auto points mode",
+    )
+
     def __init__(self, viewer_state=None, layer=None, **kwargs):
         super().__init__(viewer_state=viewer_state, layer=layer)
         # self.update_from_dict(kwargs)
+        self.add_callback("facet_count", self._update_density_map_mode)
+        self.add_callback("density_threshold", self._update_density_map_mode)
+
+    def _update_density_map_mode(self, *args):
+        if self.points_mode == "auto":
+            self.density_map = self.facet_count > self.density_threshold
+        else:
+            super()._update_density_map_mode()
 
     def _update_title(self):
         # TODO: title should be a callback property?
-        try:
-            self.title = self.facet_subset.label
-        except AttributeError:  # This is for an AndState
-            state1 = str(self.facet_subset.state1).strip("()").replace("==", "=")
-            if "***" in state1:  # FIXME: Hack for empty subset
-                state1 = None
-            state2 = str(self.facet_subset.state2).strip("()").replace("==", "=")
-            if "***" in state2:  # FIXME: Hack for empty subset
-                state2 = None
-            if state1 and state2:
-                self.title = f"{state1} and {state2}"
-            else:
-                self.title = state1 or state2
+        self.title = self.facet_label
 
     def compute_density_map(self, bins=None, range=None):
         if not self.markers_visible or not self.density_map:
@@ -324,8 +710,63 @@ def strip_out_facet_subset_states(rec):
 
 class SmallMultiplesLayerState(ScatterLayerState):
     """
-    Currently this is the same as ScatterLayerState
+    A ScatterLayerState with extra options that apply to all the facets
     """
 
+    cmap_statistic = DDSCProperty(
+        docstring="The statistic of the color attribute to show in each "
+        "pixel of a density map"
+    )
+    density_threshold = DDCProperty(
+        DEFAULT_DENSITY_THRESHOLD,
+        docstring="The number of points above which a facet is shown as a "
+        "density map in the auto points mode",
+    )
+    density_normalization = DDSCProperty(
+        docstring="Whether the color scale of density maps is set for each "
+        "facet or shared by all facets"
+    )
+    cmap_normalization = DDSCProperty(
+        docstring="Whether the colormap limits are shared by all facets or "
+        "computed from the values in each facet"
+    )
+    cmap_facet_percentile = DDSCProperty(
+        docstring="The percentile of the values in each facet used as its "
+        "colormap limits, when they are computed for each facet"
+    )
+
     def __init__(self, viewer_state=None, layer=None, **kwargs):
+        SmallMultiplesLayerState.cmap_statistic.set_choices(self, STATISTICS)
+        SmallMultiplesLayerState.cmap_statistic.set_display_func(
+            self, STATISTICS_DISPLAY.get
+        )
+        SmallMultiplesLayerState.density_normalization.set_display_func(
+            self, DENSITY_NORMALIZATIONS_DISPLAY.get
+        )
+        SmallMultiplesLayerState.density_normalization.set_choices(
+            self, DENSITY_NORMALIZATIONS
+        )
+        SmallMultiplesLayerState.cmap_normalization.set_display_func(
+            self, CMAP_NORMALIZATIONS_DISPLAY.get
+        )
+        SmallMultiplesLayerState.cmap_normalization.set_choices(
+            self, CMAP_NORMALIZATIONS
+        )
+        SmallMultiplesLayerState.cmap_facet_percentile.set_display_func(
+            self, CMAP_PERCENTILES_DISPLAY.get
+        )
+        SmallMultiplesLayerState.cmap_facet_percentile.set_choices(
+            self, CMAP_PERCENTILES
+        )
         super().__init__(viewer_state=viewer_state, layer=layer, **kwargs)
+        self.add_callback("density_threshold", self._update_density_map_mode)
+
+    def _update_density_map_mode(self, *args):
+        # In the auto mode every facet chooses for itself, so this layer uses
+        # a density map if its largest possible facet would.
+        if self.points_mode == "auto":
+            self.density_map = bool(
+                self.layer is not None and self.layer.size > self.density_threshold
+            )
+        else:
+            super()._update_density_map_mode()
@@ -0,0 +1,104 @@
+import numpy as np
+
+from glue.core import Data, DataCollection
+
+from glue_small_multiples.cache import LRUCache, LayerCache, SharedDataCache
+
+
+def test_lru_cache():
+    cache = LRUCache(max_bytes=3 * 80)
+    for key in "abc":
+        cache[key] = np.zeros(10)
+    assert cache.nbytes == 240
+
+    # Using 'a' makes 'b' the least recently used entry
+    assert cache.get("a") is not None
+    cache["d"] = np.zeros(10)
+    assert "b" not in cache
+    assert set(cache._entries) == {"a", "c", "d"}
+
+    assert cache.get("b") is None
+    assert cache.info() == {
+        "hits": 1,
+        "misses": 1,
+        "entries": 3,
+        "nbytes": 240,
+        "max_bytes": 240,
+    }
+
+    # Values larger than the budget are not stored
+    cache["e"] = np.zeros(100)
+    assert "e" not in cache
+    assert len(cache) == 3
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_lru_cache_lists():
+    # The size of a list of arrays is the total size of the arrays
+    cache = LRUCache(max_bytes=150)
+    cache["a"] = [np.zeros(10), np.zeros(5)]
+    assert cache.nbytes == 120
+    cache["b"] = (np.zeros(10),)
+    assert "a" not in cache
+    assert cache.nbytes == 80
+
+
+class TestLayerCache(object):
+    def setup_method(self, method):
+        self.data = Data(x=[1, 2, 3, 4], label="data")
+        self.data_collection = DataCollection([self.data])
+        self.subset = self.data.new_subset(label="subset")
+        self.subset.subset_state = self.data.id["x"] > 2
+
+    def test_data(self):
+        cache = LayerCache(self.data)
+        cache.register_to_hub(self.data.hub)
+        cache["a"] = np.zeros(3)
+
+        self.subset.subset_state = self.data.id["x"] > 1
+        assert cache.version == 0
+        assert "a" in cache
+
+        self.data.update_components({self.data.id["x"]: [4, 3, 2, 1]})
+        assert cache.version == 1
+        assert "a" not in cache
+
+    def test_subset(self):
+        cache = LayerCache(self.subset)
+        cache.register_to_hub(self.data.hub)
+        cache["a"] = np.zeros(3)
+
+        self.subset.style.color = "red"
+        assert cache.version == 0
+        assert "a" in cache
+
+        self.subset.subset_state = self.data.id["x"] > 1
+        assert cache.version == 1
+        assert "a" not in cache
+
+        cache.unregister(self.data.hub)
+        self.subset.subset_state = self.data.id["x"] > 3
+        assert cache.version == 1
+
+    def test_shared_data(self):
+        cache = SharedDataCache.acquire(self.data)
+        assert SharedDataCache.acquire(self.data) is cache
+        assert cache.users == 2
+        cache["a"] = np.zeros(3)
+
+        cache.release()
+        self.data.update_components({self.data.id["x"]: [4, 3, 2, 1]})
+        assert cache.version == 1
+        assert "a" not in cache
+
+        # Once the last user is gone, the cache stops listening to the hub and
+        # a new one is created for the next user
+        cache["a"] = np.zeros(3)
+        cache.release()
+        assert len(cache) == 0
+        self.data.update_components({self.data.id["x"]: [1, 2, 3, 4]})
+        assert cache.version == 1
+        assert SharedDataCache.acquire(self.data) is not cache
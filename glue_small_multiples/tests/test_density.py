@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from glue.utils import compute_histogram
+
+from glue_small_multiples.density import (
+    compute_facet_aggregate,
+    compute_facet_histogram,
+)
+
+
+def test_compute_facet_histogram():
+    rng = np.random.default_rng(12345)
+    x = rng.normal(size=1000)
+    y = rng.uniform(0.1, 10, size=1000)
+    w = rng.uniform(size=1000)
+    x[::50] = np.nan
+    slots = rng.integers(0, 3, size=1000)
+
+    histogram_range = ((0.5, 9.0), (-2, 2.5))
+    bins = (7, 5)
+    for weights in (None, w):
+        for log in ((False, False), (True, False)):
+            facets = compute_facet_histogram(
+                [y, x], slots, 3, histogram_range, bins, weights=weights, log=log
+            )
+            assert facets.shape == (3, 7, 5)
+            for slot in range(3):
+                keep = slots == slot
+                expected = compute_histogram(
+                    [y[keep], x[keep]],
+                    range=histogram_range,
+                    bins=bins,
+                    weights=None if weights is None else weights[keep],
+                    log=log,
+                )
+                assert_allclose(facets[slot], expected)
+
+
+def test_compute_facet_histogram_negative_log():
+    x = np.array([1.0, 2.0])
+    facets = compute_facet_histogram(
+        [x, x], np.array([0, 1]), 2, ((-1, 3), (0, 3)), (4, 4), log=(True, False)
+    )
+    assert_allclose(facets, 0)
+
+
+@pytest.mark.parametrize("statistic", ["mean", "min", "max", "median"])
+def test_compute_facet_aggregate(statistic):
+    rng = np.random.default_rng(12345)
+    x = rng.uniform(size=500)
+    y = rng.uniform(size=500)
+    values = rng.normal(size=500)
+    slots = rng.integers(0, 2, size=500)
+    if statistic != "mean":
+        values[::7] = np.nan
+
+    histogram_range = ((0, 1), (0, 1))
+    bins = (4, 3)
+    count, aggregate = compute_facet_aggregate(
+        [y, x], slots, 2, histogram_range, bins, values, statistic=statistic
+    )
+    assert_allclose(
+        count, compute_facet_histogram([y, x], slots, 2, histogram_range, bins)
+    )
+
+    iy = np.minimum((y * 4).astype(int), 3)
+    ix = np.minimum((x * 3).astype(int), 2)
+    func = {"mean": np.mean, "min": np.min, "max": np.max, "median": np.median}
+    for slot in range(2):
+        for j in range(4):
+            for i in range(3):
+                keep = (slots == slot) & (iy == j) & (ix == i)
+                selected = values[keep]
+                selected = selected[~np.isnan(selected)]
+                if len(selected) == 0:
+                    assert np.isnan(aggregate[slot, j, i])
+                else:
+                    assert_allclose(aggregate[slot, j, i], func[statistic](selected))
+
+
+def test_compute_facet_aggregate_empty_bins():
+    x = np.array([0.1, 0.2])
+    count, aggregate = compute_facet_aggregate(
+        [x, x], np.array([0, 0]), 2, ((0, 1), (0, 1)), (2, 2), np.array([1.0, 3.0])
+    )
+    assert_allclose(count[0, 0, 0], 2)
+    assert_allclose(aggregate[0, 0, 0], 2)
+    assert np.isnan(aggregate[1]).all()
+
+
+def test_compute_facet_aggregate_invalid_statistic():
+    x = np.array([0.1, 0.2])
+    with pytest.raises(ValueError, match="statistic should be one of"):
+        compute_facet_aggregate(
+            [x, x], np.array([0, 0]), 1, ((0, 1), (0, 1)), (2, 2), x, statistic="sum"
+        )
@@ -0,0 +1,228 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_equal
+
+from glue.core import Data
+
+from glue_small_multiples.facets import FacetBinning, FacetIndex, FacetMaskGrid, FacetOrder
+
+
+class TestFacetIndex(object):
+    def setup_method(self, method):
+        self.data = Data(
+            label="d1",
+            x=[13.4, 2.3, 20.1, 8.6, 1.1, 4.5],
+            a=["a", "b", "a", "c", "b", "a"],
+            b=["x", "y", "y", "x", "x", "y"],
+        )
+
+    def test_single_attribute(self):
+        index = FacetIndex(self.data, col_att=self.data.id["a"])
+        assert index.num_rows == 1
+        assert index.num_cols == 3
+        assert_equal(index.counts, [3, 2, 1])
+        assert_equal(index.offsets, [0, 3, 5, 6])
+        assert_equal(index.indices(0, 0), [0, 2, 5])
+        assert_equal(index.indices(0, 1), [1, 4])
+        assert_equal(index.mask(0, 2), [0, 0, 0, 1, 0, 0])
+        assert index.label(0, 1) == "a = b"
+
+    def test_two_attributes(self):
+        index = FacetIndex(
+            self.data, col_att=self.data.id["a"], row_att=self.data.id["b"]
+        )
+        assert index.num_rows == 2
+        assert index.num_cols == 3
+        assert_equal(index.counts, [1, 1, 1, 2, 1, 0])
+        assert_equal(index.indices(1, 0), [2, 5])
+        assert index.count(1, 2) == 0
+        assert len(index.indices(1, 2)) == 0
+        assert index.label(1, 0) == "b = y and a = a"
+
+        mask = self.data.get_mask(index.subset_state(1, 0))
+        assert_equal(mask, index.mask(1, 0))
+
+    def test_missing_categories(self):
+        data = Data(a=np.array(["a", np.nan, "b", "a"], dtype=object))
+        index = FacetIndex(data, col_att=data.id["a"])
+        assert_equal(index.counts, [2, 1])
+        assert_equal(np.sort(index.order[: index.offsets[-1]]), [0, 2, 3])
+
+    def test_compact_storage(self):
+        index = FacetIndex(
+            self.data, col_att=self.data.id["a"], row_att=self.data.id["b"]
+        )
+        assert index.panel_codes.dtype == np.uint8
+        assert index.order.dtype == np.uint32
+
+        data = Data(a=np.char.add("c", np.arange(1000).astype(str)))
+        index = FacetIndex(data, col_att=data.id["a"])
+        assert index.panel_codes.dtype == np.uint16
+        assert_equal(index.counts, 1)
+
+    def test_numeric_equal_bins(self):
+        index = FacetIndex(
+            self.data,
+            col_att=self.data.id["x"],
+            col_binning=FacetBinning(mode="equal", num_bins=2),
+        )
+        assert_allclose(index.col_edges, [1.1, 10.6, 20.1])
+        assert index.col_categories == ["[1.1, 10.6)", "[10.6, 20.1]"]
+        assert_equal(index.counts, [4, 2])
+        assert_equal(index.indices(0, 1), [0, 2])
+        assert index.label(0, 1) == "10.6 <= x <= 20.1"
+        for col in range(2):
+            mask = self.data.get_mask(index.subset_state(0, col))
+            assert_equal(mask, index.mask(0, col))
+
+    def test_numeric_default_bins(self):
+        index = FacetIndex(self.data, col_att=self.data.id["x"], row_att=self.data.id["a"])
+        assert index.num_cols == 5
+        assert index.num_rows == 3
+        assert index.counts.sum() == 6
+
+    def test_numeric_edges(self):
+        data = Data(x=[0.5, 1, 2, 3, np.nan, 10, 2.5])
+        binning = FacetBinning(mode="edges", edges=["1", "2", "3"])
+        index = FacetIndex(data, col_att=data.id["x"], col_binning=binning)
+        # Values outside the edges and NaN values are not in any bin
+        assert_equal(index.counts, [1, 3])
+        assert_equal(index.indices(0, 1), [2, 3, 6])
+        for col in range(2):
+            assert_equal(data.get_mask(index.subset_state(0, col)), index.mask(0, col))
+
+        with pytest.raises(ValueError, match="increasing"):
+            FacetIndex(
+                data,
+                col_att=data.id["x"],
+                col_binning=FacetBinning(mode="edges", edges=[2, 1]),
+            )
+
+    def test_numeric_quantile_bins(self):
+        rng = np.random.default_rng(1)
+        data = Data(x=rng.exponential(size=10000))
+        binning = FacetBinning(mode="quantile", num_bins=4, sample_size=2000)
+        index = FacetIndex(data, col_att=data.id["x"], col_binning=binning)
+        assert index.num_cols == 4
+        assert index.counts.sum() == 10000
+        # The quantiles are estimated from a sample, so the counts are only
+        # roughly equal, but the outer edges are the extremes of the data.
+        assert_allclose(index.counts, 2500, rtol=0.1)
+        assert index.col_edges[0] == data["x"].min()
+        assert index.col_edges[-1] == data["x"].max()
+
+    def test_datetime_bins(self):
+        times = np.array(
+            ["2020-01-01", "2020-01-05", "NaT", "2020-01-10", "2020-01-03"],
+            dtype="datetime64[ns]",
+        )
+        data = Data(t=times)
+        index = FacetIndex(
+            data, col_att=data.id["t"], col_binning=FacetBinning(num_bins=3)
+        )
+        assert index.col_edges.dtype == times.dtype
+        assert index.col_edges[0] == times[0]
+        assert index.col_edges[-1] == times[3]
+        assert_equal(index.counts, [2, 1, 1])
+        for col in range(3):
+            assert_equal(data.get_mask(index.subset_state(0, col)), index.mask(0, col))
+
+    def test_order_by_count(self):
+        index = FacetIndex(
+            self.data,
+            col_att=self.data.id["a"],
+            col_order=FacetOrder(mode="count"),
+            row_att=self.data.id["b"],
+            row_order=FacetOrder(mode="alphabetical"),
+        )
+        assert index.col_categories == ["a", "b", "c"]
+        index = FacetIndex(
+            self.data, col_att=self.data.id["b"], col_order=FacetOrder(mode="count")
+        )
+        assert index.col_categories == ["x", "y"]
+        assert_equal(index.counts, [3, 3])
+
+        data = Data(a=["c", "b", "b", "a", "b", "c"])
+        index = FacetIndex(data, col_att=data.id["a"], col_order=FacetOrder(mode="count"))
+        assert index.col_categories == ["b", "c", "a"]
+        assert_equal(index.counts, [3, 2, 1])
+        assert_equal(index.indices(0, 1), [0, 5])
+        for col in range(3):
+            assert_equal(data.get_mask(index.subset_state(0, col)), index.mask(0, col))
+
+    def test_order_by_statistic(self):
+        order = FacetOrder(mode="statistic", att=self.data.id["x"], statistic="max")
+        index = FacetIndex(self.data, col_att=self.data.id["a"], col_order=order)
+        assert index.col_categories == ["a", "c", "b"]
+        order = FacetOrder(mode="statistic", att=self.data.id["x"], statistic="mean")
+        index = FacetIndex(self.data, col_att=self.data.id["a"], col_order=order)
+        assert index.col_categories == ["a", "c", "b"]
+        assert_equal(index.indices(0, 1), [3])
+        with pytest.raises(ValueError, match="att is needed"):
+            FacetOrder(mode="statistic")
+
+    def test_top_k(self):
+        order = FacetOrder(mode="count", top_k=1)
+        index = FacetIndex(self.data, col_att=self.data.id["a"], col_order=order)
+        assert index.col_categories == ["a", "Other"]
+        assert_equal(index.counts, [3, 3])
+        assert_equal(index.indices(0, 1), [1, 3, 4])
+        assert index.label(0, 1) == "a = Other"
+        assert_equal(self.data.get_mask(index.subset_state(0, 1)), index.mask(0, 1))
+
+        # The other bins of a numeric attribute are grouped in the same way
+        index = FacetIndex(
+            self.data,
+            col_att=self.data.id["x"],
+            col_binning=FacetBinning(mode="edges", edges=[0, 5, 10, 25]),
+            col_order=FacetOrder(top_k=1),
+        )
+        assert_equal(index.counts, [3, 3])
+        assert_equal(self.data.get_mask(index.subset_state(0, 1)), index.mask(0, 1))
+        assert index.key(0, 1) != index.key(0, 0)
+
+    def test_order_many_categories(self):
+        rng = np.random.default_rng(0)
+        codes = rng.integers(0, 1000, size=50000)
+        data = Data(a=np.array([f"c{code:04d}" for code in codes]))
+        order = FacetOrder(mode="count", top_k=10)
+        index = FacetIndex(data, col_att=data.id["a"], col_order=order)
+        assert index.num_cols == 11
+        counts = np.sort(np.bincount(codes))[::-1]
+        assert_equal(index.counts[:10], counts[:10])
+        assert index.counts[10] == counts[10:].sum()
+
+    def test_limits(self):
+        rng = np.random.default_rng(0)
+        codes = rng.integers(0, 4, size=1000)
+        values = rng.normal(size=1000)
+        values[::7] = np.nan
+        data = Data(a=np.array(["p", "q", "r", "s"])[codes], x=values)
+        index = FacetIndex(data, col_att=data.id["a"])
+        mask = rng.random(1000) > 0.3
+        # The last panel has no values at all
+        mask[codes == 3] = False
+
+        for percentile in (100, 90):
+            lower, upper = index.limits(values, percentile=percentile, mask=mask)
+            for col in range(3):
+                panel = values[(codes == col) & mask]
+                assert_allclose(
+                    [lower[col], upper[col]],
+                    np.nanpercentile(panel, [50 - percentile / 2, 50 + percentile / 2]),
+                )
+            assert np.isnan(lower[3]) and np.isnan(upper[3])
+
+
+def test_facet_mask_grid():
+    data = Data(a=["a", "b", "a", "c"], b=["x", "y", "y", "x"])
+    index = FacetIndex(data, col_att=data.id["a"], row_att=data.id["b"])
+    grid = FacetMaskGrid(index, 2, 2)
+    assert len(grid) == 2
+    assert len(grid[1]) == 2
+    assert_equal(grid[1][0], [1, 1, 0, 1])
+    assert [len(row) for row in grid] == [2, 2]
+
+    grid = FacetMaskGrid(index, 1, 2, row_offset=1, col_offset=1)
+    assert_equal(grid[0][0], [1, 0, 1, 1])
+    assert_equal(grid[0][1], [1, 1, 1, 1])
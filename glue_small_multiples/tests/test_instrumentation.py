@@ -0,0 +1,117 @@
+import json
+import logging
+import threading
+
+import pytest
+
+from glue_small_multiples import instrumentation
+from glue_small_multiples.instrumentation import count, phase, recording, timed
+
+
+def test_disabled():
+    assert not instrumentation.is_enabled()
+    assert instrumentation.get_recorder() is None
+    # Nothing is recorded, and the same no-op phase is always returned
+    with phase("a", points=10) as p:
+        p.add_points(5)
+    assert phase("b") is p
+    count("c")
+
+
+def test_phases_and_counters():
+    @timed("work")
+    def work(x):
+        return x * 2
+
+    with recording() as recorder:
+        assert instrumentation.is_enabled()
+        assert work(3) == 6
+        assert work(4) == 8
+        with phase("select", points=10) as p:
+            p.add_points(5)
+        count("hits")
+        count("hits", 2)
+    assert not instrumentation.is_enabled()
+
+    assert recorder.phases == ["select", "work"]
+    stats = recorder.phase_stats("work")
+    assert stats["calls"] == 2
+    assert stats["max"] <= stats["total"]
+    assert stats["mean"] == pytest.approx(stats["total"] / 2)
+    assert recorder.phase_stats("select")["points"] == 15
+    assert recorder.phase_stats("missing") == {
+        "calls": 0, "total": 0.0, "max": 0.0, "points": 0, "mean": 0.0
+    }
+    assert recorder.counter("hits") == 3
+    assert recorder.counters == {"hits": 3}
+    assert json.loads(json.dumps(recorder.summary()))["counters"] == {"hits": 3}
+
+    recorder.reset()
+    assert recorder.phases == [] and recorder.counters == {}
+
+
+def test_phase_records_on_error():
+    with recording() as recorder:
+        with pytest.raises(ValueError):
+            with phase("fail"):
+                raise ValueError()
+    assert recorder.phase_stats("fail")["calls"] == 1
+
+
+def test_recording_nested():
+    with recording() as outer:
+        with recording() as inner:
+            count("a")
+        count("b")
+    assert inner.counters == {"a": 1}
+    assert outer.counters == {"b": 1}
+
+
+def test_threads():
+    with recording() as recorder:
+        threads = [
+            threading.Thread(target=lambda: [count("n") for _ in range(1000)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert recorder.counter("n") == 4000
+
+
+def test_export_trace(tmp_path):
+    with recording(trace=True, max_events=3) as recorder:
+        for _ in range(3):
+            with phase("outer", points=2):
+                with phase("inner"):
+                    pass
+        count("draws")
+
+    events = recorder.events()
+    # Only the most recent events are kept
+    assert len(events) == 3
+    assert events[-1]["ph"] == "C" and events[-1]["args"] == {"draws": 1}
+    assert events[-2]["name"] == "outer" and events[-2]["args"] == {"points": 2}
+    assert recorder.phase_stats("inner")["calls"] == 3
+
+    filename = tmp_path / "trace.json"
+    recorder.export_trace(filename)
+    with open(filename) as f:
+        trace = json.load(f)
+    assert trace["traceEvents"] == events
+    assert trace["otherData"]["phases"]["outer"]["calls"] == 3
+
+    with recording() as recorder:
+        pass
+    with pytest.raises(ValueError, match="trace=True"):
+        recorder.export_trace(filename)
+
+
+def test_log(caplog):
+    with caplog.at_level(logging.DEBUG, logger="glue_small_multiples.instrumentation"):
+        with recording(log=True):
+            with phase("logged", points=7):
+                pass
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["phase"] == "logged" and record["points"] == 7
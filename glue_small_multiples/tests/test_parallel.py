@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+from glue_small_multiples.parallel import map_facets, split_chunks
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_map_facets(num_workers):
+    threads = set()
+
+    def square(x):
+        threads.add(threading.current_thread())
+        return x**2
+
+    assert map_facets(square, range(20), num_workers=num_workers) == [
+        x**2 for x in range(20)
+    ]
+    if num_workers == 1:
+        assert threads == {threading.current_thread()}
+
+
+def test_map_facets_error():
+    def fail(x):
+        raise ValueError(f"bad facet {x}")
+
+    with pytest.raises(ValueError, match="bad facet 0"):
+        map_facets(fail, range(3), num_workers=2)
+
+
+def test_split_chunks():
+    assert split_chunks(range(7), 3) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert split_chunks(range(2), 4) == [[0], [1]]
+    assert split_chunks([], 4) == [[]]
+    assert sum(split_chunks(range(10), 1), []) == list(range(10))
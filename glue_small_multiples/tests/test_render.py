@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from glue_small_multiples.render import (
+    HeadlessSmallMultiplesViewer,
+    main,
+    render,
+    render_batch,
+)
+
+PENGUINS = os.path.join(
+    os.path.dirname(__file__), os.pardir, "qt", "tests", "data", "penguins.csv"
+)
+OPTIONS = dict(
+    x_att="bill_length_mm", y_att="bill_depth_mm", col_facet_att="species"
+)
+MAGIC = {"png": b"\x89PNG", "svg": b"<?xml", "pdf": b"%PDF"}
+
+
+@pytest.mark.parametrize("format", ["png", "svg", "pdf"])
+def test_render(tmp_path, format):
+    output = str(tmp_path / f"penguins.{format}")
+    assert render(PENGUINS, output, **OPTIONS) == [output]
+    with open(output, "rb") as f:
+        assert f.read().startswith(MAGIC[format])
+
+
+def test_render_invalid_format(tmp_path):
+    with pytest.raises(ValueError, match="Unsupported format 'jpg'"):
+        render(PENGUINS, str(tmp_path / "penguins.jpg"), **OPTIONS)
+
+
+def test_headless_viewer():
+    from glue.core.session import Session
+    from glue.core.data_factories import load_data
+
+    session = Session()
+    data = load_data(PENGUINS)
+    session.data_collection.append(data)
+    viewer = HeadlessSmallMultiplesViewer(session, figsize=(6, 4), dpi=50)
+    viewer.register_to_hub(session.hub)
+    viewer.add_data(data)
+    viewer.state.col_facet_att = data.id["species"]
+    viewer.state.row_facet_att = data.id["sex"]
+
+    assert viewer.axes_array.shape == (viewer.state.num_rows, 3)
+    assert len(viewer.layers[0].scatter_layer_artists) == viewer.axes_array.size
+    assert tuple(viewer.figure.get_size_inches()) == (6, 4)
+
+
+def test_render_batch(tmp_path):
+    jobs = [
+        dict(input=PENGUINS, output=str(tmp_path / "a.png"), **OPTIONS),
+        dict(input=str(tmp_path / "missing.csv"), output=str(tmp_path / "b.png")),
+        dict(input=PENGUINS, output=str(tmp_path / "c.svg"), **OPTIONS),
+    ]
+    results = render_batch(jobs, processes=2, max_memory=2**34, maxtasksperchild=1)
+    assert results[0] == ([jobs[0]["output"]], None)
+    assert results[1][0] == [] and "missing.csv" in results[1][1]
+    assert results[2] == ([jobs[2]["output"]], None)
+    assert os.path.exists(jobs[0]["output"]) and os.path.exists(jobs[2]["output"])
+
+
+def test_main(tmp_path, capsys):
+    argv = [PENGUINS, "-d", str(tmp_path), "-f", "svg", "-x", "bill_length_mm",
+            "-y", "bill_depth_mm", "--col", "island", "--size", "4", "3"]
+    assert main(argv) == 0
+    output = str(tmp_path / "penguins.svg")
+    assert capsys.readouterr().out.split() == [output]
+    assert os.path.exists(output)
+
+    assert main([str(tmp_path / "missing.csv"), "-o", str(tmp_path / "m.png")]) == 1
+    assert "missing.csv" in capsys.readouterr().err
+
+    with pytest.raises(SystemExit):
+        main([PENGUINS, PENGUINS, "-o", str(tmp_path / "x.png")])
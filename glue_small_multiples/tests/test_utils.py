@@ -0,0 +1,29 @@
+import numpy as np
+
+from matplotlib.figure import Figure
+
+from glue_small_multiples.utils import PanelLocator
+
+
+def test_panel_locator():
+    figure = Figure(figsize=(6, 4), dpi=100)
+    axes_array = np.array(figure.subplots(2, 3), dtype=object)
+    locator = PanelLocator(axes_array)
+
+    for (row, col), ax in np.ndenumerate(axes_array):
+        x, y = ax.bbox.x0 + ax.bbox.width / 2, ax.bbox.y0 + ax.bbox.height / 2
+        assert locator.panel(x, y) == (row, col)
+        assert locator.panel(ax.bbox.x0, ax.bbox.y1) == (row, col)
+
+    # Points in the gaps between the panels or outside the grid
+    left, right = axes_array[0, 0].bbox, axes_array[0, 1].bbox
+    assert locator.panel((left.x1 + right.x0) / 2, left.y0 + 1) is None
+    top, bottom = axes_array[0, 0].bbox, axes_array[1, 0].bbox
+    assert locator.panel(top.x0 + 1, (top.y0 + bottom.y1) / 2) is None
+    assert locator.panel(0, 0) is None
+    assert locator.panel(None, None) is None
+
+    # The edges are read again when the figure is resized
+    figure.set_size_inches(12, 8)
+    ax = axes_array[1, 2]
+    assert locator.panel(ax.bbox.x0 + 1, ax.bbox.y0 + 1) == (1, 2)
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class PanTrackerMixin:
     """
     Helper class that tracks drag events when using the pan/zoom mode in the matplotlib toolbar.
@@ -30,3 +33,54 @@ class PanTrackerMixin:
 
     def on_pan_end(self):
         pass
+
+
+class PanelLocator:
+    """
+    Find the panel of a grid of axes that contains a point in display
+    (pixel) coordinates.
+
+    The edges of the columns and rows are read from the axes once, and only
+    read again when the figure is resized or the grid moves within it.
+    Finding the panel under the mouse is then a lookup in these edges rather
+    than a test against every axes of the grid.
+    """
+
+    def __init__(self, axes_array):
+        self.axes_array = axes_array
+        self._key = None
+        self._edges = None
+
+    def _get_edges(self):
+        # The panels of the grid all move together, so the size of the
+        # figure and the positions of the first and last axes are enough to
+        # tell whether the edges need to be read again.
+        first, last = self.axes_array[0, 0], self.axes_array[-1, -1]
+        key = (
+            tuple(first.figure.bbox.bounds),
+            tuple(first.get_position().bounds),
+            tuple(last.get_position().bounds),
+        )
+        if key != self._key:
+            # The grid is regular, so the first row gives the column edges
+            # and the first column the row edges. Rows go from the top of
+            # the figure down, so their edges are negated to be increasing.
+            columns = np.array([ax.bbox.intervalx for ax in self.axes_array[0, :]])
+            rows = np.array([ax.bbox.intervaly for ax in self.axes_array[:, 0]])
+            self._edges = (columns[:, 0], columns[:, 1], -rows[:, 1], -rows[:, 0])
+            self._key = key
+        return self._edges
+
+    def panel(self, x, y):
+        """
+        The ``(row, col)`` of the panel containing the point ``x``, ``y``,
+        or `None` if the point is outside all the panels.
+        """
+        if x is None or y is None or self.axes_array.size == 0:
+            return None
+        left, right, top, bottom = self._get_edges()
+        col = np.searchsorted(left, x, side="right") - 1
+        row = np.searchsorted(top, -y, side="right") - 1
+        if col < 0 or row < 0 or x > right[col] or -y > bottom[row]:
+            return None
+        return int(row), int(col)
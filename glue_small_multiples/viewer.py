@@ -0,0 +1,188 @@
+import numpy as np
+
+from echo import delay_callback
+from matplotlib.artist import Artist
+
+from glue_small_multiples import instrumentation
+
+__all__ = ["SmallMultiplesViewerMixin"]
+
+
+class _DrawTimer(Artist):
+    """
+    An invisible artist recording the time spent drawing a figure as the
+    ``draw`` phase.
+
+    Matplotlib draws the whole figure at once, and it draws this artist
+    first, so the phase starts when it is drawn and ends with the
+    ``draw_event`` the figure emits once everything else has been drawn.
+    """
+
+    def __init__(self, figure):
+        super().__init__()
+        self.set_zorder(-np.inf)
+        self.set_in_layout(False)
+        self._phase = None
+        figure.add_artist(self)
+        figure.canvas.mpl_connect("draw_event", self._draw_done)
+
+    def draw(self, renderer):
+        if instrumentation.is_enabled():
+            self._phase = instrumentation.phase("draw")
+            self._phase.__enter__()
+
+    def _draw_done(self, event):
+        if self._phase is not None:
+            self._phase.__exit__(None, None, None)
+            self._phase = None
+
+
+class SmallMultiplesViewerMixin(object):
+    """
+    The front-end independent part of the small multiples viewer, which
+    manages the grid of Matplotlib axes the facets are drawn in.
+
+    Classes using this mixin should set up ``self.figure`` and ``self.axes``
+    (as done by Matplotlib viewers) and then call :meth:`setup_axes_array`.
+    """
+
+    def setup_axes_array(self):
+        if self.axes is not None and self.figure is not None:
+            self.figure.delaxes(self.axes)
+        if not any(isinstance(artist, _DrawTimer) for artist in self.figure.artists):
+            _DrawTimer(self.figure)
+        self.axes_array = np.empty((0, 0), dtype=object)
+        self.axes_array = self._resize_axes_array(
+            self.state.num_rows, self.state.num_cols
+        )
+        self.axes = self.axes_array[0][0]
+        self._connect_limits_callbacks()
+
+        self.state.add_callback("num_cols", self._configure_axes_array, priority=9999)
+        self.state.add_callback("num_rows", self._configure_axes_array, priority=9999)
+
+    def _restore_axes_array(self):
+        # Called when the viewer is created from an existing state
+        self.state._set_axes_subplots(axes_subplots=self.axes_array)
+        self.state._update_num_rows_cols()  # This sets our data_facets
+        self._configure_axes_array(force=True)
+
+    def _axes_array_changed(self):
+        """
+        Hook for front-ends to update anything attached to the individual
+        axes (such as tools) after the grid has been rebuilt.
+        """
+        pass
+
+    def _configure_axes_array(self, force=False, *args):
+        with delay_callback(self.state, "num_cols", "num_cols"):
+            """
+            I took some of this code from _update_projection
+            in scatter._update_projection
+            """
+            # If the axes are the right shape we should just return
+            if (
+                self.axes_array.shape == (self.state.num_rows, self.state.num_cols)
+            ) and not force:
+                return
+
+            self.axes_array = self._resize_axes_array(
+                self.state.num_rows, self.state.num_cols
+            )
+            self.axes = self.axes_array[0][0]
+            self._axes_array_changed()
+            self.state._set_axes_subplots(axes_subplots=self.axes_array)
+            self._connect_limits_callbacks()
+            self.update_x_axislabel()
+            self.update_y_axislabel()
+            self.update_x_ticklabel()
+            self.update_y_ticklabel()
+            self.state.x_log = self.state.y_log = False
+            self.state.reset_limits()
+
+            self.limits_to_mpl()
+            self.limits_from_mpl()
+
+            # We need to update the tick marks
+            # to account for the radians/degrees switch in polar mode
+            # Also need to add/remove axis labels as necessary
+            self._update_axes()
+
+            self.figure.canvas.draw_idle()
+
+    def _resize_axes_array(self, num_rows, num_cols):
+        """
+        Lay out the axes in a ``num_rows`` x ``num_cols`` grid.
+
+        Creating Matplotlib Axes is expensive, so the axes that are still
+        part of the new grid are kept and moved to their new position, and
+        only the difference is created or removed. All axes share their x
+        and y limits with the top-left axes, which is always kept.
+        """
+        old_axes_array = self.axes_array
+        old_rows, old_cols = old_axes_array.shape
+        gridspec = self.figure.add_gridspec(num_rows, num_cols)
+
+        axes_array = np.empty((num_rows, num_cols), dtype=object)
+        for row, col in np.ndindex(num_rows, num_cols):
+            if row < old_rows and col < old_cols:
+                ax = old_axes_array[row, col]
+                ax.set_subplotspec(gridspec[row, col])
+            elif row == 0 and col == 0:
+                ax = self.figure.add_subplot(gridspec[row, col])
+            else:
+                ax = self.figure.add_subplot(
+                    gridspec[row, col],
+                    sharex=axes_array[0, 0],
+                    sharey=axes_array[0, 0],
+                )
+            axes_array[row, col] = ax
+
+        for (row, col), ax in np.ndenumerate(old_axes_array):
+            if row >= num_rows or col >= num_cols:
+                self.figure.delaxes(ax)
+
+        # Axes that moved to the edge of the grid need their tick labels back
+        for ax in axes_array.flat:
+            ax.tick_params(which="both", labelbottom=True, labelleft=True)
+            ax.label_outer()
+
+        return axes_array
+
+    def _connect_limits_callbacks(self):
+        if getattr(self, "_limits_axes", None) is self.axes:
+            return
+        self.axes.callbacks.connect("xlim_changed", self.limits_from_mpl)
+        self.axes.callbacks.connect("ylim_changed", self.limits_from_mpl)
+        self._limits_axes = self.axes
+
+    def redraw(self):
+        instrumentation.count("viewer_redraws")
+        super().redraw()
+
+    def get_layer_artist(self, cls, layer=None, layer_state=None):
+        return cls(self.axes_array, self.state, layer=layer, layer_state=layer_state)
+
+    def apply_roi(self, roi, col_axis_num=0, row_axis_num=0, override_mode=None):
+        """
+        Select the points inside ``roi`` in the facet shown in the grid at
+        ``col_axis_num`` and ``row_axis_num`` (which are the row and the
+        column of the grid respectively, as given by the ROI tools), or in
+        every facet of the grid if ``broadcast_roi`` is set in the state.
+        """
+        self.redraw()
+
+        if len(self.layers) == 0:
+            return
+
+        cells = None if self.state.broadcast_roi else [(col_axis_num, row_axis_num)]
+        subset_state = self.state.roi_subset_state(roi, cells)
+        self.apply_subset_state(subset_state, override_mode=override_mode)
+
+    def draw_legend(self, *args):
+        # Old legend logic does not work
+        pass
+
+    def _on_resize(self, *args):
+        # Neither does the aspect_ratio call
+        pass